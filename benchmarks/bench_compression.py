@@ -0,0 +1,92 @@
+"""
+Measures sending a large /submit buffer of generated INSERTs and reading back a large result, with and without gzip, over
+a local stand-in server throttled to a WAN-like bandwidth. The server reads gzip request bodies and, when asked to, sends
+gzip responses, so the two directions are measured apart.
+
+    python -m benchmarks.bench_compression [megabits per second]
+"""
+import gzip
+import json
+import sys
+import threading
+import time
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+import requests
+
+from monitor.main import State, METHOD__post
+
+DEFAULT_MEGABITS = 20
+INSERT_ROWS = 20000
+RESULT_ROWS = 20000
+REPEATS = 3
+
+
+class ThrottledHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    bytes_per_second = DEFAULT_MEGABITS * 1000000 // 8
+    compress_responses = False
+    result = json.dumps({"columns": ["id", "name", "amount"],
+                         "rows": [[idx, "account_%d" % idx, idx % 1000 + 0.25] for idx in range(RESULT_ROWS)]}).encode("UTF-8")
+
+    def log_message(self, *args):
+        pass
+
+    def _transfer(self, num_bytes: int):
+        time.sleep(num_bytes / self.bytes_per_second)
+
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        self._transfer(len(body))
+        if self.headers.get("Content-Encoding") == "gzip":
+            body = gzip.decompress(body)
+        json.loads(body)
+
+        out = ThrottledHandler.result
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        if ThrottledHandler.compress_responses and "gzip" in self.headers.get("Accept-Encoding", ""):
+            out = gzip.compress(out, compresslevel=6)
+            self.send_header("Content-Encoding", "gzip")
+        self.send_header("Content-Length", str(len(out)))
+        self.end_headers()
+        self._transfer(len(out))
+        self.wfile.write(out)
+
+
+def main():
+    megabits = float(sys.argv[1]) if len(sys.argv) > 1 else DEFAULT_MEGABITS
+    ThrottledHandler.bytes_per_second = megabits * 1000000 / 8
+    server = ThreadingHTTPServer(("127.0.0.1", 0), ThrottledHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    url = "http://127.0.0.1:%d/submit" % server.server_address[1]
+
+    send_json = {"query": "\n".join(["INSERT INTO my_table (id, label) VALUES (%d, 'a generated label %d');" % (idx, idx)
+                                     for idx in range(INSERT_ROWS)])}
+    request_bytes = len(json.dumps(send_json))
+    print("%.0f Mbit/s, request %d KB (gzip %d KB), response %d KB (gzip %d KB)" % (
+        megabits, request_bytes // 1024, len(gzip.compress(json.dumps(send_json).encode("UTF-8"))) // 1024,
+        len(ThrottledHandler.result) // 1024, len(gzip.compress(ThrottledHandler.result)) // 1024))
+    print("%20s %10s" % ("request / response", "time (ms)"))
+
+    for compress_requests, compress_responses in [(False, False), (True, False), (False, True), (True, True)]:
+        state = State()
+        state.compress_requests = compress_requests
+        ThrottledHandler.compress_responses = compress_responses
+        session = requests.Session()
+
+        timings = []
+        for _ in range(REPEATS):
+            start = time.perf_counter()
+            res = state.send_request(session, METHOD__post, url, send_json, {})
+            assert len(res.json()["rows"]) == RESULT_ROWS
+            timings.append(time.perf_counter() - start)
+
+        mode = "%s / %s" % ("gzip" if compress_requests else "plain", "gzip" if compress_responses else "plain")
+        print("%20s %10.0f" % (mode, min(timings) * 1000))
+
+    server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,45 @@
+"""
+Times deal_with_input over generated scripts of increasing size. No requests are made: every buffer is cleared with \\r, so
+the time measured is the monitor's own line handling, which should grow linearly with the number of lines.
+
+    python -m benchmarks.bench_line_cursor
+"""
+import time
+
+from monitor.main import State, ConnectionInfo, DEFAULT_CONNECTION, deal_with_input
+
+SCRIPT_SIZES = [25000, 50000, 100000, 200000]
+LINES_PER_BUFFER = 100
+
+
+def generate_script(num_lines: int) -> str:
+    lines = []
+    for idx in range(num_lines):
+        if idx % LINES_PER_BUFFER == LINES_PER_BUFFER - 1:
+            lines.append("\\r")
+        else:
+            lines.append("INSERT INTO seed_data (id, label) VALUES (%d, 'label %d');" % (idx, idx))
+    lines.append("\\r")
+    return "\n".join(lines)
+
+
+def time_script(script: str) -> float:
+    state = State()
+    state.file_name = "bench_line_cursor.sql"
+    state.connections[DEFAULT_CONNECTION] = None
+    state.connection_info[DEFAULT_CONNECTION] = ConnectionInfo("localhost:6060", "bench", "bench", None)
+
+    start = time.perf_counter()
+    deal_with_input(state, script)
+    return time.perf_counter() - start
+
+
+def main():
+    print("%10s %12s %14s" % ("lines", "seconds", "us per line"))
+    for num_lines in SCRIPT_SIZES:
+        elapsed = time_script(generate_script(num_lines))
+        print("%10d %12.3f %14.3f" % (num_lines, elapsed, elapsed * 1000000 / num_lines))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,193 @@
+"""
+Microbenchmarks for the pure Python functions the monitor runs once per statement or per row: format_query_output,
+format_output_row, split_by_lines, submit_error, the parameter substitution on_go does (build_submit_json) and
+expand_args_file, each over a realistic input and pathological ones (wide tables, 100k line buffers, huge args files).
+
+Results can be saved as a JSON baseline and a later run compared against it, failing when any case has slowed down by
+more than the threshold. Timings are only comparable on the same machine, so no baseline is committed (benchmarks/baselines
+is ignored). Save one of your own with --save before changing anything, then --compare after.
+
+    python -m benchmarks.bench_micro [--save] [--compare] [--baseline FILE] [--threshold PERCENT] [--filter TEXT]
+"""
+import json
+import os
+import platform
+import sys
+import tempfile
+import timeit
+from contextlib import redirect_stdout, redirect_stderr
+
+from monitor.main import State, ConnectionInfo, DEFAULT_CONNECTION, JAAQLMonitorException, format_query_output, format_output_row, \
+    split_by_lines, submit_error, build_submit_json, expand_args_file, compile_template
+
+BASELINE_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "baselines", "bench_micro.json")
+DEFAULT_THRESHOLD = 10  # percent slower than the baseline that counts as a regression
+REPEATS = 5
+
+
+def make_state(file_name: str = "bench_micro.sql") -> State:
+    state = State()
+    state.file_name = file_name
+    state.do_exit = False
+    state.is_verbose = True
+    state.connections[DEFAULT_CONNECTION] = None
+    state.connection_info[DEFAULT_CONNECTION] = ConnectionInfo("localhost:6060", "bench", "bench", None)
+    state.set_current_connection(state.connection_info[DEFAULT_CONNECTION], DEFAULT_CONNECTION)
+    return state
+
+
+def query_output_case(num_rows: int, num_columns: int, text_chars: int):
+    state = make_state()
+    json_output = {
+        "columns": ["column_%d" % idx for idx in range(num_columns)],
+        "rows": [[row if idx % 3 == 0 else ("text %d " % row).ljust(text_chars, "x") if idx % 3 == 1 else None
+                  for idx in range(num_columns)] for row in range(num_rows)]
+    }
+    return lambda: format_query_output(state, json_output)
+
+
+def output_row_case(num_columns: int, cell_chars: int):
+    cells = [("cell %d " % idx).ljust(cell_chars, "x") for idx in range(num_columns)]
+    widths = [max(cell_chars // 2, 4) if idx % 2 == 0 else cell_chars + 5 for idx in range(num_columns)]
+    left_aligned = [idx % 3 != 0 for idx in range(num_columns)]
+    breaches = [idx % 2 == 0 for idx in range(num_columns)]
+    return lambda: format_output_row(cells, widths, left_aligned, breaches)
+
+
+def split_by_lines_case(num_lines: int, line_ending: str):
+    text = line_ending.join("INSERT INTO seed_data (id) VALUES (%d);" % idx if idx % 10 != 0 else "" for idx in range(num_lines))
+    return lambda: split_by_lines(text)
+
+
+def submit_error_case(num_lines: int, error_line: int = None):
+    state = make_state()
+    buffer = "\n".join("INSERT INTO seed_data (id, label) VALUES (%d, 'label %d');" % (idx, idx) for idx in range(num_lines))
+    if error_line is None:
+        err = json.dumps({"message": "relation \"seed_data\" does not exist"})
+    else:
+        prefix = "LINE %d: " % error_line
+        err = 'ERROR:  syntax error at or near "label"\n' + prefix + "INSERT INTO seed_data\n" + " " * len(prefix) + "^"
+
+    def run():
+        state.fetched_query = buffer
+        state.cur_file_line = num_lines + 1
+        try:
+            submit_error(state, err, line_offset=num_lines - 1)
+        except JAAQLMonitorException:
+            pass
+    return run
+
+
+def parameters_case(num_lines: int, num_placeholders: int, num_parameters: int):
+    state = make_state()
+    state.parameters = {"parameter_%d" % idx: "value_%d" % idx for idx in range(num_parameters)}
+    every = max(num_lines // num_placeholders, 1)
+    buffer = "\n".join("GRANT SELECT ON table_%d TO {{parameter_%d}};" % (idx, idx % num_parameters) if idx % every == 0 else
+                       "INSERT INTO seed_data (id) VALUES (%d);" % idx for idx in range(num_lines))
+
+    def run():
+        compile_template.cache_clear()  # A buffer seen for the first time, the cost every distinct buffer pays once
+        state.fetched_query = buffer
+        build_submit_json(state)
+    return run
+
+
+def args_file_case(directory: str, num_args: int):
+    args_file = os.path.join(directory, "args_%d.txt" % num_args)
+    with open(args_file, "w", encoding="utf-8") as f:
+        for idx in range(num_args // 3):
+            f.write("-p\r\nparameter_%d\r\nvalue %d with spaces\r\n" % (idx, idx))
+    argv = ["-c", "default", "creds.txt", "--args-file", args_file, "-i", "install.sql"]
+    return lambda: expand_args_file(argv)
+
+
+def cases(directory: str) -> list:
+    return [
+        ("format_query_output 1k rows x 3", lambda: query_output_case(1000, 3, 20)),
+        ("format_query_output 200 rows x 200", lambda: query_output_case(200, 200, 12)),
+        ("format_query_output 500 rows long text", lambda: query_output_case(500, 6, 2000)),
+        ("format_output_row 8 cells", lambda: output_row_case(8, 12)),
+        ("format_output_row 500 cells", lambda: output_row_case(500, 40)),
+        ("split_by_lines credentials", lambda: split_by_lines_case(4, "\n")),
+        ("split_by_lines 100k lines", lambda: split_by_lines_case(100000, "\n")),
+        ("split_by_lines 100k lines crlf", lambda: split_by_lines_case(100000, "\r\n")),
+        ("submit_error no line", lambda: submit_error_case(20)),
+        ("submit_error 20 lines", lambda: submit_error_case(20, 12)),
+        ("submit_error 100k lines", lambda: submit_error_case(100000, 99990)),
+        ("on_go parameters 200 lines", lambda: parameters_case(200, 10, 100)),
+        ("on_go parameters 100k lines", lambda: parameters_case(100000, 10000, 1000)),
+        ("expand_args_file 60 args", lambda: args_file_case(directory, 60)),
+        ("expand_args_file 300k args", lambda: args_file_case(directory, 300000))
+    ]
+
+
+def time_case(run) -> float:
+    # The best of a few repeats, each long enough to time reliably, per call
+    timer = timeit.Timer(run)
+    number, _ = timer.autorange()
+    return min(timer.repeat(REPEATS, number)) / number
+
+
+def compare(results: dict, baseline: dict, threshold: float) -> list:
+    regressions = []
+    for name, seconds in results.items():
+        if name not in baseline:
+            continue
+        change = (seconds - baseline[name]) / baseline[name] * 100
+        if change > threshold:
+            regressions.append((name, baseline[name], seconds, change))
+    return regressions
+
+
+def main():
+    args = sys.argv[1:]
+    baseline_file = args[args.index("--baseline") + 1] if "--baseline" in args else BASELINE_FILE
+    threshold = float(args[args.index("--threshold") + 1]) if "--threshold" in args else DEFAULT_THRESHOLD
+    name_filter = args[args.index("--filter") + 1] if "--filter" in args else ""
+
+    baseline = None
+    if "--compare" in args:
+        if not os.path.exists(baseline_file):
+            print("No baseline at %s to compare against. Timings from another machine would not be comparable, so save one on "
+                  "this machine first with --save, before the change being measured" % baseline_file)
+            sys.exit(1)
+        with open(baseline_file, "r") as f:
+            saved = json.load(f)
+        baseline = saved["results"]
+        if saved.get("machine") != platform.platform() or saved.get("python") != platform.python_version():
+            print("The baseline was saved on %s with Python %s, timings are only comparable on the same machine" %
+                  (saved.get("machine"), saved.get("python")))
+
+    results = {}
+    print("%40s %14s %14s" % ("case", "time (us)", "baseline (us)" if baseline is not None else ""))
+    with tempfile.TemporaryDirectory() as directory:
+        for name, make_case in cases(directory):
+            if name_filter not in name:
+                continue
+            with open(os.devnull, "w") as sink, redirect_stdout(sink), redirect_stderr(sink):  # Printing is not what is measured
+                results[name] = time_case(make_case())
+            previous = "%14.1f" % (baseline[name] * 1000000) if baseline is not None and name in baseline else ""
+            print("%40s %14.1f %s" % (name, results[name] * 1000000, previous))
+
+    if "--save" in args:
+        saved = {}
+        if os.path.exists(baseline_file):  # A filtered run only replaces the cases it ran
+            with open(baseline_file, "r") as f:
+                saved = json.load(f)["results"]
+        saved.update(results)
+        os.makedirs(os.path.dirname(baseline_file), exist_ok=True)
+        with open(baseline_file, "w") as f:
+            json.dump({"python": platform.python_version(), "machine": platform.platform(), "results": saved}, f, indent=2)
+        print("Saved baseline to " + baseline_file)
+
+    if baseline is not None:
+        regressions = compare(results, baseline, threshold)
+        for name, before, after, change in regressions:
+            print("REGRESSION %s: %.1fus -> %.1fus (+%.0f%%)" % (name, before * 1000000, after * 1000000, change))
+        if len(regressions) != 0:
+            sys.exit(1)
+        print("No case slower than the baseline by more than %.0f%%" % threshold)
+
+
+if __name__ == "__main__":
+    main()
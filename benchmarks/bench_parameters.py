@@ -0,0 +1,54 @@
+"""
+Compares substituting {{parameter}} placeholders into a buffer with the compiled template engine against the previous
+approach of one str.replace per supplied parameter, at 10, 100 and 1,000 parameters. The template engine is timed both on a
+buffer it has not seen before (a full scan) and on a repeated buffer (a cache hit).
+
+    python -m benchmarks.bench_parameters
+"""
+import timeit
+
+from monitor.main import State, compile_template, render_template
+
+PARAMETER_COUNTS = [10, 100, 1000]
+BUFFER_LINES = 200
+PLACEHOLDERS_PER_BUFFER = 10
+REPEATS = 200
+
+
+def replace_per_parameter(parameters: dict, buffer: str) -> str:
+    for parameter, value in parameters.items():
+        buffer = buffer.replace("{{" + parameter + "}}", value)
+    return buffer
+
+
+def generate_buffer(num_parameters: int) -> str:
+    lines = []
+    for idx in range(BUFFER_LINES):
+        if idx % (BUFFER_LINES // PLACEHOLDERS_PER_BUFFER) == 0:
+            lines.append("GRANT SELECT ON my_table_%d TO {{parameter_%d}};" % (idx, idx % num_parameters))
+        else:
+            lines.append("INSERT INTO my_table (id, label) VALUES (%d, 'a label that is not a parameter');" % idx)
+    return "\n".join(lines)
+
+
+def main():
+    print("%12s %14s %18s %18s" % ("parameters", "replace (us)", "template new (us)", "template hit (us)"))
+    for num_parameters in PARAMETER_COUNTS:
+        state = State()
+        state.parameters = {"parameter_%d" % idx: "value_%d" % idx for idx in range(num_parameters)}
+        buffer = generate_buffer(num_parameters)
+        assert render_template(state, buffer) == replace_per_parameter(state.parameters, buffer)
+
+        replace_time = timeit.timeit(lambda: replace_per_parameter(state.parameters, buffer), number=REPEATS) / REPEATS
+
+        def render_unseen():
+            compile_template.cache_clear()
+            render_template(state, buffer)
+        unseen_time = timeit.timeit(render_unseen, number=REPEATS) / REPEATS
+
+        hit_time = timeit.timeit(lambda: render_template(state, buffer), number=REPEATS) / REPEATS
+        print("%12d %14.1f %18.1f %18.1f" % (num_parameters, replace_time * 1000000, unseen_time * 1000000, hit_time * 1000000))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,42 @@
+"""
+Checks the monitor's cold start against a budget, as measured by tests/startup.py. Runs
+`python -X importtime -c "import monitor.main"` a few times and fails (exit code 1) when the median import is over the
+budget, or when a module that only some runs need (requests, asyncio, multiprocessing, ...) has crept back into the import
+at startup. The monitor is byte compiled first so compiling the source is not what is measured. tests/test_startup.py
+makes the same checks as part of the test suite.
+
+    python -m benchmarks.bench_startup [--budget MS]
+"""
+import sys
+
+from tests.startup import DEFAULT_BUDGET_MS, DEFERRED_MODULES, RUNS, measure_startup
+
+TOP_IMPORTS = 10
+
+
+def main():
+    args = sys.argv[1:]
+    budget_ms = float(args[args.index("--budget") + 1]) if "--budget" in args else DEFAULT_BUDGET_MS
+
+    median_ms, last = measure_startup()
+    print("Slowest imports beneath monitor.main (cumulative ms):")
+    for name, micros in sorted(last.items(), key=lambda item: -item[1])[1:TOP_IMPORTS + 1]:
+        print("%10.1f  %s" % (micros / 1000, name))
+
+    failed = False
+    print("import monitor.main: %.1fms median of %d, budget %.0fms" % (median_ms, RUNS, budget_ms))
+    if median_ms > budget_ms:
+        print("OVER BUDGET by %.1fms" % (median_ms - budget_ms))
+        failed = True
+
+    imported = [name for name in DEFERRED_MODULES if name in last]
+    if len(imported) != 0:
+        print("Imported at startup, but should only be imported by the code that uses them: " + ", ".join(imported))
+        failed = True
+
+    if failed:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,86 @@
+"""
+Compares decoding a large /submit result with res.json() against streaming it through JSONResultStream, for time and for
+peak Python memory. A local stand-in server generates the result as it sends it (chunked), so the payload is never held
+by the server either.
+
+    python -m benchmarks.bench_stream_results [rows]
+"""
+import sys
+import threading
+import time
+import tracemalloc
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+import requests
+
+from monitor.main import JSONResultStream
+
+DEFAULT_ROWS = 2000000
+ROWS_PER_CHUNK = 10000
+
+
+class ResultHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    num_rows = DEFAULT_ROWS
+
+    def log_message(self, *args):
+        pass
+
+    def _send_chunk(self, data: str):
+        data = data.encode("UTF-8")
+        self.wfile.write(("%x\r\n" % len(data)).encode("ASCII") + data + b"\r\n")
+
+    def do_POST(self):
+        self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+
+        self._send_chunk('{"columns": ["id", "name", "amount"], "rows": [')
+        for start in range(0, self.num_rows, ROWS_PER_CHUNK):
+            rows = ['[%d, "account_%d", %d.25]' % (idx, idx, idx % 1000) for idx in range(start, min(start + ROWS_PER_CHUNK, self.num_rows))]
+            self._send_chunk(("," if start != 0 else "") + ",".join(rows))
+        self._send_chunk("]}")
+        self.wfile.write(b"0\r\n\r\n")
+
+
+def decode_whole(url: str) -> int:
+    return len(requests.post(url, json={"query": "SELECT"}).json()["rows"])
+
+
+def decode_streamed(url: str) -> int:
+    result = JSONResultStream.from_response(requests.post(url, json={"query": "SELECT"}, stream=True)).open()
+    return sum(1 for _ in result.iter_rows())
+
+
+def measure(decode, url: str, num_rows: int):
+    start = time.perf_counter()
+    assert decode(url) == num_rows
+    elapsed = time.perf_counter() - start
+
+    tracemalloc.start()
+    decode(url)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return elapsed, peak
+
+
+def main():
+    num_rows = int(sys.argv[1]) if len(sys.argv) > 1 else DEFAULT_ROWS
+    ResultHandler.num_rows = num_rows
+    server = ThreadingHTTPServer(("127.0.0.1", 0), ResultHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    url = "http://127.0.0.1:%d/submit" % server.server_address[1]
+
+    print("%d rows" % num_rows)
+    print("%10s %10s %16s" % ("decoder", "time (s)", "peak memory (MB)"))
+    for name, decode in [("res.json", decode_whole), ("streamed", decode_streamed)]:
+        elapsed, peak = measure(decode, url, num_rows)
+        print("%10s %10.2f %16.1f" % (name, elapsed, peak / 1024 / 1024))
+
+    server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
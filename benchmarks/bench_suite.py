@@ -0,0 +1,173 @@
+"""
+Runs the monitor end to end, through initialise_from_args (and initialise for --prepare), against the local stand-in
+JAAQL server in tests/stub_jaaql.py, over synthetic scripts of increasing size, import depth, parameter count and
+account registrations. Reports statements per second, the client's CPU time and its peak RSS. Each scenario runs in a
+child process of its own so those are the monitor's alone, the server's work staying in this process. Runs offline.
+
+    python -m benchmarks.bench_suite [--quick] [--latency MS] [--rows N]
+"""
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+try:
+    import resource
+except ImportError:  # Windows, where peak RSS is not reported
+    resource = None
+
+from tests.stub_jaaql import StubJAAQLServer
+
+STATEMENT_COUNTS = [500, 5000, 20000]
+IMPORT_DEPTHS = [1, 10, 50]
+PARAMETER_COUNTS = [10, 100, 1000]
+ACCOUNT_COUNTS = [50, 500]
+PREPARE_COUNTS = [1000, 20000]
+QUICK_SCALE = 10  # --quick divides every size by this
+
+STATEMENTS_PER_IMPORT = 20
+STATEMENTS_WITH_PARAMETERS = 1000
+PLACEHOLDERS_PER_STATEMENT = 3
+
+
+def statement(idx: int) -> str:
+    return "INSERT INTO bench_table (id, label) VALUES (%d, 'a generated label %d');" % (idx, idx)
+
+
+def write_file(directory: str, name: str, lines: list) -> str:
+    file_name = os.path.join(directory, name)
+    with open(file_name, "w") as f:
+        f.write("\n".join(lines) + "\n")
+    return file_name
+
+
+def statements_scenario(directory: str, count: int) -> dict:
+    lines = []
+    for idx in range(count):
+        lines += [statement(idx), "\\g"]
+    return {"name": "%d statements" % count, "statements": count, "args": ["-i", write_file(directory, "statements.sql", lines)]}
+
+
+def imports_scenario(directory: str, depth: int) -> dict:
+    # Each file runs its statements then imports the next, so the last is depth imports deep
+    for level in reversed(range(depth + 1)):
+        lines = []
+        for idx in range(STATEMENTS_PER_IMPORT):
+            lines += [statement(level * STATEMENTS_PER_IMPORT + idx), "\\g"]
+        if level != depth:
+            lines.append("\\import level_%d.sql" % (level + 1))
+        write_file(directory, "level_%d.sql" % level, lines)
+    return {"name": "import depth %d" % depth, "statements": (depth + 1) * STATEMENTS_PER_IMPORT,
+            "args": ["-i", os.path.join(directory, "level_0.sql")]}
+
+
+def parameters_scenario(directory: str, count: int) -> dict:
+    lines = []
+    for idx in range(STATEMENTS_WITH_PARAMETERS):
+        placeholders = ["'{{parameter_%d}}'" % ((idx + offset) % count) for offset in range(PLACEHOLDERS_PER_STATEMENT)]
+        lines += ["INSERT INTO bench_table (id, a, b, c) VALUES (%d, %s);" % (idx, ", ".join(placeholders)), "\\g"]
+    args = ["-i", write_file(directory, "parameters.sql", lines)]
+    for idx in range(count):
+        args += ["-p", "parameter_%d" % idx, "value_%d" % idx]
+    return {"name": "%d parameters" % count, "statements": STATEMENTS_WITH_PARAMETERS, "args": args}
+
+
+def accounts_scenario(directory: str, count: int, credentials: str) -> dict:
+    lines = ["\\register jaaql account with @account overriding username as user_%d" % idx for idx in range(count)]
+    return {"name": "%d registrations" % count, "statements": count,
+            "args": ["-c", "account", credentials, "-i", write_file(directory, "accounts.sql", lines)]}
+
+
+def prepare_scenario(directory: str, count: int) -> dict:
+    return {"name": "prepare %d queries" % count, "statements": count, "prepare": True,
+            "file_content": "\n".join(statement(idx) for idx in range(count))}
+
+
+def peak_rss_mb():
+    # On Linux ru_maxrss is carried over from the parent through fork and exec, so this process's own high water mark is
+    # read from /proc instead
+    try:
+        with open("/proc/self/status", "r") as f:
+            for line in f:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    if resource is None:
+        return None
+    peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak_rss / 1024 / 1024 if sys.platform == "darwin" else peak_rss / 1024  # bytes on macOS, KB elsewhere
+
+
+def run_scenario(spec_file: str):
+    # In the child process: run the monitor once and report on it to the parent as a line of JSON
+    from monitor.main import DEFAULT_CONNECTION, initialise, initialise_from_args
+
+    with open(spec_file, "r") as f:
+        spec = json.load(f)
+
+    start = time.perf_counter()
+    cpu_start = time.process_time()
+    if spec.get("prepare"):
+        initialise(None, [[DEFAULT_CONNECTION, spec["credentials"]]], [], None, do_prepare=True, file_content=spec["file_content"])
+    else:
+        initialise_from_args(["-c", spec["credentials"]] + spec["args"], do_exit=False)
+    elapsed = time.perf_counter() - start
+    cpu = time.process_time() - cpu_start
+
+    print(json.dumps({"elapsed": elapsed, "cpu": cpu, "peak_rss_mb": peak_rss_mb()}))
+
+
+def measure(server: StubJAAQLServer, directory: str, spec: dict) -> dict:
+    spec_file = os.path.join(directory, "spec.json")
+    with open(spec_file, "w") as f:
+        json.dump(spec, f)
+
+    requests_before = server.total_requests()
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    child = subprocess.run([sys.executable, "-m", "benchmarks.bench_suite", "--run-scenario", spec_file], cwd=root,
+                           stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True)
+    if child.returncode != 0:
+        raise Exception("Scenario '%s' failed:\n%s%s" % (spec["name"], child.stdout, child.stderr))
+    result = json.loads(child.stdout.strip().splitlines()[-1])
+    result["requests"] = server.total_requests() - requests_before
+    return result
+
+
+def main():
+    args = sys.argv[1:]
+    if "--run-scenario" in args:
+        return run_scenario(args[args.index("--run-scenario") + 1])
+
+    scale = QUICK_SCALE if "--quick" in args else 1
+    latency_ms = float(args[args.index("--latency") + 1]) if "--latency" in args else 0
+    result_rows = int(args[args.index("--rows") + 1]) if "--rows" in args else 1
+
+    print("latency %.1fms, %d result row(s) per statement" % (latency_ms, result_rows))
+    print("%22s %10s %9s %10s %12s %9s %14s" % ("scenario", "statements", "requests", "time (s)", "statements/s", "cpu (s)",
+                                              "peak RSS (MB)"))
+    with StubJAAQLServer(latency=latency_ms / 1000, result_rows=result_rows) as server:
+        scenarios = [(statements_scenario, max(count // scale, 1)) for count in STATEMENT_COUNTS] + \
+                    [(imports_scenario, depth) for depth in (IMPORT_DEPTHS if scale == 1 else IMPORT_DEPTHS[:-1])] + \
+                    [(parameters_scenario, count) for count in PARAMETER_COUNTS] + \
+                    [(accounts_scenario, max(count // scale, 1)) for count in ACCOUNT_COUNTS] + \
+                    [(prepare_scenario, max(count // scale, 1)) for count in PREPARE_COUNTS]
+        for generate, size in scenarios:
+            with tempfile.TemporaryDirectory() as directory:
+                credentials = server.write_credentials(os.path.join(directory, "bench.credentials.txt"))
+                if generate == accounts_scenario:
+                    spec = generate(directory, size, server.write_credentials(os.path.join(directory, "account.credentials.txt"), "account"))
+                else:
+                    spec = generate(directory, size)
+                spec["credentials"] = credentials
+                result = measure(server, directory, spec)
+
+            peak_rss = "%14.1f" % result["peak_rss_mb"] if result["peak_rss_mb"] is not None else "%14s" % "-"
+            print("%22s %10d %9d %10.2f %12.0f %9.2f %s" % (spec["name"], spec["statements"], result["requests"], result["elapsed"],
+                                                          spec["statements"] / result["elapsed"], result["cpu"], peak_rss))
+
+
+if __name__ == "__main__":
+    main()
@@ -1,23 +1,32 @@
-import traceback
-import tempfile
+import io
+from collections import deque
+from contextlib import redirect_stdout, redirect_stderr, contextmanager, nullcontext
 
 from json import JSONDecodeError
 
 from monitor.version import print_version, VERSION
 import sys
-import requests
 from sys import exit
-from getpass import getpass
-from inspect import getframeinfo, stack
 from datetime import datetime
 from base64 import urlsafe_b64encode as b64e, urlsafe_b64decode as b64d
 import os
 from os.path import dirname
-import shutil
 import json
-import platform
-import subprocess
 import time
+import queue
+import threading
+import codecs
+import mmap
+import re
+import heapq
+from functools import lru_cache
+from itertools import islice, chain
+from array import array
+from typing import TYPE_CHECKING
+
+if TYPE_CHECKING:  # Imported where they are used, so only the runs that need them pay for them
+    import asyncio
+    import requests
 
 HEADER__security_bypass = "Authentication-Token-Bypass"
 HEADER__security_bypass_jaaql = "Authentication-Token-Bypass-Jaaql"
@@ -48,7 +57,53 @@ ENDPOINT__deep_health = "/internal/deep-health"
 # once it succeeds repeatedly, the workers are back and the build can continue safely.
 WAIT__healthy_seconds = 180         # max total wait for the workers to be serving queries again
 WAIT__healthy_stable_checks = 3     # consecutive successful probe queries that confirm real health
-WAIT__healthy_poll_interval = 0.5   # seconds between probes
+WAIT__healthy_poll_interval = 0.5   # seconds between probes until the restart has been seen
+WAIT__healthy_poll_min = 0.05       # seconds between probes once the restart has been seen, doubling whilst they fail
+WAIT__healthy_poll_max = 0.2        # the most failing probes back off to
+
+HTTP__default_pool_size = 10        # keep-alive connections held open per JAAQL host
+
+PSQL__session_min_version = 130000  # psql 13 added \\warn, which a persistent session's stderr sentinels need
+
+LOAD__mmap_threshold = 4 * 1024 * 1024  # scripts at least this large are memory mapped rather than read into memory
+LOAD__chunk_size = 1024 * 1024          # bytes decoded at a time whilst checking a script's encoding
+
+TEMPLATE__cache_size = 1024  # compiled buffers kept, so buffers repeated by shared imports are only scanned once
+TEMPLATE__cache_max_chars = 4 * 1024  # longer buffers are not kept, which bounds the cache to some 15 MB
+TEMPLATE__placeholder = re.compile(r"\{\{([^{}]*)}}")
+
+STREAM__chunk_size = 64 * 1024  # bytes read from a streamed /submit response at a time
+STREAM__page_rows = 10000  # rows laid out per table when a streamed result is too big to measure as a whole
+
+TRACE__buffer_size = 1024 * 1024
+
+PROFILE__top_statements = 20  # statements listed by --profile
+PROFILE__query_chars = 80  # how much of a statement's first line the report shows
+
+KEEP_GOING__excerpt_chars = 80  # how much of a failed buffer's first line the --keep-going summary shows
+
+COMPRESS__min_bytes = 16 * 1024  # request bodies smaller than this are sent as they are
+COMPRESS__level = 6
+COMPRESS__rejected_status = 415  # a server that cannot read a gzip body answers this
+# or a 400 saying so. Any other 400 is an error in the request itself, a SQL error say, which must not be sent twice
+COMPRESS__rejected_messages = ["content-encoding", "gzip", "codec can't decode", "failed to decode json"]
+
+ASSERT__rows_shown = 25  # rows listed when an assertion gets the wrong number of rows
+
+ASYNC__max_pending = 256  # submits allowed in flight or awaiting their result before the script waits for the oldest
+
+TOKEN__refresh_margin_seconds = 30     # oauth tokens are refreshed this long before they expire
+TOKEN__default_lifetime_seconds = 300  # assumed lifetime of a cached token whose expiry cannot be read from it
+
+IMPORT__cache_max_bytes = 8 * 1024 * 1024  # imported files larger than this are streamed on every import rather than kept
+
+IR__max_bytes = 64 * 1024 * 1024  # scripts (with their imports) larger than this are streamed rather than compiled and cached
+IR__cache_max_files = 256         # compiled scripts kept in the cache directory, the least recently used are removed
+IR__format = "3"                  # changed whenever the compiled form changes, so scripts cached by an older form are recompiled
+IR__text = "text"                 # a run of lines that only append to the buffer
+IR__lines = "lines"               # a run of lines processed one at a time (commands, parameter and cron blocks, trailing \g)
+IR__import = "import"             # entering an imported file, whose operations follow unless it has changed since compiling
+IR__end_import = "end_import"     # returning to the importing file
 
 COMMAND__initialiser = "\\"
 COMMAND__reset_short = "\\r"
@@ -62,6 +117,7 @@ COMMAND__print = "\\print"
 COMMAND__cron = "\\cron"
 COMMAND__wipe_dbms = "\\wipe dbms"
 COMMAND__switch_jaaql_account_to = "\\switch jaaql account to "
+COMMAND__independently = " independently"
 COMMAND__connect_to_database = "\\connect to database "
 COMMAND__register_jaaql_account_with = "\\register jaaql account with "
 COMMAND__federate_jaaql_account_with = "\\federate jaaql account with "
@@ -73,6 +129,9 @@ COMMAND__quit = "\\quit"
 COMMAND__freeze_instance = "\\freeze instance"
 COMMAND__defrost_instance = "\\defrost instance"
 COMMAND__set_web_config = "\\set web config"
+COMMAND__export = "\\export "
+COMMAND__go_to_file_short = "\\g >"
+COMMAND__go_to_file = "\\go >"
 COMMAND__with_parameters = "WITH PARAMETERS {"
 COMMAND__with_user = "WITH USER"
 COMMAND__and_user = " AND USER "
@@ -86,6 +145,12 @@ DEFAULT_EMAIL_ACCOUNT = "default"
 LINE_LENGTH_MAX = 115
 ROWS_MAX = 25
 
+EXPORT__csv = "csv"
+EXPORT__jsonl = "jsonl"
+EXPORT__extensions = {".csv": EXPORT__csv, ".jsonl": EXPORT__jsonl, ".ndjson": EXPORT__jsonl}
+EXPORT__rows_per_write = 10000
+EXPORT__buffer_size = 1024 * 1024
+
 METHOD__post = "POST"
 METHOD__get = "GET"
 
@@ -101,6 +166,21 @@ ARGS__environment = ['-e', '--environment-file']
 ARGS__allow_unused_parameters = ['-a', '--allow-unused-parameters']
 ARGS__clone_as_attach = ['--clone-as-attach']
 ARGS__cost_only = ['--cost-only']
+ARGS__pool_size = ['--pool-size']
+ARGS__batch_submits = ['--batch-submits']
+ARGS__jobs = ['-j', '--jobs']
+ARGS__barrier = ['--barrier']
+ARGS__persistent_psql = ['--persistent-psql']
+ARGS__ir_cache = ['--ir-cache']
+ARGS__token_cache = ['--token-cache']
+ARGS__async = ['--async']
+ARGS__stream_results = ['--stream-results']
+ARGS__export = ['--export']
+ARGS__compress = ['--compress']
+ARGS__trace = ['--trace']
+ARGS__profile = ['--profile']
+ARGS__profile_json = ['--profile-json']
+ARGS__keep_going = ['--keep-going']
 
 
 class JAAQLMonitorException(Exception):
@@ -108,10 +188,29 @@ class JAAQLMonitorException(Exception):
         super().__init__(*args, **kwargs)
 
 
+class StatementFailure(JAAQLMonitorException):
+    # A statement failed under --keep-going. It has been reported and recorded, the script carries on after it
+    pass
+
+
 class EOFMarker:
     pass
 
 
+class LineCursor:
+    """
+    The unread lines of a script. Lines are taken from the front in O(1) instead of re-slicing the remaining list, and an
+    EOFMarker is returned once they run out. Any iterable of lines can back the cursor
+    """
+
+    def __init__(self, lines=()):
+        self._lines = iter(lines)
+
+    def next_line(self):
+        line = next(self._lines, None)
+        return EOFMarker() if line is None else line
+
+
 class ConnectionInfo:
     def __init__(self, host, username, password, database, override_url=None):
         self.host = host
@@ -119,6 +218,7 @@ class ConnectionInfo:
         self.password = password
         self.database = database
         self.oauth_token = None
+        self.oauth_token_expires = None
         self.override_url = override_url
 
     def to_dict(self):
@@ -151,9 +251,278 @@ class ConnectionInfo:
         return formatted
 
 
+def get_user_cache_dir():
+    import platform
+    if platform.system().lower() == 'windows':
+        base = os.environ.get("LOCALAPPDATA", os.path.expanduser("~"))
+    else:
+        base = os.environ.get("XDG_CACHE_HOME", os.path.join(os.path.expanduser("~"), ".cache"))
+    return os.path.join(base, "jaaql-monitor")
+
+
+def get_token_expiry(token) -> float | None:
+    # Reads (without verifying) the exp claim if the token is a JWT
+    try:
+        payload = token.split(".")[1]
+        return float(json.loads(b64d(payload + "=" * (-len(payload) % 4)))["exp"])
+    except (AttributeError, IndexError, KeyError, TypeError, ValueError):
+        return None
+
+
+def get_token_cache_key(conn: ConnectionInfo):
+    import hashlib
+
+    # The password is part of the key so a cached token is only ever handed to someone who could have logged in themselves
+    return hashlib.sha256("\0".join([conn.get_http_url(), conn.username, conn.password]).encode()).hexdigest()
+
+
+def read_token_cache(token_cache_file) -> dict:
+    # Anything that is not a well formed entry, from a damaged or foreign file, is treated as not cached
+    try:
+        with open(token_cache_file, "r", encoding="utf-8") as f:
+            cache = json.load(f)
+    except (OSError, ValueError):
+        return {}
+    if not isinstance(cache, dict):
+        return {}
+    return {key: entry for key, entry in cache.items() if isinstance(entry, dict) and isinstance(entry.get("token"), str) and
+            isinstance(entry.get("expires"), (int, float)) and not isinstance(entry.get("expires"), bool)}
+
+
+def write_token_cache_entry(token_cache_file, cache_key, token, expires):
+    import uuid
+    cache = {key: entry for key, entry in read_token_cache(token_cache_file).items() if entry["expires"] > time.time()}
+    cache[cache_key] = {"token": token, "expires": expires}
+
+    # Written as a new file only the user can read, then swapped in, so concurrent monitors never see a partial cache
+    os.makedirs(dirname(token_cache_file), mode=0o700, exist_ok=True)
+    temp_file = token_cache_file + "." + uuid.uuid4().hex + ".tmp"
+    with os.fdopen(os.open(temp_file, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o600), "w", encoding="utf-8") as f:
+        json.dump(cache, f)
+    os.replace(temp_file, token_cache_file)
+
+
+class Tracer:
+    """
+    Writes a Chrome trace (the JSON array format opened by chrome://tracing, Perfetto or speedscope) as the run goes, so a
+    long build can be looked at in a flame view. Timestamps are wall clock microseconds, letting the traces of parallel
+    workers line up when merged into the parent's
+    """
+
+    def __init__(self, file_name: str):
+        self.file_name = file_name
+        self._file = open(file_name, "w", encoding="UTF-8", buffering=TRACE__buffer_size)
+        self._file.write("[\n")
+        self._lock = threading.Lock()
+        self._pid = os.getpid()
+        self._epoch_us = (time.time() - time.perf_counter()) * 1000000
+        self.command = None  # The command being run, recorded against the requests it makes
+
+    def _write(self, event: dict):
+        event["pid"] = self._pid
+        event["tid"] = threading.get_ident()
+        line = json.dumps(event, default=str) + ",\n"
+        with self._lock:
+            self._file.write(line)
+
+    def complete(self, name: str, cat: str, start: float, end: float, args: dict = None):
+        # start and end are time.perf_counter() readings
+        self._write({"name": name, "cat": cat, "ph": "X", "ts": round(self._epoch_us + start * 1000000, 1),
+                     "dur": round((end - start) * 1000000, 1), "args": args or {}})
+
+    @contextmanager
+    def span(self, name: str, cat: str, args: dict):
+        start = time.perf_counter()
+        try:
+            yield args
+        except BaseException:
+            args.setdefault("outcome", "error")
+            raise
+        finally:
+            self.complete(name, cat, start, time.perf_counter(), args)
+
+    def append_trace(self, file_name: str):
+        # Takes in the events of a finished worker's trace, removing its file
+        try:
+            with open(file_name, "r", encoding="UTF-8") as worker_file:
+                events = worker_file.read().strip()[1:-1].strip()
+            os.remove(file_name)
+        except OSError:
+            return
+        if len(events) != 0:
+            with self._lock:
+                self._file.write(events + ",\n")
+
+    def close(self):
+        with self._lock:
+            self._file.write(json.dumps({"name": "process_name", "ph": "M", "pid": self._pid, "tid": threading.get_ident(),
+                                         "args": {"name": "jaaql-monitor"}}) + "\n]\n")
+            self._file.close()
+
+
+def trace_span(state, name: str, cat: str, file_name: str = None, line: int = None, command: str = None):
+    # A span over a with block, recorded against the script position. Does nothing without --trace
+    if state.tracer is None:
+        return nullcontext({})
+    return state.tracer.span(name, cat, {
+        "file": state.file_name if file_name is None else file_name,
+        "line": state.cur_file_line if line is None else line,
+        "command": state.tracer.command if command is None else command
+    })
+
+
+@lru_cache(maxsize=None)
+def tracing_http_adapter_class():
+    # Built on first use, so requests is only imported by runs that make requests
+    from requests.adapters import HTTPAdapter
+    from urllib3.connection import HTTPConnection, HTTPSConnection
+    from urllib3.connectionpool import HTTPConnectionPool, HTTPSConnectionPool
+
+    class TracingHTTPAdapter(HTTPAdapter):
+        """
+        An HTTPAdapter whose new connections record their set up in the trace: "connect" spans the whole of it, containing a
+        "tcp connect", so for https the remainder is the TLS handshake
+        """
+
+        def __init__(self, tracer: Tracer, **kwargs):
+            self.tracer = tracer  # Before HTTPAdapter.__init__, which creates the pool manager
+            super().__init__(**kwargs)
+
+        def init_poolmanager(self, *args, **kwargs):
+            super().init_poolmanager(*args, **kwargs)
+            tracer = self.tracer
+
+            def timed(connection_cls):
+                class TimedConnection(connection_cls):
+                    def _new_conn(self):
+                        start = time.perf_counter()
+                        try:
+                            return super()._new_conn()
+                        finally:
+                            tracer.complete("tcp connect", "connect", start, time.perf_counter(), {"host": self.host, "port": self.port})
+
+                    def connect(self):
+                        start = time.perf_counter()
+                        try:
+                            return super().connect()
+                        finally:
+                            tracer.complete("connect", "connect", start, time.perf_counter(),
+                                            {"host": self.host, "port": self.port, "tls": isinstance(self, HTTPSConnection)})
+                return TimedConnection
+
+            self.poolmanager.pool_classes_by_scheme = {
+                "http": type("TimedHTTPConnectionPool", (HTTPConnectionPool,), {"ConnectionCls": timed(HTTPConnection)}),
+                "https": type("TimedHTTPSConnectionPool", (HTTPSConnectionPool,), {"ConnectionCls": timed(HTTPSConnection)})
+            }
+
+    return TracingHTTPAdapter
+
+
+class Profiler:
+    """
+    Collects where the time of a run goes for the --profile report: the slowest statements, with where they were read
+    from, and the cumulative time per command and per file (an imported file including the files it imports in turn)
+    """
+
+    def __init__(self, top_statements: int = PROFILE__top_statements):
+        self.top_statements = top_statements
+        self._statements = []  # A min heap, so only the slowest few of a long build are ever held
+        self._seq = 0
+        self.commands = {}  # name -> [count, seconds]
+        self.files = {}
+        self.waits = []  # one per \wipe dbms, for the workers to serve queries again
+
+    def add_statement(self, statement: dict):
+        entry = (statement["ms"], self._seq, statement)
+        self._seq += 1
+        if len(self._statements) < self.top_statements:
+            heapq.heappush(self._statements, entry)
+        else:
+            heapq.heappushpop(self._statements, entry)
+
+    @staticmethod
+    def _add(totals: dict, name: str, seconds: float, count: int = 1):
+        total = totals.setdefault(name, [0, 0.0])
+        total[0] += count
+        total[1] += seconds
+
+    def add_command(self, name: str, seconds: float):
+        Profiler._add(self.commands, name, seconds)
+
+    def add_file(self, file_name: str, seconds: float):
+        Profiler._add(self.files, file_name, seconds)
+
+    def add_wait(self, wait: dict):
+        self.waits.append(wait)
+
+    def slowest_statements(self) -> list:
+        return [statement for _, _, statement in sorted(self._statements, key=lambda entry: (-entry[0], entry[1]))]
+
+    @staticmethod
+    def _totals_to_json(totals: dict) -> list:
+        return [{"name": name, "count": total[0], "ms": round(total[1] * 1000, 1)}
+                for name, total in sorted(totals.items(), key=lambda item: -item[1][1])]
+
+    def to_json(self) -> dict:
+        return {
+            "statements": self.slowest_statements(),
+            "commands": Profiler._totals_to_json(self.commands),
+            "files": Profiler._totals_to_json(self.files),
+            "waits": self.waits
+        }
+
+    def merge_file(self, file_name: str):
+        # Takes in the profile a parallel worker wrote with --profile-json, removing its file
+        try:
+            with open(file_name, "r", encoding="UTF-8") as worker_file:
+                profile = json.load(worker_file)
+            os.remove(file_name)
+        except (OSError, ValueError):
+            return
+        for statement in profile["statements"]:
+            self.add_statement(statement)
+        for totals, key in [(self.commands, "commands"), (self.files, "files")]:
+            for total in profile[key]:
+                Profiler._add(totals, total["name"], total["ms"] / 1000, total["count"])
+        self.waits += profile["waits"]
+
+    def write_json(self, file_name: str):
+        with open(file_name, "w", encoding="UTF-8") as f:
+            json.dump(self.to_json(), f, indent=2)
+
+    def report(self) -> str:
+        lines = ["Slowest statements:"]
+        for statement in self.slowest_statements():
+            location = "%s:%d" % (statement["file"], statement["line"]) if statement["line"] is not None else "(input)"
+            connection = statement["connection"] + ("/" + statement["database"] if statement["database"] is not None else "")
+            lines.append("%10.0fms  %s  %s  %s" % (statement["ms"], location, connection, statement["query"]))
+        for title, totals in [("Time per command:", self.commands), ("Time per file, including its imports:", self.files)]:
+            lines.append(title)
+            for total in Profiler._totals_to_json(totals):
+                lines.append("%10.0fms  %6d x  %s" % (total["ms"], total["count"], total["name"]))
+        if len(self.waits) != 0:
+            lines.append("Waits for JAAQL to serve queries after \\wipe dbms:")
+            for wait in self.waits:
+                lines.append("%10.0fms  %6d probes  %s:%d" % (wait["ms"], wait["probes"], wait["file"], wait["line"]))
+        return "\n".join(lines)
+
+
+@contextmanager
+def file_span(state, name: str, file_name: str = None):
+    # A top level file: traced as a span and, with --profile, added to the time per file
+    started_at = time.perf_counter()
+    try:
+        with trace_span(state, name, "file"):
+            yield
+    finally:
+        if state.profiler is not None and file_name is not None:
+            state.profiler.add_file(file_name, time.perf_counter() - started_at)
+
+
 FUTURE_TYPE_none = 0
 FUTURE_TYPE_input = 1
 FUTURE_TYPE_psql = 2
+FUTURE_TYPE_barrier = 3
 
 
 class State:
@@ -172,21 +541,59 @@ class State:
         self.is_debugging = False
         self.file_name = None
         self.cur_file_line = 0
-        self.file_lines = []
+        self.file_lines = LineCursor()
         self.override_url = None
         self.parameters = {}
+        self.used_parameters = set()
         self.query_parameters = None
         self.reading_parameters = False
+        self.cron = None
         self.prevent_unused_parameters = True
         self.clone_as_attach = False
 
         self.do_exit = True
 
         self.future_files = []
+        self.jobs = 1
 
         self.database_override = None
         self.is_transactional = True
 
+        self.http_sessions = {}
+        self.http_pool_size = HTTP__default_pool_size
+
+        self.batch_size = 1
+        self.submit_batch = []
+
+        self.persistent_psql = False
+        self.psql_sessions = {}
+
+        self.ir_cache_dir = None
+
+        self.token_cache_file = None
+
+        self.use_async = False
+        self.stream_results = False
+        self.export_file = None
+        self.export_started = False
+
+        self.compress_requests = False
+        self.compression_rejected = set()  # sessions whose server turned a compressed body away
+
+        self.tracer = None
+        self.profiler = None
+        self.profile_file = None
+        self.print_profile = False
+        self.async_engine = None
+
+        self.keep_going = False
+        self.failures = []
+
+        self.import_cache = {}
+        self.import_cache_hits = 0
+        self.import_cache_misses = 0
+        self.import_cache_bytes_saved = 0
+
     def set_current_connection(self, connection, name=DEFAULT_CONNECTION):
         self._current_connection = name
         if connection not in self.connection_info:
@@ -216,7 +623,54 @@ class State:
         if self.is_verbose:
             print(str(msg))
 
-    def _fetch_oauth_token_for_current_connection(self):
+    def get_http_session(self, conn: ConnectionInfo) -> "requests.Session":
+        # One keep-alive session per JAAQL url, shared by every account on that host, so a long build does not pay a new
+        # TCP/TLS handshake per request. Cookies are never persisted: accounts share the session and authenticate by header
+        url = conn.get_http_url()
+        session = self.http_sessions.get(url)
+        if session is None:
+            import requests
+            from requests.adapters import HTTPAdapter
+            from http.cookiejar import DefaultCookiePolicy
+
+            session = requests.Session()
+            session.cookies.set_policy(DefaultCookiePolicy(allowed_domains=[]))
+            if self.tracer is not None:
+                adapter = tracing_http_adapter_class()(self.tracer, pool_maxsize=self.http_pool_size)
+            else:
+                adapter = HTTPAdapter(pool_maxsize=self.http_pool_size)
+            session.mount("http://", adapter)
+            session.mount("https://", adapter)
+            self.http_sessions[url] = session
+        return session
+
+    @staticmethod
+    def http_errors():
+        # The base class of what requests raises when a server cannot be reached. Imported here, not at the top, so runs
+        # that never make a request (psql files, --version) start without requests
+        from requests.exceptions import RequestException
+        return RequestException
+
+    def get_http_connection_counts(self):
+        opened = 0
+        sent = 0
+        for session in self.http_sessions.values():
+            for adapter in set(session.adapters.values()):
+                for pool_key in adapter.poolmanager.pools.keys():
+                    pool = adapter.poolmanager.pools[pool_key]
+                    opened += pool.num_connections
+                    sent += pool.num_requests
+        return opened, max(sent - opened, 0)
+
+    def close_http_sessions(self):
+        if len(self.http_sessions) != 0:
+            opened, reused = self.get_http_connection_counts()
+            self.log("HTTP connections opened: %d, reused: %d" % (opened, reused))
+        for session in self.http_sessions.values():
+            session.close()
+        self.http_sessions = {}
+
+    def _fetch_oauth_token_for_current_connection(self, use_token_cache: bool = True):
         conn = self.get_current_connection()
 
         if self.skip_auth:
@@ -225,8 +679,18 @@ class State:
                 HEADER__security_specify_user: conn.username
             }
         else:
+            cache_key = None
+            if self.token_cache_file is not None:
+                cache_key = get_token_cache_key(conn)
+                cached = read_token_cache(self.token_cache_file).get(cache_key) if use_token_cache else None
+                if cached is not None and cached["expires"] - TOKEN__refresh_margin_seconds > time.time():
+                    self.log("Using cached oauth token for username '" + conn.username + "'")
+                    conn.oauth_token = {HEADER__security: cached["token"]}
+                    conn.oauth_token_expires = cached["expires"]
+                    return
+
             try:
-                oauth_res = requests.post(conn.get_http_url() + ENDPOINT__oauth, json={
+                oauth_res = self.get_http_session(conn).post(conn.get_http_url() + ENDPOINT__oauth, json={
                     "username": conn.username,
                     "password": conn.password
                 })
@@ -236,17 +700,53 @@ class State:
                                 " for username '" + conn.username + "'")
                     return None
 
-                conn.oauth_token = {HEADER__security: oauth_res.json()}
-            except requests.exceptions.RequestException:
+                token = oauth_res.json()
+                conn.oauth_token = {HEADER__security: token}
+                conn.oauth_token_expires = get_token_expiry(token)
+            except self.http_errors():
                 print_error(self, "Could not connect to JAAQL running on " + conn.host + "\nPlease make sure that JAAQL is running and accessible")
+                return None
+
+            if cache_key is not None:
+                expires = conn.oauth_token_expires
+                if expires is None:
+                    expires = time.time() + TOKEN__default_lifetime_seconds
+                    conn.oauth_token_expires = expires
+                try:
+                    write_token_cache_entry(self.token_cache_file, cache_key, token, expires)
+                except OSError as ex:
+                    self.log("Could not write the oauth token cache: " + str(ex))
+
+    def send_request(self, session: "requests.Session", method: str, url: str, send_json=None, headers: dict = None, stream: bool = False):
+        # With --compress, bodies over COMPRESS__min_bytes are gzipped. Should the server turn one away the request is resent
+        # as plain JSON, as is every later request to that server. Responses need nothing here, requests already asks for
+        # gzip or deflate (Accept-Encoding) and decodes whichever the server sends
+        if not self.compress_requests or send_json is None or session in self.compression_rejected:
+            return session.request(method, url, json=send_json, headers=headers, stream=stream)
+
+        # Encoded once, as requests would encode json=send_json, and sent as these bytes whether compressed or not
+        body = json.dumps(send_json, allow_nan=False).encode("UTF-8")
+        json_headers = {**(headers or {}), "Content-Type": "application/json"}
+        if len(body) < COMPRESS__min_bytes:
+            return session.request(method, url, data=body, headers=json_headers, stream=stream)
+
+        import gzip
+        res = session.request(method, url, data=gzip.compress(body, compresslevel=COMPRESS__level),
+                              headers={**json_headers, "Content-Encoding": "gzip"}, stream=stream)
+        if res.status_code == COMPRESS__rejected_status or \
+                (res.status_code == 400 and any(message in res.text.lower() for message in COMPRESS__rejected_messages)):
+            res.close()
+            self.compression_rejected.add(session)
+            self.log("The server rejected a compressed request, sending requests to it uncompressed")
+            res = session.request(method, url, data=body, headers=json_headers, stream=stream)
+        return res
 
     @staticmethod
     def time_delta_ms(start_time: datetime, end_time: datetime) -> int:
         return int(round((end_time - start_time).total_seconds() * 1000))
 
-    def request_handler(self, method, endpoint, send_json=None, handle_error: bool = True, format_as_query_output: bool = True,
-                        compress_output_unless: list = None, line_offset: int = 0, silent_success: bool = False):
-        conn = self.get_current_connection()
+    def authenticate(self, conn: ConnectionInfo):
+        # Must be called with conn as the current connection
         if conn.oauth_token is None:
             if conn.password.startswith(MARKER__bypass):
                 conn.oauth_token = {HEADER__security_bypass: conn.password.split(MARKER__bypass)[1]}
@@ -254,45 +754,109 @@ class State:
                 conn.oauth_token = {HEADER__security_bypass_jaaql: conn.password.split(MARKER__jaaql_bypass)[1]}
             else:
                 self._fetch_oauth_token_for_current_connection()
-
-        start_time = datetime.now()
-        res = requests.request(method, conn.get_http_url() + endpoint, json=send_json, headers=conn.oauth_token)
-
-        if res.status_code == 401:
-            self.log("Refreshing oauth token")
+        elif conn.oauth_token_expires is not None and conn.oauth_token_expires - TOKEN__refresh_margin_seconds <= time.time():
+            self.log("Refreshing oauth token before it expires")
             self._fetch_oauth_token_for_current_connection()
-            start_time = datetime.now()
-            res = requests.request(method, conn.get_http_url() + endpoint, json=send_json, headers=conn.oauth_token)
 
-        self.log("Request took " + str(State.time_delta_ms(start_time, datetime.now())) + "ms")
+    def request_handler(self, method, endpoint, send_json=None, handle_error: bool = True, format_as_query_output: bool = True,
+                        compress_output_unless: list = None, line_offset: int = 0, silent_success: bool = False, stream: bool = False):
+        with trace_span(self, endpoint, "request") as trace_args:
+            conn = self.get_current_connection()
+            self.authenticate(conn)
 
+            session = self.get_http_session(conn)
+            start_time = datetime.now()
+            stream = stream or (self.stream_results and endpoint == ENDPOINT__submit)
+            sent_at = time.perf_counter()
+            res = self.send_request(session, method, conn.get_http_url() + endpoint, send_json, conn.oauth_token, stream=stream)
+
+            if res.status_code == 401:
+                res.close()
+                self.log("Refreshing oauth token")
+                self._fetch_oauth_token_for_current_connection(use_token_cache=False)
+                start_time = datetime.now()
+                sent_at = time.perf_counter()
+                res = self.send_request(session, method, conn.get_http_url() + endpoint, send_json, conn.oauth_token, stream=stream)
+
+            self.log("Request took " + str(State.time_delta_ms(start_time, datetime.now())) + "ms")
+            if self.tracer is not None:
+                self.trace_response(res, endpoint, sent_at, trace_args)
+            if self.profiler is not None and endpoint == ENDPOINT__submit:
+                self.profile_statement(time.perf_counter() - sent_at, send_json, line_offset)
+
+            return self.handle_response(res, endpoint, send_json, handle_error=handle_error, format_as_query_output=format_as_query_output,
+                                        compress_output_unless=compress_output_unless, line_offset=line_offset, silent_success=silent_success)
+
+    def profile_statement(self, seconds: float, send_json: dict, line_offset: int):
+        # Recorded before the response is handled, as reporting an error moves cur_file_line
+        conn = self.get_current_connection()
+        self.profiler.add_statement({
+            "ms": round(seconds * 1000, 1),
+            "file": self.file_name,
+            "line": buffer_start_line(self.cur_file_line, line_offset, send_json["query"]) if self.is_script() else None,
+            "connection": self._current_connection,
+            "database": send_json.get("database", conn.database),
+            "query": first_line(send_json["query"])[:PROFILE__query_chars]
+        })
+
+    def trace_response(self, res, endpoint: str, sent_at: float, trace_args: dict):
+        # "server" runs from sending to the response headers (any new connection is set up within it), "download" from there
+        # until the body has been read, unless the body is streamed, when it is read whilst decoding
+        received_at = time.perf_counter()
+        headers_at = min(sent_at + res.elapsed.total_seconds(), received_at)
+        self.tracer.complete("server", "phase", sent_at, headers_at)
+        if headers_at < received_at:
+            self.tracer.complete("download", "phase", headers_at, received_at)
+        trace_args.update({
+            "endpoint": endpoint,
+            "payload_bytes": len(res.request.body) if res.request.body is not None else 0,  # As sent, gzipped with --compress
+            "response_bytes": res.headers.get("Content-Length"),
+            "status": res.status_code,
+            "outcome": "ok" if res.status_code == 200 else "error"
+        })
+
+    def handle_response(self, res, endpoint, send_json=None, handle_error: bool = True, format_as_query_output: bool = True,
+                        compress_output_unless: list = None, line_offset: int = 0, silent_success: bool = False):
         if res.status_code == 200:
             if silent_success:
                 return res
 
             if format_as_query_output:
+                is_streamed = self.stream_results and endpoint == ENDPOINT__submit
+                if not self.is_verbose:
+                    # Query output is only ever logged, so without -v the body is never decoded or scanned
+                    if is_streamed:
+                        drain_response(res)
+                    return res
+
+                with trace_span(self, "decode", "phase"):
+                    if is_streamed:
+                        result = JSONResultStream.from_response(res).open()
+                    else:
+                        result = JSONResultStream.from_json(res.json())
                 was_explain = False
                 if send_json is not None:
                     if "query" in send_json:
                         was_explain = len([line for line in split_by_lines(send_json["query"]) if
                                            line.strip().startswith("EXPLAIN ANALYZE")]) != 0
 
-                if was_explain:
-                    rows = res.json()["rows"]
-                    self.log("")
-                    self.log("")
-                    for row in rows:
-                        self.log(row[0])
-                else:
-                    format_query_output(self, res.json())
+                with trace_span(self, "render", "phase"):
+                    if was_explain:
+                        self.log("")
+                        self.log("")
+                        for row in result.iter_rows():
+                            self.log(row[0])
+                    else:
+                        format_streamed_query_output(self, result)
             else:
-                if compress_output_unless is not None and isinstance(res.json(), list):
+                json_output = res.json()
+                if compress_output_unless is not None and isinstance(json_output, list):
                     perhaps_expanded = ["\n    ".join(json.dumps(itm, indent=4 if any(
                         [itm.get(val) is not None for val in compress_output_unless]) else None).split("\n")) for itm in
-                                        res.json()]
+                                        json_output]
                     print("[\n    " + ",\n    ".join(perhaps_expanded) + "\n]")
                 else:
-                    print(json.dumps(res.json(), indent=4))
+                    print(json.dumps(json_output, indent=4))
         else:
             if handle_error:
                 if endpoint == ENDPOINT__submit:
@@ -302,8 +866,6 @@ class State:
 
         return res
 
-        return res
-
 
 def split_by_lines(split_str, gap=1):
     split_str = split_str.split("".join(["\r\n"] * gap))
@@ -357,95 +919,402 @@ def get_connection_info(state: State, connection_name: str = None, file_name: st
             print_error(state, "Could not find named credentials file '" + connection_name + "' located at '" + file_name +
                         "', using working directory " + os.getcwd())
     except Exception:
+        import traceback
         traceback.print_exc()
         print_error(state, "Could not load the credential file '" + connection_name + "'. Is the file formatted correctly?")
 
 
-def format_output_row(data, max_length, data_types, breaches):
-    builder = ""
-    for col, the_length, data_type, did_breach in zip(data, max_length, data_types, breaches):
-        col_str = str(col) if col is not None else "null"
-        builder += "|"
-        spacing = "".join([" "] * max(the_length - len(col_str), 0))
-        if did_breach and len(col_str) > the_length:
-            col_str = col_str[0:min(the_length, len(col_str)) - 3]
-            col_str += "..."
+def drain_response(res):
+    # Reads a streamed body to its end without keeping it, so the keep-alive connection goes back to the pool
+    for _ in res.iter_content(STREAM__chunk_size):
+        pass
+
+
+class JSONResultStream:
+    """
+    Decodes a /submit response body, {"columns": [...], "rows": [[...], ...]}, as it arrives. Members before "rows" are
+    decoded by open(), iter_rows() then yields the rows one at a time followed by decoding any members after them, so no
+    more than a chunk of the body is held at once. Should "rows" come before "columns" the rows are read into memory, as
+    they cannot be used without their columns
+    """
+
+    _whitespace = re.compile(r"[ \t\n\r]*")
+    _whitespace_chars = " \t\n\r"
+    _number_chars = "0123456789.eE+-"
+
+    def __init__(self, chunks):
+        self._chunks = iter(chunks)
+        self._buffer = ""
+        self._pos = 0
+        self._exhausted = False
+        self._decoder = json.JSONDecoder()
+        self._rows_read = False
+        self.fields = {}
+        self.streaming_rows = False
+
+    @staticmethod
+    def from_response(res):
+        decoder = codecs.getincrementaldecoder(res.encoding or "utf-8")(errors="replace")
+
+        def chunks():
+            for chunk in res.iter_content(STREAM__chunk_size):
+                yield decoder.decode(chunk)
+            yield decoder.decode(b"", final=True)
+
+        return JSONResultStream(chunks())
+
+    @staticmethod
+    def from_json(json_output):
+        # Wraps an already decoded body so both kinds of response can be handled alike
+        stream = JSONResultStream([])
+        stream.fields = json_output
+        stream._rows_read = True
+        return stream
+
+    def _read_more(self) -> bool:
+        # Reads at least as much again as is buffered, so a value retried after a short read costs amortised linear time
+        wanted = max(len(self._buffer) - self._pos, 1)
+        read = []
+        read_len = 0
+        while read_len < wanted:
+            chunk = next(self._chunks, None)
+            if chunk is None:
+                self._exhausted = True
+                break
+            read.append(chunk)
+            read_len += len(chunk)
+
+        if read_len == 0:
+            return False
+        self._buffer = self._buffer[self._pos:] + "".join(read)
+        self._pos = 0
+        return True
+
+    def _peek(self):
+        # Skips whitespace and returns the next character, None at the end of the body
+        while True:
+            self._pos = JSONResultStream._whitespace.match(self._buffer, self._pos).end()
+            if self._pos < len(self._buffer):
+                return self._buffer[self._pos]
+            if not self._read_more():
+                return None
+
+    def _expect(self, chars: str) -> str:
+        char = self._peek()
+        if char is None or char not in chars:
+            raise JSONDecodeError("Expecting one of '" + chars + "'", self._buffer, self._pos)
+        self._pos += 1
+        return char
+
+    def _value(self):
+        self._peek()
+        while True:
+            try:
+                value, end = self._decoder.raw_decode(self._buffer, self._pos)
+                # A number cut short by the end of a chunk decodes, but is followed by the end or by more of the number
+                if self._exhausted or (end < len(self._buffer) and self._buffer[end] not in JSONResultStream._number_chars):
+                    self._pos = end
+                    return value
+            except JSONDecodeError:
+                if self._exhausted:
+                    raise
+            self._read_more()
+
+    def _members(self):
+        while True:
+            key = self._value()
+            if not isinstance(key, str):
+                raise JSONDecodeError("Expecting property name", self._buffer, self._pos)
+            self._expect(":")
+            if key == "rows" and not self._rows_read and self._peek() == "[":
+                self._pos += 1
+                self._rows_read = True
+                if "columns" in self.fields:
+                    self.streaming_rows = True
+                    return
+                self.fields["rows"] = list(self._rows())
+            else:
+                self.fields[key] = self._value()
+
+            if self._expect(",}") == "}":
+                return
+
+    def _rows(self):
+        if self._peek() == "]":
+            self._pos += 1
+            return
+        raw_decode = self._decoder.raw_decode
+        skip_whitespace = JSONResultStream._whitespace.match
+        while True:
+            # Rows wholly within the buffer are decoded directly, a row cut by the end of a chunk takes the careful path
+            buffer = self._buffer
+            pos = self._pos
+            if buffer[pos:pos + 1] in JSONResultStream._whitespace_chars:
+                pos = skip_whitespace(buffer, pos).end()
+            try:
+                row, end = raw_decode(buffer, pos)
+                separator = buffer[end:end + 1]
+                if separator in JSONResultStream._whitespace_chars:
+                    end = skip_whitespace(buffer, end).end()
+                    separator = buffer[end:end + 1]
+            except JSONDecodeError:
+                separator = None
+            if separator == ",":
+                self._pos = end + 1
+                yield row
+                continue
+            if separator == "]":
+                self._pos = end + 1
+                yield row
+                return
+
+            yield self._value()
+            if self._expect(",]") == "]":
+                return
+
+    def open(self):
+        self._expect("{")
+        if self._peek() == "}":
+            self._pos += 1
         else:
-            col_str = col_str[0:min(the_length, len(col_str))]
-        if data_type == str:
-            builder += col_str + spacing
+            self._members()
+        return self
+
+    def iter_rows(self):
+        if not self.streaming_rows:
+            yield from self.fields.get("rows", [])
+            return
+
+        yield from self._rows()
+        self.streaming_rows = False
+        if self._expect(",}") == ",":
+            self._members()
+
+    def to_json(self) -> dict:
+        if self.streaming_rows:
+            rows = list(self.iter_rows())
+            self.fields["rows"] = rows
+        return self.fields
+
+
+class QueryResult:
+    """
+    A /submit result held by column. A column of integers or of floats, with no nulls, is kept in a typed array, any other
+    column as a list. Slicing gives a view over the same columns without copying them, so the renderer, assertions and
+    exports can all share the one copy of a result
+    column_types: the type of each value in the first row, as used to align the columns
+    """
+
+    _typecodes = {int: "q", float: "d"}
+
+    def __init__(self, columns: list, data: list, column_types: list, num_rows: int, start: int = 0, stop: int = None):
+        self.columns = columns
+        self.column_types = column_types
+        self._data = data
+        self._num_rows = num_rows
+        self._start = start
+        self._stop = num_rows if stop is None else stop
+
+    @staticmethod
+    def from_rows(columns: list, rows):
+        data = [[] for _ in columns]
+        kinds = [None] * len(columns)
+        column_types = [type(None)] * len(columns)
+        num_rows = 0
+        for row in rows:
+            if not isinstance(row, list) or len(row) != len(columns):
+                raise ValueError("Row %d does not have one value per column" % (num_rows + 1))
+            if num_rows == 0:
+                column_types = [type(value) for value in row]
+                kinds = [col_type if col_type in QueryResult._typecodes else None for col_type in column_types]
+                data = [array(QueryResult._typecodes[kind]) if kind is not None else [] for kind in kinds]
+
+            for col_idx, value in enumerate(row):
+                if kinds[col_idx] is not None:
+                    if type(value) is kinds[col_idx]:  # Not isinstance, a bool must not be stored as an int
+                        try:
+                            data[col_idx].append(value)
+                            continue
+                        except OverflowError:
+                            pass
+                    kinds[col_idx] = None
+                    data[col_idx] = data[col_idx].tolist()
+                data[col_idx].append(value)
+            num_rows += 1
+
+        return QueryResult(columns, data, column_types, num_rows)
+
+    def __len__(self):
+        return self._stop - self._start
+
+    def __getitem__(self, key: slice):
+        start, stop, _ = key.indices(len(self))
+        return QueryResult(self.columns, self._data, self.column_types, self._num_rows, self._start + start,
+                           self._start + max(start, stop))
+
+    def column(self, col_idx: int):
+        column = self._data[col_idx]
+        if isinstance(column, array):
+            return memoryview(column)[self._start:self._stop]
+        return islice(column, self._start, self._stop)
+
+    def row(self, row_idx: int) -> list:
+        return [column[self._start + row_idx] for column in self._data]
+
+    def iter_rows(self):
+        if len(self._data) == 0:
+            return ([] for _ in range(len(self)))
+        return map(list, zip(*[self.column(col_idx) for col_idx in range(len(self._data))]))
+
+    def to_dicts(self) -> list:
+        return [dict(zip(self.columns, row)) for row in self.iter_rows()]
+
+
+def format_output_row(cells, widths, left_aligned, breaches):
+    # cells are already strings, each rendered into its column padded or truncated to the column width
+    parts = []
+    for col_str, the_length, is_left_aligned, did_breach in zip(cells, widths, left_aligned, breaches):
+        spacing = " " * max(the_length - len(col_str), 0)
+        if did_breach and len(col_str) > the_length:
+            col_str = col_str[0:the_length - 3] + "..."
         else:
-            builder += spacing + col_str
-    builder += "|"
-    return builder
+            col_str = col_str[0:the_length]
+        parts.append(col_str + spacing if is_left_aligned else spacing + col_str)
+    return "|" + "|".join(parts) + "|"
 
 
 def format_output_divider(max_length):
-    builder = ""
+    return "+" + "+".join(["-" * x for x in max_length]) + "+"
+
 
-    for x in max_length:
-        builder += "+"
-        builder += "".join(["-"] * x)
+def fit_column_widths(widths, line_length_max):
+    """
+    Shrinks the widest columns until the row, dividers included, fits in line_length_max. The result is that of shaving
+    one character at a time off the widest column (the leftmost on ties), computed directly: every column wider than
+    some level is cut to that level or one above it, the leftmost of them taking the lower level
+    Returns the new widths and, per column, whether it was cut
+    """
+    budget = line_length_max - len(widths)
+    if sum(widths) <= budget:
+        return widths, [False] * len(widths)
+
+    if budget < 0:  # Not even empty columns fit, every column is emptied and the leftmost absorbs the rest
+        fitted = [0] * len(widths)
+        fitted[0] = budget
+        return fitted, [new_width < width for new_width, width in zip(fitted, widths)]
+
+    ordered = sorted(widths, reverse=True)
+    remaining = sum(widths)
+    level = 0
+    for capped, width in enumerate(ordered, 1):
+        remaining -= width
+        level = (budget - remaining) // capped
+        if level >= (ordered[capped] if capped < len(ordered) else 0):
+            break
+
+    to_lower = sum([min(width, level + 1) for width in widths]) - budget
+    fitted = []
+    for width in widths:
+        if width > level:
+            fitted.append(level if to_lower > 0 else level + 1)
+            to_lower -= 1
+        else:
+            fitted.append(width)
 
-    builder += "+"
-    return builder
+    return fitted, [new_width < width for new_width, width in zip(fitted, widths)]
 
 
-def format_query_output(state, json_output):
-    if "rows" not in json_output:
-        return None
-    str_num_rows = "(" + str(len(json_output["rows"])) + " " + ("row" if len(json_output["rows"]) == 1 else "rows") + ")"
+def format_row_count(num_rows: int) -> str:
+    return "(" + str(num_rows) + " " + ("row" if num_rows == 1 else "rows") + ")"
 
-    if len(json_output["rows"]) > 50:
+
+def format_table(result: QueryResult, is_truncated: bool):
+    # Each displayed cell is stringified exactly once, a column at a time, rows that will not be displayed are never looked at
+    columns = result.columns
+    col_strs = [["null" if col is None else str(col) for col in result.column(col_idx)] for col_idx in range(len(columns))]
+    cells = list(zip(*col_strs)) if len(col_strs) != 0 else [()] * len(result)
+
+    if len(cells) != 0:
+        left_aligned = [col_type is str for col_type in result.column_types]
+        max_length = [max([len(col_str) for col_str in strs]) for strs in col_strs]
+        max_length, breaches = fit_column_widths(max_length, LINE_LENGTH_MAX)
+    else:
+        left_aligned = []
+        max_length = [len(col) for col in columns]
+        breaches = [False] * len(max_length)
+
+    divider = format_output_divider(max_length)
+    header_breaches = [False] * len(max_length)
+    lines = [divider, format_output_row(columns, max_length, [True] * len(columns), header_breaches), divider]
+
+    if is_truncated:
+        cells.append(["..." for _ in columns])
+
+    for row in cells:
+        lines.append(format_output_row(row, max_length, left_aligned, breaches))
+
+    if len(cells) != 0:
+        lines.append(divider)
+
+    return lines
+
+
+def format_result(state, result: QueryResult, num_rows: int = None):
+    """
+    num_rows: the size of the whole result when result holds only the rows to display
+    """
+    if num_rows is None:
+        num_rows = len(result)
+    str_num_rows = format_row_count(num_rows)
+
+    if num_rows > 50:
         state.log(str_num_rows)
 
-    max_length = []
-    types = []
-    first_pass = True
-    for row in json_output["rows"]:
-        for col, col_idx in zip(row, range(len(row))):
-            col_str = str(col)
-            if first_pass:
-                max_length.append(len(col_str))
-                types.append(type(col))
-            elif len(col_str) > max_length[col_idx]:
-                max_length[col_idx] = len(col_str)
-        first_pass = False
+    is_truncated = num_rows > ROWS_MAX and not state.file_name
+    if is_truncated:
+        result = result[0:ROWS_MAX]
 
-    breaches = [False] * len(max_length)
+    lines = format_table(result, is_truncated)
+    lines.append(str_num_rows)
+    state.log("\n".join(lines))
 
-    while sum(max_length) + len(max_length) > LINE_LENGTH_MAX:
-        max_idx = 0
-        max_len = 0
-        for cur_len, col_idx in zip(max_length, range(len(max_length))):
-            if cur_len > max_len:
-                max_len = cur_len
-                max_idx = col_idx
-        breaches[max_idx] = True
-        max_length[max_idx] -= 1
 
-    if first_pass:
-        for col in json_output["columns"]:
-            max_length.append(len(col))
+def format_query_output(state, json_output):
+    if "rows" not in json_output:
+        return None
+    rows = json_output["rows"]
+    shown = rows if state.file_name else islice(rows, ROWS_MAX)
+    format_result(state, QueryResult.from_rows(json_output["columns"], shown), num_rows=len(rows))
 
-    state.log(format_output_divider(max_length))
-    state.log(format_output_row(json_output["columns"], max_length, [str] * len(json_output["columns"]), [False] * len(max_length)))
-    state.log(format_output_divider(max_length))
 
-    if len(json_output["rows"]) > ROWS_MAX and not state.file_name:
-        json_output["rows"] = json_output["rows"][0:ROWS_MAX]
-        json_output["rows"].append(["..." for _ in json_output["columns"]])
+def format_streamed_query_output(state, stream: JSONResultStream):
+    if not stream.streaming_rows:
+        return format_query_output(state, stream.to_json())
 
-    for row in json_output["rows"]:
-        state.log(format_output_row(row, max_length, types, breaches))
+    columns = stream.fields["columns"]
+    rows = stream.iter_rows()
+    if not state.file_name:
+        shown = QueryResult.from_rows(columns, islice(rows, ROWS_MAX))
+        return format_result(state, shown, num_rows=len(shown) + sum(1 for _ in rows))
 
-    if len(json_output["rows"]) != 0:
-        state.log(format_output_divider(max_length))
+    page = QueryResult.from_rows(columns, islice(rows, STREAM__page_rows))
+    no_row = object()
+    next_row = next(rows, no_row)
+    if next_row is no_row:
+        return format_result(state, page)
 
-    state.log(str_num_rows)
+    # Too many rows to measure at once, each page is laid out as its own table and the count comes at the end
+    rows = chain([next_row], rows)
+    num_rows = 0
+    while len(page) != 0:
+        num_rows += len(page)
+        state.log("\n".join(format_table(page, False)))
+        page = QueryResult.from_rows(columns, islice(rows, STREAM__page_rows))
+    state.log(format_row_count(num_rows))
 
 
 def handle_login(state, jaaql_url: str = None):
+    from getpass import getpass
     load_file = False
     username = None
     password = None
@@ -461,45 +1330,96 @@ def handle_login(state, jaaql_url: str = None):
     return ConnectionInfo(jaaql_url, username, password, None, state.override_url)
 
 
+def buffer_start_line(cur_file_line: int, line_offset: int, buffer: str) -> int:
+    # The line a buffer submitted from cur_file_line starts on. \g usually has the line after the buffer to itself, but it
+    # may end the buffer's last line instead (SELECT 1 \g), when the buffer is left without a final line break
+    return cur_file_line - line_offset - (1 if buffer.endswith("\n") else 0)
+
+
 def dump_buffer(state, start: str = "\n\n"):
     return ("%sBuffer [" % start) + str(len(state.fetched_query.strip())) + "]:\n" + state.fetched_query.strip() + "\n\n"
 
 
-def get_message(state, err, line_offset, buffer, additional_line_message: str = ""):
-    caller = getframeinfo(stack()[1][0])
+def get_message(state, err, line_offset, buffer, additional_line_message: str = "", recoverable: bool = False,
+                failure_line: int = None):
+    if state.async_engine is not None and not state.async_engine.completing and len(state.async_engine.pending) != 0:
+        # Earlier submits still in flight come first in the script, so their errors must be reported first
+        saved = (state.file_name, state.cur_file_line, state.fetched_query)
+        state.async_engine.wait_all()
+        state.file_name, state.cur_file_line, state.fetched_query = saved
     file_message = ""
     if state.file_name is not None:
         file_message = "Using JAAQL " + str(VERSION) + "\nError on " + additional_line_message + "line %d of file '%s':\n" % (state.cur_file_line - line_offset, state.file_name)
-    debug_message = " [%s:%d]" % (caller.filename, caller.lineno)
-    if not state.is_script() or not state.is_debugging:
-        debug_message = ""
+    debug_message = ""
+    if state.is_script() and state.is_debugging:
+        caller = sys._getframe(1)
+        debug_message = " [%s:%d]" % (caller.f_code.co_filename, caller.f_lineno)
     buffer = "\n" + buffer
     if not state.is_script():
         buffer = ""
 
+    server_message = None
     try:
         json_err = json.loads(err)
         if json_err.get("message") is not None:
+            server_message = json_err["message"]
             err = json_err["message"] + "\n\n" + err
     except JSONDecodeError:
         pass
 
     print(file_message + err + debug_message + buffer, file=sys.stderr)
     if state.is_script():
-        if state.do_exit:
+        if recoverable and state.keep_going:
+            record_failure(state, server_message if server_message is not None else err,
+                           failure_line if failure_line is not None else state.cur_file_line - line_offset)
+            raise StatementFailure(file_message + err + debug_message + buffer)
+        elif state.do_exit:
             exit(1)
         else:
             raise JAAQLMonitorException(file_message + err + debug_message + buffer)
 
 
+def first_line(text: str) -> str:
+    return next((line.strip() for line in text.splitlines() if len(line.strip()) != 0), "")
+
+
+def record_failure(state, message: str, line: int):
+    # Only the first line of each is kept, the full error has just been printed
+    message = first_line(message.replace("\\<b>", "").replace("\\</b>", ""))
+    try:
+        message = json.loads(message)["message"]
+    except (JSONDecodeError, TypeError, KeyError):
+        pass
+    state.failures.append({
+        "file": state.file_name,
+        "line": line,
+        "buffer": first_line(state.fetched_query)[:KEEP_GOING__excerpt_chars],
+        "message": str(message)
+    })
+
+
+def report_failures(state):
+    msg = "%d statement(s) failed:\n" % len(state.failures) + "\n".join(
+        "    %s:%d: %s" % (failure["file"], failure["line"], failure["message"]) +
+        ("\n        " + failure["buffer"] if len(failure["buffer"]) != 0 else "") for failure in state.failures)
+    print(msg, file=sys.stderr)
+    if state.do_exit:
+        exit(1)
+    else:
+        raise JAAQLMonitorException(msg)
+
+
 def submit_error(state, err, line_offset: int = 0):
     divided_lines = [line for line in [err_line.strip() for err_line in err.split("\n")]]
     lines_with_line_number = [line for line in divided_lines if line.startswith("LINE ")]
     marker_lines = [line for line in [err_line for err_line in err.split("\n")] if line.strip() == "^"]
 
     print_buffer = dump_buffer(state, "")
+    file_line = state.cur_file_line
+    failure_line = None
     if len(lines_with_line_number) != 0:
         line_err_num = int(lines_with_line_number[0].split("LINE ")[1].split(":")[0])
+        failure_line = buffer_start_line(file_line, line_offset, state.fetched_query) + line_err_num - 1
         state.cur_file_line = line_err_num
         buffer_lines = state.fetched_query.strip().replace("\r\n", "\n").split("\n")
         start_line_num = max(0, line_err_num - 10) + 1
@@ -522,13 +1442,24 @@ def submit_error(state, err, line_offset: int = 0):
 
         err = "\\<b>" + err + "\\</b>\n\n" + "\n".join(buffer_lines)
         err = err + "\n\n"
-    get_message(state, err, line_offset, print_buffer)
+    try:
+        get_message(state, err, line_offset, print_buffer, recoverable=True, failure_line=failure_line)
+    finally:
+        state.cur_file_line = file_line  # Under --keep-going the script carries on from the line it had reached
 
 
 def print_error(state, err, line_offset: int = 0):
     get_message(state, err, line_offset, dump_buffer(state, ""))
 
 
+def print_statement_error(state, err, line_offset: int = 0):
+    """
+    Reports a statement that ran and failed, such as an assertion that did not hold. Unlike print_error, with --keep-going
+    the failure is recorded and the script carries on with the next statement
+    """
+    get_message(state, err, line_offset, dump_buffer(state, ""), recoverable=True)
+
+
 def freeze_defrost_instance(state: State, freeze: bool):
     endpoint = ENDPOINT__freeze if freeze else ENDPOINT__defrost
     verb = "freezing" if freeze else "defrosting"
@@ -552,28 +1483,49 @@ def wait_for_server_restart(state: State):
     # cache, and works with no `database` (like the build's own paramless submits). The probe itself
     # absorbs the single post-install restart. Require several consecutive successes so a brief green
     # flap mid-restart is not mistaken for readiness.
+    #
+    # A probe that fails, or whose kept alive connection the restart dropped, shows the restart has happened. From then on
+    # probes follow the workers coming back closely: quickly at first, backing off whilst they keep failing, and confirming
+    # readiness with quick successes. Until a failure is seen a success may still be the old worker, before the restart has
+    # torn it down, so those are spaced as far apart as they always were
     conn = state.get_current_connection()
     url = conn.get_http_url() + ENDPOINT__submit
+    session = state.get_http_session(conn)  # Kept alive, so a probe costs a request and not a new connection
     state.log("Waiting for JAAQL to be able to serve queries again after wipe...")
 
     def can_serve():
         try:
-            return requests.post(url, json={"query": "SELECT 1", "database": "postgres", "autocommit": True},
+            return session.post(url, json={"query": "SELECT 1", "database": "postgres", "autocommit": True},
                                  headers=conn.oauth_token, timeout=5).status_code == 200
-        except requests.exceptions.RequestException:
+        except state.http_errors():
             return False
 
-    deadline = time.time() + WAIT__healthy_seconds
+    started_at = time.perf_counter()
+    deadline = started_at + WAIT__healthy_seconds
     consecutive = 0
-    while time.time() < deadline:
-        if can_serve():
-            consecutive += 1
-            if consecutive >= WAIT__healthy_stable_checks:
-                state.log("JAAQL healthy again.")
-                return
-        else:
-            consecutive = 0
-        time.sleep(WAIT__healthy_poll_interval)
+    probes = 0
+    restart_seen = False
+    interval = WAIT__healthy_poll_min
+    with trace_span(state, "wait for restart", "wait") as trace_args:
+        while time.perf_counter() < deadline:
+            probes += 1
+            if can_serve():
+                consecutive += 1
+                if consecutive >= WAIT__healthy_stable_checks:
+                    waited = time.perf_counter() - started_at
+                    state.log("JAAQL healthy again after %dms and %d probes." % (waited * 1000, probes))
+                    trace_args.update({"probes": probes, "restart_seen": restart_seen})
+                    if state.profiler is not None:
+                        state.profiler.add_wait({"file": state.file_name, "line": state.cur_file_line, "ms": round(waited * 1000, 1),
+                                                 "probes": probes, "restart_seen": restart_seen})
+                    return
+                interval = WAIT__healthy_poll_min if restart_seen else WAIT__healthy_poll_interval
+            else:
+                interval = WAIT__healthy_poll_min if consecutive != 0 or not restart_seen else min(interval * 2, WAIT__healthy_poll_max)
+                consecutive = 0
+                restart_seen = True
+            time.sleep(interval)
+        trace_args.update({"probes": probes, "restart_seen": restart_seen})
 
     print_error(state, "JAAQL did not become able to serve queries within %d seconds after the wipe" % WAIT__healthy_seconds)
 
@@ -648,7 +1600,46 @@ def federate_jaaql_user_account(state, credentials_name: str, connection_info: C
                     (credentials_name, username, res.status_code, res.text))
 
 
-def _render_rows_for_assertion_error(json_output, max_rows: int = 25) -> str:
+def split_template(buffer: str) -> tuple:
+    """
+    Splits a buffer in one scan into literal text (even indices) and the names of its {{parameter}} placeholders (odd indices)
+    """
+    return tuple(TEMPLATE__placeholder.split(buffer))
+
+
+@lru_cache(maxsize=TEMPLATE__cache_size)
+def compile_template(buffer: str) -> tuple:
+    return split_template(buffer)
+
+
+def render_template(state: State, buffer: str) -> str:
+    if "{{" not in buffer:
+        return buffer
+    if len(state.parameters) == 0 or len(buffer) > TEMPLATE__cache_max_chars:
+        parts = split_template(buffer)  # Nothing to substitute, or too big to keep: a generated data script is not held
+    else:
+        parts = compile_template(buffer)
+    if len(parts) == 1:
+        return buffer
+
+    rendered = list(parts)
+    unresolved = []
+    for idx in range(1, len(parts), 2):
+        value = state.parameters.get(parts[idx])
+        if value is None:
+            rendered[idx] = "{{" + parts[idx] + "}}"  # Left as written, it may well be intended literally
+            unresolved.append(rendered[idx])
+        else:
+            rendered[idx] = value
+            state.used_parameters.add(parts[idx])
+
+    if len(unresolved) != 0:
+        state.log("Unresolved parameter placeholder(s) " + ", ".join(unresolved))
+
+    return "".join(rendered)
+
+
+def _render_rows_for_assertion_error(json_output, max_rows: int = 25, num_rows: int = None, result: QueryResult = None) -> str:
     """
     Render returned rows as JSON-ish data for assertion failures.
     Keeps it readable and avoids your output-table truncation rules.
@@ -665,7 +1656,9 @@ def _render_rows_for_assertion_error(json_output, max_rows: int = 25) -> str:
     show_rows = rows[:max_rows]
 
     rendered = []
-    if isinstance(columns, list) and all(isinstance(c, str) for c in columns):
+    if result is not None and all(isinstance(c, str) for c in columns):
+        rendered = result[0:max_rows].to_dicts()
+    elif isinstance(columns, list) and all(isinstance(c, str) for c in columns):
         for row in show_rows:
             if isinstance(row, list) and len(row) == len(columns):
                 rendered.append({columns[i]: row[i] for i in range(len(columns))})
@@ -674,9 +1667,12 @@ def _render_rows_for_assertion_error(json_output, max_rows: int = 25) -> str:
     else:
         rendered = show_rows
 
+    if num_rows is None:
+        num_rows = len(rows)
+
     suffix = ""
-    if len(rows) > max_rows:
-        suffix = "\n... (%d more row(s) not shown)" % (len(rows) - max_rows)
+    if num_rows > max_rows:
+        suffix = "\n... (%d more row(s) not shown)" % (num_rows - max_rows)
 
     return json.dumps(rendered, indent=4, default=str) + suffix
 
@@ -698,8 +1694,7 @@ def on_go_expect_equals(state: State, expected_raw: str):
         return
 
     # Apply parameters exactly like on_go()
-    for parameter, value in state.parameters.items():
-        state.fetched_query = state.fetched_query.replace("{{" + parameter + "}}", value)
+    state.fetched_query = render_template(state, state.fetched_query)
 
     send_json = {"query": state.fetched_query}
 
@@ -723,6 +1718,12 @@ def on_go_expect_equals(state: State, expected_raw: str):
     # Keep the same line_offset strategy you use for normal submit errors
     line_offset = len(state.fetched_query.splitlines()) - 1
 
+    if state.async_engine is not None:
+        state.async_engine.submit(send_json, line_offset, expected_raw=expected_raw)
+        state.fetched_query = ""
+        state.query_parameters = None
+        return
+
     res = state.request_handler(
         METHOD__post,
         ENDPOINT__submit,
@@ -735,54 +1736,79 @@ def on_go_expect_equals(state: State, expected_raw: str):
     state.fetched_query = ""
     state.query_parameters = None
 
+    check_assertion(state, res, expected_raw)
+
+
+def check_assertion(state: State, res, expected_raw: str):
     if res.status_code != 200:
         # request_handler already printed submit_error / print_error
         return
 
+    num_rows = None
     try:
-        json_output = res.json()
-    except JSONDecodeError:
-        print_error(state, "Assertion failed: server returned non-JSON response:\n\n" + res.text)
+        if state.stream_results:
+            # Only the rows an error would show are kept, the rest are just counted
+            result = JSONResultStream.from_response(res).open()
+            if result.streaming_rows:
+                rows = result.iter_rows()
+                shown = list(islice(rows, ASSERT__rows_shown))
+                num_rows = len(shown) + sum(1 for _ in rows)
+                result.fields["rows"] = shown
+            json_output = result.fields
+        else:
+            json_output = res.json()
+    except JSONDecodeError as ex:
+        print_statement_error(state, "Assertion failed: server returned non-JSON response:\n\n" + (str(ex) if state.stream_results else res.text))
         return
 
     rows = json_output.get("rows", None)
     columns = json_output.get("columns", None)
 
     if rows is None:
-        print_error(state, "Assertion failed: server response did not contain 'rows'.\n\nResponse:\n" + json.dumps(json_output, indent=4, default=str))
+        print_statement_error(state, "Assertion failed: server response did not contain 'rows'.\n\nResponse:\n" + json.dumps(json_output, indent=4, default=str))
         return
 
     if not isinstance(rows, list):
-        print_error(state, "Assertion failed: response 'rows' was not a list.\n\nResponse:\n" + json.dumps(json_output, indent=4, default=str))
+        print_statement_error(state, "Assertion failed: response 'rows' was not a list.\n\nResponse:\n" + json.dumps(json_output, indent=4, default=str))
         return
 
+    if num_rows is None:
+        num_rows = len(rows)
+
     expected_is_null_marker = expected_raw.upper() == "(NULL)"
     expected_is_literal_null_string = expected_raw == "null"
     expected_display = expected_raw
 
     # 1) exactly 1 row
-    if len(rows) == 0:
-        print_error(state, "Assertion failed (\\=%s): query returned 0 rows (expected exactly 1 row)." % expected_display)
+    if num_rows == 0:
+        print_statement_error(state, "Assertion failed (\\=%s): query returned 0 rows (expected exactly 1 row)." % expected_display)
         return
 
-    if len(rows) != 1:
-        details = _render_rows_for_assertion_error(json_output, max_rows=25)
+    result = None
+    if isinstance(columns, list):
+        try:
+            result = QueryResult.from_rows(columns, islice(rows, ASSERT__rows_shown))
+        except ValueError:
+            pass  # Left to the checks on the raw row below
+
+    if num_rows != 1:
+        details = _render_rows_for_assertion_error(json_output, max_rows=ASSERT__rows_shown, num_rows=num_rows, result=result)
         msg = (
             "Assertion failed (\\=%s): query returned %d rows (expected exactly 1 row).\n\nReturned rows:\n%s"
-            % (expected_display, len(rows), details)
+            % (expected_display, num_rows, details)
         )
-        print_error(state, msg)
+        print_statement_error(state, msg)
         return
 
-    row = rows[0]
+    row = result.row(0) if result is not None else rows[0]
 
     # 2) exactly 1 value in that row
     if not isinstance(row, list):
-        print_error(state, "Assertion failed (\\=%s): row was not a list. Row value:\n%s" % (expected_display, repr(row)))
+        print_statement_error(state, "Assertion failed (\\=%s): row was not a list. Row value:\n%s" % (expected_display, repr(row)))
         return
 
     if len(row) == 0:
-        print_error(state, "Assertion failed (\\=%s): row had 0 values (expected exactly 1 value)." % expected_display)
+        print_statement_error(state, "Assertion failed (\\=%s): row had 0 values (expected exactly 1 value)." % expected_display)
         return
 
     if len(row) != 1:
@@ -795,7 +1821,7 @@ def on_go_expect_equals(state: State, expected_raw: str):
             "Assertion failed (\\=%s): query returned 1 row but %d values (expected exactly 1 value).\n\nReturned row:\n%s"
             % (expected_display, len(row), row_details)
         )
-        print_error(state, msg)
+        print_statement_error(state, msg)
         return
 
     actual = row[0]
@@ -807,7 +1833,7 @@ def on_go_expect_equals(state: State, expected_raw: str):
                 "Assertion failed (\\=%s): expected NULL but got %s (type=%s)."
                 % (expected_display, repr(actual), type(actual).__name__)
             )
-            print_error(state, msg)
+            print_statement_error(state, msg)
         return
 
     # Non-NULL marker expects a real value (possibly empty string)
@@ -819,7 +1845,7 @@ def on_go_expect_equals(state: State, expected_raw: str):
             "Assertion failed (\\=%s): expected '%s' but query returned NULL."
             % (expected_display, expected_raw)
         ) + warn
-        print_error(state, msg)
+        print_statement_error(state, msg)
         return
 
     actual_str = str(actual)
@@ -832,13 +1858,12 @@ def on_go_expect_equals(state: State, expected_raw: str):
             "Actual repr: %s (type=%s)"
             % (expected_display, expected_raw, actual_str, repr(actual), type(actual).__name__)
         )
-        print_error(state, msg)
+        print_statement_error(state, msg)
         return
 
 
-def on_go(state):
-    for parameter, value in state.parameters.items():
-        state.fetched_query = state.fetched_query.replace("{{" + parameter + "}}", value)
+def build_submit_json(state) -> dict:
+    state.fetched_query = render_template(state, state.fetched_query)
 
     send_json = {"query": state.fetched_query}
     if state.query_parameters is not None:
@@ -856,10 +1881,340 @@ def on_go(state):
     if not state.prevent_unused_parameters:
         send_json["prevent_unused_parameters"] = False
 
-    state.request_handler(METHOD__post, ENDPOINT__submit, send_json=send_json, line_offset=len(state.fetched_query.splitlines()) - 1)
+    return send_json
+
+
+def on_go(state):
+    if state.export_file is not None:
+        if on_go_export(state, state.export_file, export_format_for_file(state, state.export_file), append=state.export_started):
+            state.export_started = True
+        return None
+
+    send_json = build_submit_json(state)
+    line_offset = len(state.fetched_query.splitlines()) - 1
+    if state.async_engine is not None:
+        state.async_engine.submit(send_json, line_offset)
+    elif state.batch_size > 1 and state.is_transactional:
+        queue_submit(state, send_json, line_offset)
+    else:
+        flush_submit_batch(state)
+        state.request_handler(METHOD__post, ENDPOINT__submit, send_json=send_json, line_offset=line_offset)
+
+    state.fetched_query = ""
+    state.query_parameters = None
+
+
+def export_format_for_file(state, file_name: str) -> str:
+    export_format = EXPORT__extensions.get(os.path.splitext(file_name)[1].lower())
+    if export_format is None:
+        print_error(state, "Cannot tell the export format from the file name '" + file_name + "'. Use a " +
+                    ", ".join(EXPORT__extensions.keys()) + " file or " + COMMAND__export + "<format> <file>")
+    return export_format
+
+
+def on_go_export(state, file_name: str, export_format: str, append: bool = False) -> bool:
+    """
+    Submits the buffer and streams its result into file_name, a page of rows at a time, rather than displaying it. Returns
+    whether file_name was written, which it is not for a statement returning no rows
+    """
+    flush_submit_batch(state)
+    if state.async_engine is not None:
+        state.async_engine.wait_all()
+
+    send_json = build_submit_json(state)
+    line_offset = len(state.fetched_query.splitlines()) - 1
+    res = state.request_handler(METHOD__post, ENDPOINT__submit, send_json=send_json, line_offset=line_offset, silent_success=True,
+                                stream=True)
+    exported = res.status_code == 200 and export_result(state, res, file_name, export_format, append=append)
 
     state.fetched_query = ""
     state.query_parameters = None
+    return exported
+
+
+def export_result(state, res, file_name: str, export_format: str, append: bool = False) -> bool:
+    # A csv file gets its header when it is created, appended results share it
+    import csv
+    try:
+        stream = JSONResultStream.from_response(res).open()
+    except JSONDecodeError as ex:
+        print_error(state, "Could not export, the server returned a non-JSON response: " + str(ex))
+        return False
+    columns = stream.fields.get("columns")
+    if not isinstance(columns, list):
+        state.log("Nothing to export to '%s', the statement returned no rows" % file_name)
+        return False
+
+    start_time = datetime.now()
+    num_rows = 0
+    rows = stream.iter_rows()
+    try:
+        with open(file_name, "a" if append else "w", encoding="UTF-8", newline="", buffering=EXPORT__buffer_size) as out_file:
+            writer = csv.writer(out_file) if export_format == EXPORT__csv else None
+            if writer is not None and not append:
+                writer.writerow(columns)
+
+            while True:
+                page = QueryResult.from_rows(columns, islice(rows, EXPORT__rows_per_write))
+                if len(page) == 0:
+                    break
+                num_rows += len(page)
+                if writer is not None:
+                    writer.writerows([[json.dumps(col) if isinstance(col, (list, dict)) else col for col in row]
+                                      for row in page.iter_rows()])
+                else:
+                    out_file.write("".join([json.dumps(row, default=str) + "\n" for row in page.to_dicts()]))
+    except OSError as ex:
+        print_error(state, "Could not export to '" + file_name + "': " + str(ex))
+        return False
+    except ValueError as ex:
+        print_error(state, "Could not export to '" + file_name + "': " + str(ex))
+        return False
+
+    took_ms = State.time_delta_ms(start_time, datetime.now())
+    state.log("Exported %d rows to '%s' in %dms (%d rows/s)" % (num_rows, file_name, took_ms, num_rows * 1000 // max(took_ms, 1)))
+    return True
+
+
+def queue_submit(state: State, send_json: dict, line_offset: int):
+    # Buffers are only coalesced while everything but the query text is identical, so the batch runs exactly as its parts would
+    batch_key = json.dumps([state.get_current_connection().username, {key: val for key, val in send_json.items() if key != "query"}],
+                           sort_keys=True, default=str)
+    if len(state.submit_batch) != 0 and (state.submit_batch[0]["key"] != batch_key or len(state.submit_batch) >= state.batch_size):
+        flush_submit_batch(state)
+
+    state.submit_batch.append({
+        "key": batch_key,
+        "send_json": send_json,
+        "file_name": state.file_name,
+        "cur_file_line": state.cur_file_line,
+        "line_offset": line_offset
+    })
+
+
+def _submit_batch_entry_error(state: State, entry: dict, err: str):
+    # Report an error as if the buffer had been submitted on its own, from where it was read
+    state.fetched_query = entry["send_json"]["query"]
+    state.file_name = entry["file_name"]
+    state.cur_file_line = entry["cur_file_line"]
+    submit_error(state, err, line_offset=entry["line_offset"])
+
+
+def flush_submit_batch(state: State):
+    batch = state.submit_batch
+    if len(batch) == 0:
+        return
+    state.submit_batch = []
+
+    # Buffers are joined with a lone ';' line so a trailing comment or missing terminator cannot swallow the next buffer
+    combined = ""
+    start_lines = []
+    for entry in batch:
+        query = entry["send_json"]["query"]
+        if not query.endswith("\n"):
+            query += "\n"
+        start_lines.append(combined.count("\n") + 1)
+        combined += query + ";\n"
+
+    send_json = {**batch[0]["send_json"], "query": combined}
+    state.log("Submitting %d buffers in one batch" % len(batch))
+    res = state.request_handler(METHOD__post, ENDPOINT__submit, send_json=send_json, handle_error=False)
+    if res.status_code == 200:
+        return
+
+    saved = (state.fetched_query, state.file_name, state.cur_file_line)
+    try:
+        err = res.text
+        line_numbers = [line.strip() for line in err.split("\n") if line.strip().startswith("LINE ")]
+        if len(line_numbers) != 0 and not state.keep_going:
+            # Rewrite the batch relative line (and the caret beneath it) to be relative to the buffer it came from
+            batch_line = int(line_numbers[0].split("LINE ")[1].split(":")[0])
+            entry_idx = max(idx for idx, start_line in enumerate(start_lines) if start_line <= batch_line)
+            entry_line = batch_line - start_lines[entry_idx] + 1
+            shift = len(str(batch_line)) - len(str(entry_line))
+            err_lines = []
+            for line in err.split("\n"):
+                if line.strip().startswith("LINE " + str(batch_line) + ":"):
+                    line = line.replace("LINE " + str(batch_line) + ":", "LINE " + str(entry_line) + ":", 1)
+                elif line.strip() == "^" and line.startswith(" " * shift):
+                    line = line[shift:]
+                err_lines.append(line)
+            _submit_batch_entry_error(state, batch[entry_idx], "\n".join(err_lines))
+        else:
+            # The batch ran as one transaction and was rolled back, so replay it one buffer at a time to find the culprit.
+            # With --keep-going every buffer is replayed, so each failure is recorded and the rest still run
+            state.log("Batch failed without a line number, replaying its buffers one at a time" if len(line_numbers) == 0 else
+                      "Batch failed, replaying its buffers one at a time")
+            for entry in batch:
+                res = state.request_handler(METHOD__post, ENDPOINT__submit, send_json=entry["send_json"], handle_error=False)
+                if res.status_code != 200:
+                    try:
+                        _submit_batch_entry_error(state, entry, res.text)
+                    except StatementFailure:
+                        continue
+                    break
+    finally:
+        state.fetched_query, state.file_name, state.cur_file_line = saved
+
+
+class AsyncSubmitEngine:
+    """
+    Sends /submit requests from an asyncio event loop on a background thread, one lane per connection. A lane sends its
+    requests one after another in script order, so each connection sees exactly the order of the script. Different
+    connections proceed concurrently only where the script declares them independent (\\switch jaaql account to @name
+    independently), any other switch waits for the submits in flight. Responses are handled back on the main thread in
+    script order, with the file, line and buffer of the request restored, so output and errors read exactly as they would
+    had the requests been synchronous
+    """
+
+    def __init__(self, state: State):
+        self.state = state
+        self.completing = False
+        self.pending = deque()
+        self._lanes = {}
+        import asyncio
+        from concurrent.futures import ThreadPoolExecutor
+
+        self._executor = ThreadPoolExecutor(max_workers=state.http_pool_size)
+        self._loop = asyncio.new_event_loop()
+        self._thread = threading.Thread(target=self._loop.run_forever, daemon=True)
+        self._thread.start()
+
+    def submit(self, send_json: dict, line_offset: int, expected_raw: str = None):
+        from concurrent.futures import Future
+
+        state = self.state
+        conn = state.get_current_connection()
+        state.authenticate(conn)
+        job = {
+            "connection_name": state._current_connection,
+            "session": state.get_http_session(conn),
+            "url": conn.get_http_url() + ENDPOINT__submit,
+            "headers": dict(conn.oauth_token),
+            "send_json": send_json,
+            "line_offset": line_offset,
+            "expected_raw": expected_raw,
+            "file_name": state.file_name,
+            "cur_file_line": state.cur_file_line,
+            "fetched_query": state.fetched_query,
+            "stream": state.stream_results,
+            "command": state.tracer.command if state.tracer is not None else None
+        }
+        result = Future()
+        self.pending.append((job, result))
+        self._loop.call_soon_threadsafe(self._enqueue, job, result)
+
+        if len(self.pending) > ASYNC__max_pending:
+            self.complete_oldest()
+
+    def _enqueue(self, job, result):
+        import asyncio
+
+        lane = self._lanes.get(job["connection_name"])
+        if lane is None:
+            lane = asyncio.Queue()
+            self._lanes[job["connection_name"]] = (lane, self._loop.create_task(self._run_lane(lane)))
+        else:
+            lane = lane[0]
+        lane.put_nowait((job, result))
+
+    async def _run_lane(self, lane: "asyncio.Queue"):
+        failed = False
+        refreshed = {}  # A token the server turned away (401) -> the one the main thread fetched in its place
+        while True:
+            job, result = await lane.get()
+            if failed:
+                result.cancel()  # The script stops at the earlier failure, later requests on the connection must not run
+                continue
+            try:
+                job["headers"] = refreshed.get(tuple(sorted(job["headers"].items())), job["headers"])
+                start_time = datetime.now()
+                res = await self._loop.run_in_executor(self._executor, self._send, job)
+                if res.status_code == 401:
+                    # Nothing more is sent on the connection until the main thread has resent this request, so it still
+                    # runs before the requests queued after it
+                    resumed = self._loop.create_future()
+                    result.set_result((res, State.time_delta_ms(start_time, datetime.now()), resumed))
+                    refreshed[tuple(sorted(job["headers"].items()))] = await resumed
+                    continue
+                result.set_result((res, State.time_delta_ms(start_time, datetime.now()), None))
+                failed = res.status_code != 200 and not self.state.keep_going  # With --keep-going a failure stops nothing
+            except Exception as ex:
+                result.set_exception(ex)
+                failed = True
+
+    def _send(self, job):
+        state = self.state
+        with trace_span(state, ENDPOINT__submit, "request", job["file_name"], job["cur_file_line"], job["command"]) as trace_args:
+            sent_at = time.perf_counter()
+            res = state.send_request(job["session"], METHOD__post, job["url"], job["send_json"], job["headers"], stream=job["stream"])
+            if state.tracer is not None:
+                state.trace_response(res, ENDPOINT__submit, sent_at, trace_args)
+            return res
+
+    def complete_oldest(self):
+        from concurrent.futures import CancelledError
+
+        job, result = self.pending.popleft()
+        try:
+            res, took_ms, resumed = result.result()
+        except CancelledError:
+            return
+
+        state = self.state
+        saved = (state._current_connection, state.file_name, state.cur_file_line, state.fetched_query)
+        state._current_connection = job["connection_name"]
+        state.file_name = job["file_name"]
+        state.cur_file_line = job["cur_file_line"]
+        state.fetched_query = job["fetched_query"]
+        self.completing = True
+        try:
+            if res.status_code == 401:
+                res.close()
+                state.log("Refreshing oauth token")
+                state._fetch_oauth_token_for_current_connection(use_token_cache=False)
+                start_time = datetime.now()
+                res = state.send_request(job["session"], METHOD__post, job["url"], job["send_json"],
+                                         state.get_current_connection().oauth_token, stream=job["stream"])
+                took_ms = State.time_delta_ms(start_time, datetime.now())
+                self._loop.call_soon_threadsafe(resumed.set_result, dict(state.get_current_connection().oauth_token))
+
+            state.log("Request took " + str(took_ms) + "ms")
+            if state.profiler is not None:
+                state.profile_statement(took_ms / 1000, job["send_json"], job["line_offset"])
+
+            if job["expected_raw"] is None:
+                state.handle_response(res, ENDPOINT__submit, job["send_json"], line_offset=job["line_offset"])
+            else:
+                state.handle_response(res, ENDPOINT__submit, job["send_json"], line_offset=job["line_offset"], silent_success=True)
+                state.fetched_query = ""
+                check_assertion(state, res, job["expected_raw"])
+        except StatementFailure:
+            pass  # Recorded under --keep-going, the submits after it were still sent
+        finally:
+            self.completing = False
+            state._current_connection, state.file_name, state.cur_file_line, state.fetched_query = saved
+
+    def wait_all(self):
+        while len(self.pending) != 0:
+            self.complete_oldest()
+
+    async def _cancel_lanes(self):
+        import asyncio
+
+        tasks = [task for _, task in self._lanes.values()]
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+    def close(self):
+        import asyncio
+
+        asyncio.run_coroutine_threadsafe(self._cancel_lanes(), self._loop).result()
+        self._loop.call_soon_threadsafe(self._loop.stop)
+        self._thread.join()
+        self._loop.close()
+        self._executor.shutdown(wait=False)
 
 
 def parse_user_printing_any_errors(state, potential_user, allow_spaces: bool = False):
@@ -898,40 +2253,107 @@ def fire_cron(state: State, cron_application, cron_command, cron_args):
         raise ex
 
 
-def read_file_lines_with_fallback(file_path, first_encoding='utf-8-sig', second_encoding='windows-1252', default_encoding='utf-8'):
-    try:
-        # Attempt to open with the first specified encoding
-        with open(file_path, 'r', encoding=first_encoding) as f:
-            return f.readlines()
-    except UnicodeDecodeError:
+class _MemoryReader(io.RawIOBase):
+    """
+    A readable stream over bytes or a memory map, so a loaded script can be decoded lazily without copying it
+    """
+
+    def __init__(self, data):
+        self._data = memoryview(data)
+        self._position = 0
+
+    def readable(self):
+        return True
+
+    def readinto(self, buffer):
+        chunk = self._data[self._position:self._position + len(buffer)]
+        buffer[:len(chunk)] = chunk
+        self._position += len(chunk)
+        return len(chunk)
+
+    def close(self):
+        if not self.closed:
+            self._data.release()
+        super().close()
+
+
+def _detect_encoding(data, encodings):
+    if data[:len(codecs.BOM_UTF8)] == codecs.BOM_UTF8:
+        encodings = ['utf-8-sig']
+    elif data[:2] in [codecs.BOM_UTF16_LE, codecs.BOM_UTF16_BE]:
+        encodings = ['utf-16']
+
+    last_error = None
+    for encoding in encodings:
+        # Decode in chunks and throw the text away: this only establishes that the whole script decodes
+        decoder = codecs.getincrementaldecoder(encoding)()
         try:
-            with open(file_path, 'r', encoding=second_encoding) as f:
-                return f.readlines()
+            for offset in range(0, len(data), LOAD__chunk_size):
+                decoder.decode(data[offset:offset + LOAD__chunk_size])
+            decoder.decode(b"", final=True)
+            return encoding
         except UnicodeDecodeError as e:
-            try:
-                # Attempt to open with the first specified encoding
-                with open(file_path, 'r', encoding=default_encoding) as f:
-                    return f.readlines()
-            except UnicodeDecodeError:
-                raise e
-            except Exception as e:
-                raise e
-        except Exception as e:
-            raise e
-    except Exception as e:
-        raise e
+            last_error = e
+    raise last_error
 
 
-def construct_docker_command(container_name, sql_file_path_inside_container, supplied_database, session_user):
+def _iter_decoded_lines(data, encoding):
+    stream = io.TextIOWrapper(io.BufferedReader(_MemoryReader(data), buffer_size=LOAD__chunk_size), encoding=encoding)
+    stream._CHUNK_SIZE = LOAD__chunk_size  # Decode in large chunks, the default 8KB makes line iteration noticeably slower
+    try:
+        yield from stream
+    finally:
+        stream.close()
+        if isinstance(data, mmap.mmap):
+            data.close()
+
+
+def load_file_lines(file_path, encodings):
     """
-    Constructs the Docker command based on the operating system.
+    Reads a script once, memory mapping it if it is large, and returns its lines lazily, decoded with the first of the
+    encodings that can decode it (or as indicated by a BOM). Line endings are translated as for a file opened in text mode
     """
+    with open(file_path, 'rb') as f:
+        if os.fstat(f.fileno()).st_size >= LOAD__mmap_threshold:
+            data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        else:
+            data = f.read()
+
+    return decode_lines(data, encodings)
+
+
+def decode_lines(data, encodings):
+    try:
+        encoding = _detect_encoding(data, encodings)
+    except UnicodeDecodeError:
+        if isinstance(data, mmap.mmap):
+            data.close()
+        raise
+
+    return _iter_decoded_lines(data, encoding)
+
+
+def read_file_lines_with_fallback(file_path, first_encoding='utf-8-sig', second_encoding='windows-1252', default_encoding='utf-8'):
+    return load_file_lines(file_path, [first_encoding, second_encoding, default_encoding])
+
+
+def _docker_exec_prefix():
+    import platform
     docker_exec = ["docker", "exec"]
 
     # If not Windows, prepend 'sudo'
     if not platform.system().lower() == 'windows':
         docker_exec = ["sudo"] + docker_exec
 
+    return docker_exec
+
+
+def construct_docker_command(container_name, sql_file_path_inside_container, supplied_database, session_user):
+    """
+    Constructs the Docker command based on the operating system.
+    """
+    docker_exec = _docker_exec_prefix()
+
     # Full Docker command to execute psql
     command = docker_exec + [
         container_name,
@@ -946,10 +2368,149 @@ def construct_docker_command(container_name, sql_file_path_inside_container, sup
     return command
 
 
+class PsqlSession:
+    """
+    A long lived psql process in the database container which runs many files one after another, saving a process spawn,
+    docker exec and postgres backend startup per file. Each file is bracketed by sentinel lines echoed to stdout and, with
+    \\warn (psql 13+), to stderr so that exactly the error output produced by that file can be attributed to it. version_num
+    is the psql version, sessions of an older psql must not be used
+    """
+
+    def __init__(self, container_name, supplied_database, session_user):
+        import subprocess
+        import uuid
+
+        self.database = supplied_database
+        self.session_user = session_user
+        self.process = subprocess.Popen(
+            _docker_exec_prefix() + ["-i", container_name, "psql", "-X", "-q", "-U", "postgres", "-d", supplied_database],
+            stdin=subprocess.PIPE,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE,
+            text=True,
+            encoding="utf-8",
+            bufsize=1
+        )
+        self._token = "__jaaql_monitor_" + uuid.uuid4().hex
+        self._counter = 0
+        self._stdout = queue.Queue()
+        self._stderr = queue.Queue()
+        for stream, lines in [(self.process.stdout, self._stdout), (self.process.stderr, self._stderr)]:
+            threading.Thread(target=PsqlSession._pump, args=(stream, lines), daemon=True).start()
+
+        # VERSION_NUM is psql's own version. One too old to know it (before 10) echoes the name back instead
+        marker = self._token + "_version "
+        self.process.stdin.write("\\echo " + marker + ":VERSION_NUM\n")
+        self.process.stdin.flush()
+        self.version_num = 0
+        while (line := self._stdout.get()) is not None:
+            if line.startswith(marker):
+                version_num = line[len(marker):].strip()
+                self.version_num = int(version_num) if version_num.isdigit() else 0
+                break
+
+    @staticmethod
+    def _pump(stream, lines):
+        for line in iter(stream.readline, ""):
+            lines.put(line)
+        lines.put(None)
+
+    @staticmethod
+    def _read_between(lines, begin, end):
+        # Returns the lines between the two markers, the remainder of the end marker line and whether the end was reached
+        collected = []
+        in_file = False
+        while (line := lines.get()) is not None:
+            if line.startswith(begin):
+                in_file = True
+            elif line.startswith(end):
+                return collected, line[len(end):].strip(), True
+            elif in_file:
+                collected.append(line)
+        return collected, None, False
+
+    def is_alive(self):
+        return self.process.poll() is None
+
+    def execute_file(self, sql_file_path_inside_container):
+        """
+        Runs the file as if it were run by its own psql process, returning whether it errored and its error output
+        """
+        self._counter += 1
+        begin = "%s_begin_%d" % (self._token, self._counter)
+        end = "%s_end_%d" % (self._token, self._counter)
+
+        # Undo anything a previous file left behind. Output from the reset falls before the begin markers and is ignored
+        self.process.stdin.write("\n".join([
+            "ROLLBACK;",
+            "DISCARD ALL;",
+            f'SET SESSION AUTHORIZATION "{self.session_user}";',
+            "SET client_min_messages = WARNING;",
+            "\\echo " + begin,
+            "\\warn " + begin,
+            "\\i '" + sql_file_path_inside_container.replace("'", "''") + "'",
+            "\\o",  # Should the file have redirected output (\\o file), the end marker must still reach stdout
+            "\\echo " + end + " :DBNAME",
+            "\\warn " + end
+        ]) + "\n")
+        self.process.stdin.flush()
+
+        _, database, completed = PsqlSession._read_between(self._stdout, begin, end)
+        stderr, _, _ = PsqlSession._read_between(self._stderr, begin, end)
+        stderr = "".join(stderr)
+
+        if not completed:
+            # psql exited during the file, e.g. a \q. Judge it like a one off process would be judged
+            return self.process.wait() != 0 or len(stderr) != 0, stderr
+        if database != self.database:
+            self.close()  # The file connected elsewhere. Do not run later files against the wrong database
+
+        return len(stderr) != 0, stderr
+
+    def close(self):
+        import subprocess
+
+        if self.is_alive():
+            try:
+                self.process.stdin.write("\\q\n")
+                self.process.stdin.close()
+                self.process.wait(timeout=10)
+            except (OSError, subprocess.TimeoutExpired):
+                self.process.kill()
+
+
+def get_psql_session(state: State, container_name, supplied_database, session_user) -> PsqlSession | None:
+    # None when psql is too old for a persistent session. Every file is then run by a psql process of its own
+    key = (container_name, session_user, supplied_database)
+    session = state.psql_sessions.get(key)
+    if session is None or not session.is_alive():
+        state.psql_sessions.pop(key, None)
+        try:
+            session = PsqlSession(container_name, supplied_database, session_user)
+        except Exception as e:
+            print_error(state, f"Error starting psql session: {e}")
+            return None  # Only reached when errors do not stop the run, the file is then run in a psql process of its own
+        if session.version_num < PSQL__session_min_version:
+            session.close()
+            state.log("psql did not report version 13 or newer, without \\warn a persistent session cannot tell which file an error "
+                      "came from. Running every file in a psql process of its own")
+            state.persistent_psql = False
+            return None
+        state.psql_sessions[key] = session
+    return session
+
+
+def close_psql_sessions(state: State):
+    for session in state.psql_sessions.values():
+        session.close()
+    state.psql_sessions = {}
+
+
 def execute_command(state, command):
     """
     Executes the given command and returns the result.
     """
+    import subprocess
     try:
         result = subprocess.run(
             command,
@@ -966,46 +2527,670 @@ def execute_command(state, command):
 
 def read_utf8_lines(state, filename):
     try:
-        with open(filename, 'rb') as file:
-            # Read the first few bytes to check for BOM
-            first_bytes = file.read(3)
-
-            # Check for UTF-8-SIG (BOM)
-            if first_bytes.startswith(b'\xef\xbb\xbf'):
-                # Reopen with 'utf-8-sig' to properly handle BOM
-                file = open(filename, encoding='utf-8-sig')
-            else:
-                # Reopen with 'utf-8' assuming no BOM
-                file = open(filename, encoding='utf-8')
+        return load_file_lines(filename, ['utf-8-sig'])
+    except FileNotFoundError:
+        print_error(state, "Could not locate file: " + filename)
+
+
+class ImportedFile:
+    """
+    The decoded content of an imported file, kept for the rest of the run whilst the file's mtime and size are unchanged
+    """
+
+    def __init__(self, mtime_ns: int, size: int, data: bytes):
+        self.mtime_ns = mtime_ns
+        self.size = size
+        self.lines = tuple(decode_lines(data, ['utf-8-sig']))
+        import hashlib
+        self.content_hash = hashlib.sha256(data).hexdigest()
+
 
-            return file.readlines()
+def load_imported_file(state: State, filename) -> ImportedFile:
+    """
+    Raises OSError or UnicodeDecodeError if the file cannot be read. Large files are read but not kept
+    """
+    cache_key = os.path.normpath(os.path.abspath(filename))
+    stat = os.stat(filename)
+    imported = state.import_cache.get(cache_key)
+    if imported is not None and imported.mtime_ns == stat.st_mtime_ns and imported.size == stat.st_size:
+        state.import_cache_hits += 1
+        state.import_cache_bytes_saved += imported.size
+        return imported
+
+    state.import_cache_misses += 1
+    with open(filename, 'rb') as f:
+        data = f.read()
+    imported = ImportedFile(stat.st_mtime_ns, stat.st_size, data)
+    if stat.st_size <= IMPORT__cache_max_bytes:
+        state.import_cache[cache_key] = imported
+    return imported
+
+
+def read_import_lines(state: State, filename):
+    try:
+        if os.path.getsize(filename) > IMPORT__cache_max_bytes:
+            return read_utf8_lines(state, filename)  # Streamed lazily, decoded lines this large are not worth keeping
+        return load_imported_file(state, filename).lines
     except FileNotFoundError:
         print_error(state, "Could not locate file: " + filename)
 
 
 def execute_file_with_psql(state: State, username, database, file_relative, url):
     expect_error = ".error." in file_relative
-    command = construct_docker_command(
-        "jaaql_pg" if "6060" in url else "jaaql_container",
-        "/slurp-in/" + file_relative,
-        database,
-        username
-    )
-    result = execute_command(state, command)
+    container_name = "jaaql_pg" if "6060" in url else "jaaql_container"
+    session = get_psql_session(state, container_name, database, username) if state.persistent_psql else None
+    if session is not None:
+        had_error, stderr = session.execute_file("/slurp-in/" + file_relative)
+    else:
+        command = construct_docker_command(
+            container_name,
+            "/slurp-in/" + file_relative,
+            database,
+            username
+        )
+        result = execute_command(state, command)
 
-    had_error = (result.returncode != 0) or (len(result.stderr) != 0)
+        had_error = (result.returncode != 0) or (len(result.stderr) != 0)
+        stderr = result.stderr
 
     if expect_error:
         # If we got the error we expected, continue silently.
         if had_error:
             return
         # If we did NOT error, fail the run and explain.
-        print_error(state, f"Expected an error executing: {file_relative}\n\nBut the command succeeded (no error was raised).")
+        print_statement_error(state, f"Expected an error executing: {file_relative}\n\nBut the command succeeded (no error was raised).")
         return
 
     # Normal behaviour (no expected error)
     if had_error:
-        print_error(state, f"Error executing: {file_relative}\n\n{result.stderr}")
+        print_statement_error(state, f"Error executing: {file_relative}\n\n{stderr}")
+
+
+class CommandSpec:
+    def __init__(self, prefix: str, handler, exact: bool, case_sensitive: bool, requires_empty_buffer: bool, flushes_batch: bool,
+                 awaits_submits: bool):
+        self.prefix = prefix
+        self.handler = handler
+        self.exact = exact
+        self.case_sensitive = case_sensitive
+        self.requires_empty_buffer = requires_empty_buffer
+        self.flushes_batch = flushes_batch
+        self.awaits_submits = awaits_submits
+
+    def matches(self, line: str, upper_line: str):
+        compare_to = line if self.case_sensitive else upper_line
+        return compare_to == self.prefix if self.exact else compare_to.startswith(self.prefix)
+
+
+class Command:
+    """
+    A command line parsed once: the command it matched and the text following the command
+    """
+
+    def __init__(self, spec: CommandSpec, line: str):
+        self.spec = spec
+        self.line = line
+        self.argument = line[len(spec.prefix):]
+
+
+COMMAND_RESULT__stop = "stop"
+
+# The first two characters of a command (upper cased) to the commands starting with them, longest first. Built at import
+COMMAND_TABLE = {}
+
+
+def register_command(*prefixes, exact: bool = True, case_sensitive: bool = True, requires_empty_buffer: bool = True,
+                     flushes_batch: bool = True, awaits_submits: bool = True):
+    """
+    awaits_submits: the command must wait for every asynchronous submit to complete. Only commands that affect no more
+    than the current connection's own (ordered) requests may skip this
+    """
+    def decorator(handler):
+        for prefix in prefixes:
+            candidates = COMMAND_TABLE.setdefault(prefix[:2].upper(), [])
+            candidates.append(CommandSpec(prefix, handler, exact, case_sensitive, requires_empty_buffer, flushes_batch, awaits_submits))
+            candidates.sort(key=lambda spec: len(spec.prefix), reverse=True)
+        return handler
+    return decorator
+
+
+def parse_command(line: str) -> Command | None:
+    upper_line = line.upper()
+    for spec in COMMAND_TABLE.get(upper_line[:2], []):
+        if spec.matches(line, upper_line):
+            return Command(spec, line)
+    return None
+
+
+@register_command(COMMAND__go, COMMAND__go_short, requires_empty_buffer=False, flushes_batch=False, awaits_submits=False)
+def _command_go(state: State, command: Command):
+    on_go(state)
+
+
+@register_command(COMMAND__go_to_file, COMMAND__go_to_file_short, exact=False, requires_empty_buffer=False)
+def _command_go_to_file(state: State, command: Command):
+    file_name = command.argument.strip()
+    on_go_export(state, file_name, export_format_for_file(state, file_name))
+
+
+@register_command(COMMAND__export, exact=False, requires_empty_buffer=False)
+def _command_export(state: State, command: Command):
+    arguments = command.argument.strip().split(" ", 1)
+    if len(arguments) != 2 or arguments[0].lower() not in [EXPORT__csv, EXPORT__jsonl]:
+        print_error(state, "Expected " + COMMAND__export + EXPORT__csv + "|" + EXPORT__jsonl + " <file>")
+    on_go_export(state, arguments[1].strip(), arguments[0].lower())
+
+
+@register_command(COMMAND__assert_equals, exact=False, requires_empty_buffer=False, awaits_submits=False)
+def _command_assert_equals(state: State, command: Command):
+    on_go_expect_equals(state, command.argument)
+
+
+@register_command(COMMAND__reset, COMMAND__reset_short, requires_empty_buffer=False, awaits_submits=False)
+def _command_reset(state: State, command: Command):
+    state.fetched_query = ""
+
+
+@register_command(COMMAND__print, COMMAND__print_short, requires_empty_buffer=False, awaits_submits=False)
+def _command_print(state: State, command: Command):
+    dump_buffer(state)
+
+
+@register_command(COMMAND__freeze_instance, requires_empty_buffer=False)
+def _command_freeze_instance(state: State, command: Command):
+    freeze_defrost_instance(state, freeze=True)
+
+
+@register_command(COMMAND__defrost_instance, requires_empty_buffer=False)
+def _command_defrost_instance(state: State, command: Command):
+    freeze_defrost_instance(state, freeze=False)
+
+
+def resolve_import_path(importing_file_name: str, import_argument: str):
+    import_file = import_argument.strip()
+    if import_file.startswith("%TEMP%"):
+        import tempfile
+        import_file = import_file.replace("%TEMP%", tempfile.gettempdir().replace("\\", "/"))
+    return os.path.join(dirname(importing_file_name), import_file)
+
+
+@register_command(COMMAND__import, exact=False, requires_empty_buffer=False, flushes_batch=False, awaits_submits=False)
+def _command_import(state: State, command: Command):
+    state.file_stack.append({
+        "cur_file_line": state.cur_file_line,
+        "file_lines": state.file_lines,
+        "cur_file_name": state.file_name,
+        "started_at": time.perf_counter()
+    })
+    state.file_name = resolve_import_path(state.file_name, command.argument)
+    state.file_lines = LineCursor(read_import_lines(state, state.file_name))
+    state.cur_file_line = 0  # Lines are counted from the start of the imported file, pop_import restores the importer's
+
+
+@register_command(COMMAND__cron, exact=False)
+def _command_cron(state: State, command: Command):
+    cron_command = command.argument.strip()
+    state.cron = {
+        "application": cron_command.split(" ")[0],
+        "command": " ".join(cron_command.split(" ")[1:]),
+        "args": ""
+    }
+
+
+@register_command(COMMAND__wipe_dbms)
+def _command_wipe_dbms(state: State, command: Command):
+    wipe_jaaql_box(state)
+
+
+@register_command(COMMAND__set_web_config)
+def _command_set_web_config(state: State, command: Command):
+    set_web_config(state)
+
+
+@register_command(COMMAND__with_user, exact=False, case_sensitive=False, awaits_submits=False)
+def _command_with_user(state: State, command: Command):
+    overriding_user = command.argument.strip().lower()
+    if "\"" in overriding_user or "'" in overriding_user:
+        print_error(state, "Please do not quote the user!")
+    state.get_current_connection().username = overriding_user
+
+
+@register_command(COMMAND__with_parameters, exact=False, case_sensitive=False, awaits_submits=False)
+def _command_with_parameters(state: State, command: Command):
+    if command.line.endswith("}"):
+        state.query_parameters = "{" + command.argument
+    else:
+        state.query_parameters = "{"
+        state.reading_parameters = True
+
+
+@register_command(COMMAND__switch_jaaql_account_to, exact=False, awaits_submits=False)
+def _command_switch_jaaql_account(state: State, command: Command):
+    argument = command.argument
+    if argument.lower().endswith(COMMAND__independently):
+        # Without --async every submit has completed before the switch anyway, so the same script runs either way
+        argument = argument[:-len(COMMAND__independently)]
+    elif state.async_engine is not None:
+        # The account's statements may depend on those other accounts still have in flight (created as dba, used as app)
+        state.async_engine.wait_all()
+    connection_name = parse_user_printing_any_errors(state, argument)
+    state.set_current_connection(get_connection_info(state, connection_name=connection_name), connection_name)
+
+
+@register_command(COMMAND__connect_to_database, exact=False, awaits_submits=False)
+def _command_connect_to_database(state: State, command: Command):
+    candidate_database = command.argument.split(" ")[0]
+    if command.line.endswith(CONNECT_FOR_CREATEDB) or command.line.startswith(CONNECT_FOR_EXTENSION_CONFIGURATION):
+        state.is_transactional = False
+
+    state.database_override = candidate_database.split(CONNECT_FOR_CREATEDB)[0].split(CONNECT_FOR_EXTENSION_CONFIGURATION)[0]
+
+
+@register_command(COMMAND__clone_jaaql_account, exact=False)
+def _command_clone_jaaql_account(state: State, command: Command):
+    arguments = command.argument.split(" ")
+    connection_name = parse_user_printing_any_errors(state, arguments[0])
+    federation_data = json.loads(" ".join(arguments[1:]))
+
+    connection_info = get_connection_info(state, connection_name=connection_name)
+    federate_jaaql_user_account(state, connection_name, connection_info, federation_data["provider"], federation_data["tenant"],
+                                federation_data["sub"], federation_data["username"])
+
+
+@register_command(COMMAND__register_jaaql_account_with, exact=False)
+def _command_register_jaaql_account(state: State, command: Command):
+    overriding = command.line.split(" overriding username as ")
+    if len(overriding) != 1:
+        overriding = overriding[1]
+    else:
+        overriding = None
+    connection_name = parse_user_printing_any_errors(state, command.argument.split(" ")[0])
+
+    register_jaaql_account(state, connection_name, get_connection_info(state, connection_name=connection_name, override_username=overriding))
+
+
+@register_command(COMMAND__federate_jaaql_account_with, exact=False)
+def _command_federate_jaaql_account(state: State, command: Command):
+    arguments = command.argument.split(" ")
+    connection_name = parse_user_printing_any_errors(state, arguments[0])
+    federation_data = json.loads(" ".join(arguments[1:]))
+    connection_info = get_connection_info(state, connection_name=connection_name, override_username=federation_data["username"])
+    federate_jaaql_user_account(state, connection_name, connection_info, federation_data["provider"], federation_data["tenant"],
+                                federation_data["sub"], connection_info.username)
+
+
+@register_command(COMMAND__attach_email_account, exact=False)
+def _command_attach_email_account(state: State, command: Command):
+    candidate_connection_name = command.argument
+    connection_name = parse_user_printing_any_errors(state, candidate_connection_name, allow_spaces=True)
+    if " to " not in candidate_connection_name:
+        print_error(state, "Expected token 'to' after dispatcher credentials file e.g. " +
+                    COMMAND__attach_email_account + "@dispatcher to app.dispatcher_name")
+    if candidate_connection_name.endswith(" to "):
+        print_error(state, "Expected fully qualified dispatcher after ' to ' e.g. " +
+                    COMMAND__attach_email_account + "@dispatcher to app.dispatcher_name")
+    dispatcher_fqn = candidate_connection_name.split(" to ")[1]
+    dispatcher_fqn_split = dispatcher_fqn.split(".")
+    if len(dispatcher_fqn_split) != 2:
+        print_error(state, "Badly formatted dispatcher name. Must be of the format 'app.dispatcher_name'. Received '%s'" % dispatcher_fqn)
+
+    attach_email_account(state, dispatcher_fqn_split[0], dispatcher_fqn_split[1], connection_name,
+                         get_connection_info(state, connection_name=connection_name))
+
+
+@register_command(COMMAND__psql, exact=False)
+def _command_psql(state: State, command: Command):
+    arguments = command.argument.split(" ")
+    the_user = parse_user_printing_any_errors(state, arguments[0])
+    the_file = arguments[1]
+
+    connection = get_connection_info(state, connection_name=the_user)
+    execute_file_with_psql(state, connection.username, connection.database, the_file, connection.get_http_url())
+
+
+@register_command(COMMAND__quit, COMMAND__quit_short)
+def _command_quit(state: State, command: Command):
+    return COMMAND_RESULT__stop
+
+
+class ScriptIRUnavailable(Exception):
+    pass
+
+
+class ScriptIRCompiler:
+    """
+    Compiles a script and everything it imports into a flat list of operations with the file and line each came from.
+    Runs of plain SQL become a single buffer append, everything else is kept as lines for process_line. Line numbers are
+    counted exactly as deal_with_input counts them, so errors raised whilst executing the IR read the same as when streaming.
+    An imported file is compiled as it is now, with a hash of its content. A script may generate the files it imports, so
+    the hash is checked again when the import is reached and a file that has changed (or could not be read) is streamed
+    """
+
+    def __init__(self, state: State, root_file_name: str):
+        self.state = state
+        self.files = [root_file_name]
+        self.ops = []
+        self.total_bytes = 0
+        self.line_counter = 0
+        self.reading_parameters = False
+        self.cron_args = None
+        self._run_kind = None
+        self._run_lines = []
+        self._run_file_idx = 0
+        self._run_first_line = 0
+        self._run_last_line = 0
+
+    def _add_to_run(self, kind, file_idx, line):
+        if kind != self._run_kind or file_idx != self._run_file_idx:
+            self._end_run()
+            self._run_kind = kind
+            self._run_file_idx = file_idx
+            self._run_first_line = self.line_counter
+        self._run_lines.append(line)
+        self._run_last_line = self.line_counter
+
+    def _end_run(self):
+        if self._run_kind == IR__text:
+            first_non_blank = next((idx for idx, line in enumerate(self._run_lines) if len(line.strip()) != 0), len(self._run_lines))
+            self.ops.append([IR__text, self._run_file_idx, self._run_last_line, "".join(self._run_lines),
+                             "".join(self._run_lines[first_non_blank:])])
+        elif self._run_kind == IR__lines:
+            self.ops.append([IR__lines, self._run_file_idx, self._run_first_line, self._run_lines])
+        self._run_kind = None
+        self._run_lines = []
+
+    def _add_bytes(self, num_bytes: int):
+        self.total_bytes += num_bytes
+        if self.total_bytes > IR__max_bytes:
+            raise ScriptIRUnavailable()
+
+    def compile_file(self, file_idx: int, lines):
+        # A quit is compiled like any other command and what follows it is compiled too, as a quit in an imported file that
+        # has changed by the time it is run may no longer be there
+        for line in lines:
+            self.line_counter += 1
+            if line.startswith(COMMAND__initialiser) or line.upper().startswith(COMMAND__with_parameters) or line.upper().startswith(COMMAND__with_user):
+                command = parse_command(line.strip())
+                if command is not None and command.spec.prefix == COMMAND__import:
+                    self._end_run()
+                    self.compile_import(file_idx, command)
+                    continue
+
+                self._add_to_run(IR__lines, file_idx, line)
+                if command is None:
+                    continue
+                if command.spec.prefix == COMMAND__cron:
+                    self.cron_args = ""
+                elif command.spec.prefix == COMMAND__with_parameters and not command.line.endswith("}"):
+                    self.reading_parameters = True
+            elif self.cron_args is not None:
+                self._add_to_run(IR__lines, file_idx, line)
+                self.cron_args += line.strip()
+                if self.cron_args.endswith("}"):
+                    self.cron_args = None
+            elif self.reading_parameters or line.strip().endswith(COMMAND__go_short):
+                self._add_to_run(IR__lines, file_idx, line)
+                if line.strip().startswith("}") or line.strip().endswith(COMMAND__go_short):
+                    self.reading_parameters = False
+            else:
+                self._add_to_run(IR__text, file_idx, line)
+
+        self._end_run()
+
+    def compile_import(self, file_idx: int, command: Command):
+        file_name = resolve_import_path(self.files[file_idx], command.argument)
+        import_line = self.line_counter
+        self.files.append(file_name)
+        try:
+            imported = load_imported_file(self.state, file_name)
+        except (OSError, UnicodeDecodeError):
+            imported = None  # Perhaps generated by the script before it is imported. Streamed, which reports it if it is not
+
+        self.ops.append([IR__import, file_idx, import_line, len(self.files) - 1, None if imported is None else imported.content_hash,
+                         command.line])
+        if imported is not None:
+            self._add_bytes(imported.size)
+            self.line_counter = 0
+            self.compile_file(len(self.files) - 1, imported.lines)
+            self.line_counter = import_line
+        self.ops.append([IR__end_import])
+
+
+def _imported_file_unchanged(state: State, file_name: str, content_hash: str) -> bool:
+    try:
+        return load_imported_file(state, file_name).content_hash == content_hash
+    except (OSError, UnicodeDecodeError):
+        return False
+
+
+def prune_script_ir_cache(cache_dir: str, keep: int):
+    # Removes all but the most recently used compiled scripts. A script is marked used by touching its file
+    try:
+        cache_files = [entry for entry in os.scandir(cache_dir) if entry.is_file() and entry.name.endswith(".json")]
+        cache_files.sort(key=lambda entry: entry.stat().st_mtime, reverse=True)
+        for entry in cache_files[keep:]:
+            os.remove(entry.path)
+    except OSError:
+        pass  # Another monitor may be pruning too
+
+
+def load_script_ir(state: State, file_content: str = None):
+    """
+    Returns the compiled operations of the current script, from the cache if it has not changed. Its imports are checked
+    as they are reached, see ScriptIRCompiler. Returns None if the script should be streamed instead, including whenever it
+    cannot be read; streaming reports why
+    """
+    import hashlib
+    import tempfile
+    import uuid
+
+    try:
+        if file_content:
+            data = file_content.encode("utf-8")
+        else:
+            with open(state.file_name, 'rb') as f:
+                data = f.read()
+    except OSError:
+        return None
+    if len(data) > IR__max_bytes:
+        return None
+
+    cache_key = hashlib.sha256("\0".join([VERSION, IR__format, state.file_name, tempfile.gettempdir(), ""]).encode() + data).hexdigest()
+    cache_file = os.path.join(state.ir_cache_dir, cache_key + ".json")
+
+    try:
+        with open(cache_file, "r", encoding="utf-8") as f:
+            script_ir = json.load(f)
+        os.utime(cache_file)
+        state.log("Using cached compiled script " + cache_file)
+        return script_ir
+    except (OSError, ValueError):
+        pass
+
+    compiler = ScriptIRCompiler(state, state.file_name)
+    try:
+        compiler._add_bytes(len(data))
+        if file_content:
+            lines = [line + "\n" for line in file_content.replace("\r\n", "\n").split("\n")]
+        else:
+            lines = decode_lines(data, ['utf-8-sig', 'windows-1252', 'utf-8'])
+        compiler.compile_file(0, lines)
+    except (ScriptIRUnavailable, UnicodeDecodeError):
+        return None
+
+    # Reading the end of the script counts as a line, as it does when streaming
+    script_ir = {"files": compiler.files, "ops": compiler.ops, "end_line": compiler.line_counter + 1}
+    try:
+        os.makedirs(state.ir_cache_dir, exist_ok=True)
+        temp_file = cache_file + "." + uuid.uuid4().hex + ".tmp"
+        with open(temp_file, "w", encoding="utf-8") as f:
+            json.dump(script_ir, f)
+        os.replace(temp_file, cache_file)
+        state.log("Cached compiled script " + cache_file)
+    except OSError as ex:
+        state.log("Could not cache compiled script: " + str(ex))
+    prune_script_ir_cache(state.ir_cache_dir, IR__cache_max_files)
+
+    return script_ir
+
+
+def stream_import(state: State, import_line: str) -> bool:
+    """
+    Runs an \\import line and then the imported file a line at a time, as deal_with_input would, until it has been
+    returned from. Returns True if input should stop (a quit)
+    """
+    depth = len(state.file_stack)
+    if process_line(state, import_line):
+        return True
+    while len(state.file_stack) > depth:
+        fetched_line = state.file_lines.next_line()
+        state.cur_file_line += 1
+        if isinstance(fetched_line, EOFMarker):
+            pop_import(state)
+        elif process_line(state, fetched_line):
+            return True
+    return False
+
+
+def execute_script_ir(state: State, script_ir):
+    files = script_ir["files"]
+    ops = script_ir["ops"]
+    state.file_name = files[0]
+    op_idx = 0
+    while op_idx < len(ops):
+        op = ops[op_idx]
+        op_idx += 1
+        if op[0] == IR__text:
+            state.cur_file_line = op[2]
+            state.fetched_query += op[3] if len(state.fetched_query.strip()) != 0 else op[4]  # No leading empty lines
+        elif op[0] == IR__lines:
+            state.cur_file_line = op[2] - 1
+            for line in op[3]:
+                state.cur_file_line += 1
+                if process_line(state, line):
+                    return
+        elif op[0] == IR__import:
+            state.cur_file_line = op[2]
+            if op[4] is None or not _imported_file_unchanged(state, files[op[3]], op[4]):
+                state.log("Streaming " + files[op[3]] + ", it has changed since the script was compiled")
+                if stream_import(state, op[5]):
+                    return
+                depth = 1  # The compiled operations of the file are skipped, up to and including its end
+                while depth != 0:
+                    depth += {IR__import: 1, IR__end_import: -1}.get(ops[op_idx][0], 0)
+                    op_idx += 1
+                continue
+            state.file_stack.append({
+                "cur_file_line": state.cur_file_line,
+                "file_lines": state.file_lines,
+                "cur_file_name": state.file_name,
+                "started_at": time.perf_counter()
+            })
+            state.file_name = files[op[3]]
+            state.cur_file_line = 0
+        elif op[0] == IR__end_import:
+            pop_import(state)
+
+    state.cur_file_line = script_ir["end_line"]
+
+
+def run_command(state: State, command: Command):
+    # An import is traced and profiled as the span of the imported file, which ends long after the command itself
+    if (state.tracer is None and state.profiler is None) or command.spec.prefix == COMMAND__import:
+        return command.spec.handler(state, command)
+    return run_measured_command(state, command.spec.prefix.strip(), command.spec.handler, state, command)
+
+
+def run_measured_command(state: State, name: str, handler, *args):
+    started_at = time.perf_counter()
+    if state.tracer is not None:
+        state.tracer.command = name
+    try:
+        with trace_span(state, name, "command"):
+            return handler(*args)
+    finally:
+        if state.profiler is not None:
+            state.profiler.add_command(name, time.perf_counter() - started_at)
+
+
+def pop_import(state: State):
+    last_ret = state.file_stack.pop()
+    if state.profiler is not None:
+        state.profiler.add_file(state.file_name, time.perf_counter() - last_ret["started_at"])
+    if state.tracer is not None:
+        state.tracer.complete("import " + os.path.basename(state.file_name), "import", last_ret["started_at"], time.perf_counter(),
+                              {"file": state.file_name, "imported_from": last_ret["cur_file_name"], "line": last_ret["cur_file_line"]})
+    state.cur_file_line = last_ret["cur_file_line"]
+    state.file_lines = last_ret["file_lines"]
+    state.file_name = last_ret["cur_file_name"]
+
+
+def process_line(state: State, fetched_line: str) -> bool:
+    """
+    Processes one line of input, returning True if input should stop (a quit)
+    """
+    try:
+        return _process_line(state, fetched_line)
+    except StatementFailure:
+        # Already reported and recorded (--keep-going). The failed buffer is dropped and the script carries on
+        state.fetched_query = ""
+        state.query_parameters = None
+        state.reading_parameters = False
+        return False
+
+
+def _process_line(state: State, fetched_line: str) -> bool:
+    if fetched_line.startswith(COMMAND__initialiser) or fetched_line.upper().startswith(COMMAND__with_parameters) or fetched_line.upper().startswith(COMMAND__with_user):
+        fetched_line = fetched_line.strip()  # Ignore the line terminator e.g. \r\n
+        command = parse_command(fetched_line)
+        if state.async_engine is not None and (command is None or command.spec.awaits_submits):
+            state.async_engine.wait_all()
+        if command is None or command.spec.flushes_batch:
+            flush_submit_batch(state)  # Any other command may depend on, or change the context of, the queued buffers
+        if (command is None or command.spec.requires_empty_buffer) and len(state.fetched_query.strip()) != 0:
+            print_error(state, "Tried to execute the command '" + fetched_line + "' but buffer was non empty.")
+        if command is None:
+            print_error(state, "Unrecognised command '" + fetched_line + "'")
+        elif run_command(state, command) == COMMAND_RESULT__stop:
+            return True
+    elif state.cron is not None:
+        state.cron["args"] += fetched_line.strip()
+        if state.cron["args"].endswith("}"):
+            cron = state.cron
+            state.cron = None
+            fire_cron(state, cron["application"], cron["command"], cron["args"])
+    else:
+        if state.reading_parameters:
+            if fetched_line.strip().startswith("}"):
+                state.reading_parameters = False
+
+                if len(fetched_line.split("} ")) > 1 and (fetched_line.split("} ")[1].upper().startswith(COMMAND__and_user) or fetched_line.split("} ")[1].upper().startswith(COMMAND__with_user)):
+                    delimiter = COMMAND__and_user if COMMAND__and_user in fetched_line.upper() else COMMAND__with_user
+                    overriding_user = fetched_line.upper().split(delimiter)[1].strip().lower()
+                    if "\"" in overriding_user or "'" in overriding_user:
+                        print_error(state, "Please do not quote the user!")
+                    state.get_current_connection().username = overriding_user
+
+                state.query_parameters += "}"
+            else:
+                state.query_parameters += fetched_line
+        else:
+            if len(state.fetched_query.strip()) != 0 or len(fetched_line.strip()) != 0:
+                state.fetched_query += fetched_line  # Do not pre-append things with empty lines
+
+        if fetched_line.strip().endswith(COMMAND__go_short):
+            if state.reading_parameters:
+                state.query_parameters = state.query_parameters[:-(len(COMMAND__go_short) + 1)]
+                state.reading_parameters = False
+            else:
+                state.fetched_query = state.fetched_query[:-(len(COMMAND__go_short) + 1)]
+
+            if state.tracer is None and state.profiler is None:
+                on_go(state)
+            else:
+                run_measured_command(state, COMMAND__go_short, on_go, state)
+
+    return False
 
 
 def deal_with_input(state: State, file_content: str = None):
@@ -1017,196 +3202,65 @@ def deal_with_input(state: State, file_content: str = None):
         print(state, "Type jaaql url or \"file [config_file_location]\"")
         state.set_current_connection(handle_login(state, input("LOGIN>").strip()))
 
-    if state.is_script():
-        try:
-            if file_content:
-                state.file_lines = [line + "\n" for line in file_content.replace("\r\n", "\n").split("\n")]
-            else:
-                state.file_lines = read_file_lines_with_fallback(state.file_name)
-            state.file_lines.append(EOFMarker())  # Ignore warning. We can have multiple types. This is python
-        except FileNotFoundError:
-            print_error(state, "Could not load file for processing '" + state.file_name + "'")
-        except Exception as ex:
-            print_error(state, "Unhandled exception whilst processing file '" + state.file_name + "' " + str(ex))
+    if state.use_async and state.async_engine is None:
+        state.async_engine = AsyncSubmitEngine(state)
 
-    in_cron = False
-    cron_application = None
-    cron_command = None
-    cron_args = ""
+    script_ir = None
+    if state.is_script() and state.ir_cache_dir is not None:
+        script_ir = load_script_ir(state, file_content)
 
-    while True:
-        fetched_line = None
+    if script_ir is not None:
+        execute_script_ir(state, script_ir)
+    else:
+        if state.is_script():
+            try:
+                if file_content:
+                    state.file_lines = LineCursor([line + "\n" for line in file_content.replace("\r\n", "\n").split("\n")])
+                else:
+                    state.file_lines = LineCursor(read_file_lines_with_fallback(state.file_name))
+            except FileNotFoundError:
+                print_error(state, "Could not load file for processing '" + state.file_name + "'")
+            except Exception as ex:
+                print_error(state, "Unhandled exception whilst processing file '" + state.file_name + "' " + str(ex))
 
-        try:
-            if len(state.file_lines) != 0:
+        while True:
+            fetched_line = None
+
+            try:
                 while fetched_line is None:
-                    fetched_line = state.file_lines[0]
+                    fetched_line = state.file_lines.next_line()
                     state.cur_file_line += 1
-                    state.file_lines = state.file_lines[1:]
                     if isinstance(fetched_line, EOFMarker):
                         if len(state.file_stack) == 0:
                             raise EOFError()
                         else:
-                            last_ret = state.file_stack[-1]
-                            state.cur_file_line = last_ret["cur_file_line"]
-                            state.file_lines = last_ret["file_lines"]
-                            state.file_name = last_ret["cur_file_name"]
-                            state.file_stack = state.file_stack[:-1]
+                            pop_import(state)
                             fetched_line = None
-        except EOFError:
-            break
-
-        if fetched_line.startswith(COMMAND__initialiser) or fetched_line.upper().startswith(COMMAND__with_parameters) or fetched_line.upper().startswith(COMMAND__with_user):
-            fetched_line = fetched_line.strip()  # Ignore the line terminator e.g. \r\n
-            if fetched_line == COMMAND__go or fetched_line == COMMAND__go_short:
-                on_go(state)
-            elif fetched_line.startswith(COMMAND__assert_equals):
-                expected = fetched_line[len(COMMAND__assert_equals):]
-                on_go_expect_equals(state, expected)
-            elif fetched_line == COMMAND__reset or fetched_line == COMMAND__reset_short:
-                state.fetched_query = ""
-            elif fetched_line == COMMAND__print or fetched_line == COMMAND__print_short:
-                dump_buffer(state)
-            elif fetched_line == COMMAND__freeze_instance:
-                freeze_defrost_instance(state, freeze=True)
-            elif fetched_line == COMMAND__defrost_instance:
-                freeze_defrost_instance(state, freeze=False)
-            elif fetched_line.startswith(COMMAND__import):
-                state.file_stack.append({
-                    "cur_file_line": state.cur_file_line,
-                    "file_lines": state.file_lines,
-                    "cur_file_name": state.file_name
-                })
-                import_file = " ".join(fetched_line.split(COMMAND__import)[1:]).strip()
-                if import_file.startswith("%TEMP%"):
-                    import_file = import_file.replace("%TEMP%", tempfile.gettempdir().replace("\\", "/"))
-                file_path = os.path.join(dirname(state.file_name), import_file)
-                state.file_name = file_path
-                state.file_lines = read_utf8_lines(state, state.file_name)
-                state.file_lines.append(EOFMarker())
-            elif len(state.fetched_query.strip()) != 0:
-                print_error(state, "Tried to execute the command '" + fetched_line + "' but buffer was non empty.")
-            elif fetched_line.startswith(COMMAND__cron):
-                cron_command = fetched_line.split(COMMAND__cron + " ")[1].strip()
-                cron_application = cron_command.split(" ")[0]
-                cron_command = " ".join(cron_command.split(" ")[1:])
-                cron_args = ""
-                in_cron = True
-            elif fetched_line == COMMAND__wipe_dbms:
-                wipe_jaaql_box(state)
-            elif fetched_line == COMMAND__set_web_config:
-                set_web_config(state)
-            elif fetched_line.upper().startswith(COMMAND__with_user):
-                overriding_user = fetched_line.upper().split(COMMAND__with_user)[1].strip().lower()
-                if "\"" in overriding_user or "'" in overriding_user:
-                    print_error(state, "Please do not quote the user!")
-                state.get_current_connection().username = overriding_user
-            elif fetched_line.startswith(COMMAND__with_parameters):
-                if fetched_line.strip().endswith("}"):
-                    state.query_parameters = fetched_line[len(COMMAND__with_parameters)-1:]
-                else:
-                    state.query_parameters = "{"
-                    state.reading_parameters = True
-            elif fetched_line.startswith(COMMAND__switch_jaaql_account_to):
-                candidate_connection_name = fetched_line.split(COMMAND__switch_jaaql_account_to)[1]
-                connection_name = parse_user_printing_any_errors(state, candidate_connection_name)
-                state.set_current_connection(get_connection_info(state, connection_name=connection_name), connection_name)
-            elif fetched_line.startswith(COMMAND__connect_to_database):
-                candidate_database = fetched_line.split(COMMAND__connect_to_database)[1].split(" ")[0]
-                if fetched_line.endswith(CONNECT_FOR_CREATEDB) or fetched_line.startswith(CONNECT_FOR_EXTENSION_CONFIGURATION):
-                    state.is_transactional = False
-
-                state.database_override = candidate_database.split(CONNECT_FOR_CREATEDB)[0].split(CONNECT_FOR_EXTENSION_CONFIGURATION)[0]
-            elif fetched_line.startswith(COMMAND__clone_jaaql_account):
-                candidate_connection_name = fetched_line.split(COMMAND__clone_jaaql_account)[1].split(" ")[0]
-                connection_name = parse_user_printing_any_errors(state, candidate_connection_name)
-                federation_data = json.loads(" ".join(fetched_line.split(COMMAND__clone_jaaql_account)[1].split(" ")[1:]))
-
-                connection_info = get_connection_info(state, connection_name=connection_name)
-                federate_jaaql_user_account(state, connection_name, connection_info, federation_data["provider"], federation_data["tenant"],
-                                            federation_data["sub"], federation_data["username"])
-            elif fetched_line.startswith(COMMAND__register_jaaql_account_with):
-                candidate_connection_name = fetched_line.split(COMMAND__register_jaaql_account_with)[1].split(" ")[0]
-                overriding = fetched_line.split(" overriding username as ")
-                if len(overriding) != 1:
-                    overriding = overriding[1]
-                else:
-                    overriding = None
-                connection_name = parse_user_printing_any_errors(state, candidate_connection_name)
-
-                register_jaaql_account(state, connection_name, get_connection_info(state, connection_name=connection_name, override_username=overriding))
-            elif fetched_line.startswith(COMMAND__federate_jaaql_account_with):
-                candidate_connection_name = fetched_line.split(COMMAND__federate_jaaql_account_with)[1].split(" ")[0]
-                connection_name = parse_user_printing_any_errors(state, candidate_connection_name)
-                federation_data = json.loads(" ".join(fetched_line.split(COMMAND__federate_jaaql_account_with)[1].split(" ")[1:]))
-                connection_info = get_connection_info(state, connection_name=connection_name, override_username=federation_data["username"])
-                federate_jaaql_user_account(state, connection_name, connection_info, federation_data["provider"], federation_data["tenant"],
-                                            federation_data["sub"], connection_info.username)
-            elif fetched_line.startswith(COMMAND__attach_email_account):
-                candidate_connection_name = fetched_line.split(COMMAND__attach_email_account)[1]
-                connection_name = parse_user_printing_any_errors(state, candidate_connection_name, allow_spaces=True)
-                if " to " not in candidate_connection_name:
-                    print_error(state, "Expected token 'to' after dispatcher credentials file e.g. " +
-                                COMMAND__attach_email_account + "@dispatcher to app.dispatcher_name")
-                if candidate_connection_name.endswith(" to "):
-                    print_error(state, "Expected fully qualified dispatcher after ' to ' e.g. " +
-                                COMMAND__attach_email_account + "@dispatcher to app.dispatcher_name")
-                dispatcher_fqn = candidate_connection_name.split(" to ")[1]
-                dispatcher_fqn_split = dispatcher_fqn.split(".")
-                if len(dispatcher_fqn_split) != 2:
-                    print_error(state, "Badly formatted dispatcher name. Must be of the format 'app.dispatcher_name'. Received '%s'" % dispatcher_fqn)
-
-                attach_email_account(state, dispatcher_fqn_split[0], dispatcher_fqn_split[1], connection_name,
-                                     get_connection_info(state, connection_name=connection_name))
-            elif fetched_line.startswith(COMMAND__psql):
-                the_user = parse_user_printing_any_errors(state, fetched_line.split(COMMAND__psql)[1].split(" ")[0])
-                the_file = fetched_line.split(COMMAND__psql)[1].split(" ")[1]
-
-                connection = get_connection_info(state, connection_name=the_user)
-                execute_file_with_psql(state, connection.username, connection.database, the_file, connection.get_http_url())
-            elif fetched_line == COMMAND__quit or fetched_line == COMMAND__quit_short:
+            except EOFError:
                 break
-            else:
-                print_error(state, "Unrecognised command '" + fetched_line + "'")
-        elif in_cron:
-            cron_args += fetched_line.strip()
-            if cron_args.endswith("}"):
-                in_cron = False
-                fire_cron(state, cron_application, cron_command, cron_args)
-        else:
-            if state.reading_parameters:
-                if fetched_line.strip().startswith("}"):
-                    state.reading_parameters = False
 
-                    if len(fetched_line.split("} ")) > 1 and (fetched_line.split("} ")[1].upper().startswith(COMMAND__and_user) or fetched_line.split("} ")[1].upper().startswith(COMMAND__with_user)):
-                        delimiter = COMMAND__and_user if COMMAND__and_user in fetched_line.upper() else COMMAND__with_user
-                        overriding_user = fetched_line.upper().split(delimiter)[1].strip().lower()
-                        if "\"" in overriding_user or "'" in overriding_user:
-                            print_error(state, "Please do not quote the user!")
-                        state.get_current_connection().username = overriding_user
-
-                    state.query_parameters += "}"
-                else:
-                    state.query_parameters += fetched_line
-            else:
-                if len(state.fetched_query.strip()) != 0 or len(fetched_line.strip()) != 0:
-                    state.fetched_query += fetched_line  # Do not pre-append things with empty lines
-
-            if fetched_line.strip().endswith(COMMAND__go_short):
-                if state.reading_parameters:
-                    state.query_parameters = state.query_parameters[:-(len(COMMAND__go_short) + 1)]
-                    state.reading_parameters = False
-                else:
-                    state.fetched_query = state.fetched_query[:-(len(COMMAND__go_short) + 1)]
+            if process_line(state, fetched_line):
+                break
 
-                on_go(state)
+    if state.async_engine is not None:
+        state.async_engine.wait_all()
 
     if len(state.fetched_query) != 0:
         if state.single_query:
-            on_go(state)
+            try:
+                on_go(state)
+            except StatementFailure:
+                pass  # Already reported and recorded (--keep-going), the summary follows the run
         else:
             print_error(state, "Attempting to quit with non-empty buffer. Please submit with \\g or clear with \\r")
 
+    try:
+        flush_submit_batch(state)
+        if state.async_engine is not None:
+            state.async_engine.wait_all()
+    except StatementFailure:
+        pass  # As above
+
 
 def initialise_from_args(args, file_name: str = None, file_content: str = None, do_exit: bool = True, override_url: str = None, do_prepare: bool = False):
     state = State()
@@ -1218,6 +3272,8 @@ def initialise_from_args(args, file_name: str = None, file_content: str = None,
                 state.future_files.append({"name": args[idx + 1], "type": FUTURE_TYPE_input})
             elif arg in ARGS__psql_file:
                 state.future_files.append({"name": args[idx + 1], "type": FUTURE_TYPE_psql})
+            elif arg in ARGS__barrier:
+                state.future_files.append({"type": FUTURE_TYPE_barrier})
 
         file_name = [idx for arg, idx in zip(args, range(len(args))) if arg in ARGS__input_file]
         if len(file_name) != 0:
@@ -1233,12 +3289,107 @@ def initialise_from_args(args, file_name: str = None, file_content: str = None,
     state.single_query = len([arg for arg in args if arg in ARGS__single_query]) != 0
     state.prevent_unused_parameters = len([arg for arg in args if arg in ARGS__allow_unused_parameters]) == 0
     state.clone_as_attach = len([arg for arg in args if arg in ARGS__clone_as_attach]) == 1
+    state.persistent_psql = len([arg for arg in args if arg in ARGS__persistent_psql]) != 0
+    state.use_async = len([arg for arg in args if arg in ARGS__async]) != 0
+    state.stream_results = len([arg for arg in args if arg in ARGS__stream_results]) != 0
+    state.compress_requests = len([arg for arg in args if arg in ARGS__compress]) != 0
+    state.keep_going = len([arg for arg in args if arg in ARGS__keep_going]) != 0
+
+    trace_file = None
+    for arg, arg_idx in zip(args, range(len(args))):
+        if arg not in ARGS__trace:
+            continue
+
+        if arg_idx == len(args) - 1:
+            print_error(state, "The trace flag is the last argument. You need to supply a file to write the trace to")
+
+        trace_file = args[arg_idx + 1]  # Opened once every argument has been read, see below
+
+    state.print_profile = len([arg for arg in args if arg in ARGS__profile]) != 0
+
+    for arg, arg_idx in zip(args, range(len(args))):
+        if arg not in ARGS__profile_json:
+            continue
+
+        if arg_idx == len(args) - 1:
+            print_error(state, "The profile json flag is the last argument. You need to supply a file to write the profile to")
+
+        state.profile_file = args[arg_idx + 1]
+
+    if state.print_profile or state.profile_file is not None:
+        state.profiler = Profiler()
+
+    for arg, arg_idx in zip(args, range(len(args))):
+        if arg not in ARGS__export:
+            continue
+
+        if arg_idx == len(args) - 1:
+            print_error(state, "The export flag is the last argument. You need to supply a .csv or .jsonl file")
+
+        state.export_file = args[arg_idx + 1]
+        export_format_for_file(state, state.export_file)
+    if len([arg for arg in args if arg in ARGS__token_cache]) != 0:
+        state.token_cache_file = os.path.join(get_user_cache_dir(), "oauth-tokens.json")
+
+    for arg, arg_idx in zip(args, range(len(args))):
+        if arg not in ARGS__ir_cache:
+            continue
+
+        if arg_idx == len(args) - 1:
+            print_error(state, "The IR cache flag is the last argument. You need to supply a directory")
+
+        state.ir_cache_dir = args[arg_idx + 1]
 
     cost_only = len([arg for arg in args if arg in ARGS__cost_only]) == 1
 
     if state.is_verbose:
         print_version()
 
+    for arg, arg_idx in zip(args, range(len(args))):
+        if arg not in ARGS__pool_size:
+            continue
+
+        if arg_idx == len(args) - 1:
+            print_error(state, "The pool size flag is the last argument. You need to supply a number of connections")
+
+        try:
+            state.http_pool_size = int(args[arg_idx + 1])
+        except ValueError:
+            print_error(state, "The pool size must be a number, received '" + args[arg_idx + 1] + "'")
+
+        if state.http_pool_size < 1:
+            print_error(state, "The pool size must be at least 1")
+
+    for arg, arg_idx in zip(args, range(len(args))):
+        if arg not in ARGS__batch_submits:
+            continue
+
+        if arg_idx == len(args) - 1:
+            print_error(state, "The batch submits flag is the last argument. You need to supply the maximum number of buffers per batch")
+
+        try:
+            state.batch_size = int(args[arg_idx + 1])
+        except ValueError:
+            print_error(state, "The batch size must be a number, received '" + args[arg_idx + 1] + "'")
+
+    if state.use_async and state.batch_size > 1:
+        print_error(state, "Asynchronous submits cannot be combined with batched submits")
+
+    for arg, arg_idx in zip(args, range(len(args))):
+        if arg not in ARGS__jobs:
+            continue
+
+        if arg_idx == len(args) - 1:
+            print_error(state, "The jobs flag is the last argument. You need to supply the number of files to run at once")
+
+        try:
+            state.jobs = int(args[arg_idx + 1])
+        except ValueError:
+            print_error(state, "The number of jobs must be a number, received '" + args[arg_idx + 1] + "'")
+
+        if state.jobs < 1:
+            print_error(state, "The number of jobs must be at least 1")
+
     for arg, arg_idx in zip(args, range(len(args))):
         if arg not in ARGS__parameter:
             continue
@@ -1327,26 +3478,188 @@ def initialise_from_args(args, file_name: str = None, file_content: str = None,
 
                 state.connections[configuration_name] = full_file_name
 
-    if do_prepare:
-        deal_with_prepare(state, file_content, cost_only=cost_only)
-    else:
-        if file_content is not None:
-            deal_with_input(state, file_content)
+    # Only now, so an error in the arguments cannot leave behind a trace that was never closed (and is not valid JSON)
+    if trace_file is not None:
+        try:
+            state.tracer = Tracer(trace_file)
+        except OSError as ex:
+            print_error(state, "Could not open the trace file '" + trace_file + "': " + str(ex))
+
+    try:
+        if do_prepare:
+            with trace_span(state, "prepare", "file"):
+                deal_with_prepare(state, file_content, cost_only=cost_only)
         else:
-            while (future := state.get_next()) != FUTURE_TYPE_none:
-                state.file_name = future['name']
-                if future['type'] == FUTURE_TYPE_input:
+            if file_content is not None:
+                with file_span(state, "script", state.file_name):
                     deal_with_input(state, file_content)
-                else:
-                    default_connection = get_connection_info(state, connection_name=DEFAULT_CONNECTION)
-                    exec_as = "dba" if state.file_name.endswith("dba") else "jaaql"
-                    the_database = default_connection.database
-                    try:
-                        the_database = get_connection_info(state, connection_name="dba_db" if state.file_name.endswith("dba") else "jaaql").database
+            elif state.jobs > 1:
+                run_future_files_in_parallel(state, args)
+            else:
+                while (future := state.get_next()) != FUTURE_TYPE_none:
+                    if future['type'] == FUTURE_TYPE_barrier:
+                        continue  # Files already run one after the other
+                    state.file_name = future['name']
+                    if future['type'] == FUTURE_TYPE_input:
+                        with file_span(state, "script " + os.path.basename(state.file_name), state.file_name):
+                            deal_with_input(state, file_content)
+                    else:
+                        default_connection = get_connection_info(state, connection_name=DEFAULT_CONNECTION)
                         exec_as = "dba" if state.file_name.endswith("dba") else "jaaql"
-                    except:
-                        pass
-                    execute_file_with_psql(state, exec_as, the_database, state.file_name, default_connection.get_http_url())
+                        the_database = default_connection.database
+                        try:
+                            the_database = get_connection_info(state, connection_name="dba_db" if state.file_name.endswith("dba") else "jaaql").database
+                            exec_as = "dba" if state.file_name.endswith("dba") else "jaaql"
+                        except:
+                            pass
+                        with file_span(state, "psql " + os.path.basename(state.file_name), state.file_name):
+                            try:
+                                execute_file_with_psql(state, exec_as, the_database, state.file_name, default_connection.get_http_url())
+                            except StatementFailure:
+                                pass  # Recorded under --keep-going, the next file still runs
+
+        if len(state.failures) != 0:
+            report_failures(state)
+
+        unused_parameters = [parameter for parameter in state.parameters if parameter not in state.used_parameters]
+        if len(unused_parameters) != 0 and not do_prepare and state.jobs == 1:  # Parallel workers report their own
+            state.log("Unused parameter(s) " + ", ".join(unused_parameters))
+
+        if state.import_cache_hits + state.import_cache_misses != 0:
+            state.log("Imports: %d cached, %d read, %d bytes not re-read" %
+                      (state.import_cache_hits, state.import_cache_misses, state.import_cache_bytes_saved))
+    finally:
+        if state.async_engine is not None:
+            state.async_engine.close()
+        state.close_http_sessions()
+        close_psql_sessions(state)
+        if state.tracer is not None:
+            state.tracer.close()
+        if state.profiler is not None:
+            if state.profile_file is not None:
+                state.profiler.write_json(state.profile_file)
+            if state.print_profile:
+                print(state.profiler.report())
+
+
+def _strip_future_file_args(args):
+    # The arguments every parallel worker shares: everything except the files to run and the scheduling flags
+    stripped = []
+    idx = 0
+    while idx < len(args):
+        if args[idx] in ARGS__input_file or args[idx] in ARGS__psql_file or args[idx] in ARGS__jobs or args[idx] in ARGS__trace or \
+                args[idx] in ARGS__profile_json or args[idx] in ARGS__export:
+            idx += 2
+        elif args[idx] in ARGS__barrier or args[idx] in ARGS__profile:
+            idx += 1
+        else:
+            stripped.append(args[idx])
+            idx += 1
+    return stripped
+
+
+def _run_future_file_job(worker_args, future, trace_file: str = None, profile: bool = False, export_file: str = None):
+    # Runs in a worker process with a State of its own. Output is captured so the parent can print it in file order
+    import tempfile
+    import uuid
+
+    out = io.StringIO()
+    err = io.StringIO()
+    file_flag = ARGS__input_file[0] if future["type"] == FUTURE_TYPE_input else ARGS__psql_file[0]
+    if trace_file is not None:
+        trace_file = "%s.%d.%s" % (trace_file, os.getpid(), uuid.uuid4().hex)  # Merged into the parent's trace afterwards
+        worker_args = worker_args + [ARGS__trace[0], trace_file]
+    profile_file = None
+    if profile:
+        profile_file = os.path.join(tempfile.gettempdir(), "jaaql-profile.%d.%s.json" % (os.getpid(), uuid.uuid4().hex))
+        worker_args = worker_args + [ARGS__profile_json[0], profile_file]
+    if export_file is not None:
+        root, extension = os.path.splitext(export_file)  # The extension gives the format
+        export_file = "%s.%d.%s%s" % (root, os.getpid(), uuid.uuid4().hex, extension)  # Appended to the parent's export afterwards
+        worker_args = worker_args + [ARGS__export[0], export_file]
+    succeeded = True
+    with redirect_stdout(out), redirect_stderr(err):
+        try:
+            initialise_from_args(worker_args + [file_flag, future["name"]], do_exit=False)
+        except JAAQLMonitorException:
+            succeeded = False
+        except Exception:
+            import traceback
+            traceback.print_exc()
+            succeeded = False
+    return out.getvalue(), err.getvalue(), succeeded, trace_file, profile_file, export_file
+
+
+def _skip_csv_record(csv_file):
+    # A record ends with the first line that leaves its quotes balanced, as quotes within a quoted value are doubled
+    quotes = 0
+    while len(line := csv_file.readline()) != 0:
+        quotes += line.count(b'"')
+        if quotes % 2 == 0:
+            return
+
+
+def _append_worker_export(state: State, worker_export_file: str):
+    # Takes in what a parallel worker exported, removing its file. Workers are taken in file order, so the export holds the
+    # rows in the order a sequential run would have written them. Each worker's csv starts with a header of its own, only the
+    # first is kept
+    import shutil
+
+    if not os.path.exists(worker_export_file):
+        return  # The worker's file exported nothing
+    try:
+        with open(worker_export_file, "rb") as worker_file, open(state.export_file, "ab" if state.export_started else "wb") as out_file:
+            if state.export_started and export_format_for_file(state, state.export_file) == EXPORT__csv:
+                _skip_csv_record(worker_file)
+            shutil.copyfileobj(worker_file, out_file, EXPORT__buffer_size)
+        os.remove(worker_export_file)
+    except OSError as ex:
+        print_error(state, "Could not export to '" + state.export_file + "': " + str(ex))
+    state.export_started = True
+
+
+def run_future_files_in_parallel(state: State, args):
+    from concurrent.futures import ProcessPoolExecutor
+
+    # Files between barriers are independent and run concurrently. A group must finish entirely before the next starts
+    groups = [[]]
+    while (future := state.get_next()) != FUTURE_TYPE_none:
+        if future["type"] == FUTURE_TYPE_barrier:
+            groups.append([])
+        else:
+            groups[-1].append(future)
+
+    worker_args = _strip_future_file_args(args)
+    failed = []
+    with ProcessPoolExecutor(max_workers=state.jobs) as executor:
+        for group in groups:
+            trace_file = state.tracer.file_name if state.tracer is not None else None
+            submitted = [(future, executor.submit(_run_future_file_job, worker_args, future, trace_file, state.profiler is not None,
+                                                  state.export_file)) for future in group]
+            for future, job in submitted:
+                out, err, succeeded, worker_trace_file, worker_profile_file, worker_export_file = job.result()
+                if worker_trace_file is not None:
+                    state.tracer.append_trace(worker_trace_file)
+                if worker_profile_file is not None:
+                    state.profiler.merge_file(worker_profile_file)
+                if worker_export_file is not None:
+                    _append_worker_export(state, worker_export_file)
+                sys.stdout.write(out)
+                sys.stdout.flush()
+                sys.stderr.write(err)
+                sys.stderr.flush()
+                if not succeeded:
+                    failed.append(future["name"])
+            if len(failed) != 0 and not state.keep_going:
+                break
+
+    if len(failed) != 0:
+        msg = "Failed executing %d file(s):\n" % len(failed) + "\n".join(["    " + file_name for file_name in failed])
+        print(msg, file=sys.stderr)
+        if state.do_exit:
+            exit(1)
+        else:
+            raise JAAQLMonitorException(msg)
 
 
 def initialise(file_name: str, configs: list[[str, str]], encoded_configs: list[[str, str, str, str, str | None]],
@@ -1406,4 +3719,7 @@ def expand_args_file(argv):
 
 
 if __name__ == "__main__":
+    if getattr(sys, "frozen", False):  # Only the built executable needs it, for the -j workers on Windows
+        import multiprocessing
+        multiprocessing.freeze_support()
     initialise_from_args(expand_args_file(sys.argv[1:]))
@@ -0,0 +1,45 @@
+"""
+Measures the monitor's cold start: what importing monitor.main costs, and which modules it imports. The microcompiler starts
+the monitor once per install step, so this is paid hundreds of times a build. Shared by tests/test_startup.py, which checks
+it against the budget, and benchmarks/bench_startup.py, which reports it in detail
+"""
+import compileall
+import os
+import statistics
+import subprocess
+import sys
+
+DEFAULT_BUDGET_MS = 30
+RUNS = 7
+
+# Imported by the code paths that use them, never at startup
+DEFERRED_MODULES = ["requests", "urllib3", "http.cookiejar", "asyncio", "multiprocessing", "concurrent.futures.process",
+                    "concurrent.futures.thread", "inspect", "subprocess", "platform", "getpass", "csv", "gzip", "uuid", "hashlib"]
+
+
+def import_times() -> dict:
+    # Module -> cumulative microseconds for monitor.main and what it imports, from one fresh interpreter. importtime lists
+    # a module after those it imported, indented beneath it, so they are the indented lines just before monitor.main
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    child = subprocess.run([sys.executable, "-X", "importtime", "-c", "import monitor.main"], cwd=root, stdout=subprocess.PIPE,
+                           stderr=subprocess.PIPE, text=True, check=True)
+    times = {}
+    for line in child.stderr.splitlines():
+        if not line.startswith("import time:") or not line.split("|")[1].strip().isdigit():
+            continue
+        _, cumulative, name = line.split("|")
+        if not name.startswith("  "):  # The top of an import made at startup, by site or by monitor.main itself
+            if name.strip() == "monitor.main":
+                times[name.strip()] = int(cumulative)
+                return times
+            times = {}
+            continue
+        times[name.strip()] = int(cumulative)
+    return times
+
+
+def measure_startup() -> tuple:
+    # The median milliseconds to import monitor.main over RUNS fresh interpreters, and the import times of the last of them
+    compileall.compile_dir(os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "monitor"), quiet=1)
+    runs = [import_times() for _ in range(RUNS)]
+    return statistics.median(times["monitor.main"] for times in runs) / 1000, runs[-1]
@@ -0,0 +1,154 @@
+"""
+A local stand-in for a JAAQL server, so the monitor can be driven end to end without a network or a database. It answers
+/oauth/token, /submit, /prepare, /accounts, /accounts/batch, /cron and /internal/* as the monitor expects, after a
+configurable latency, with /submit results of a configurable size. Gzip request bodies (--compress) are read. The tests
+and benchmarks/bench_suite.py both serve from it.
+
+    python -m tests.stub_jaaql [port] [latency ms] [result rows]
+
+Then point the monitor at it with a credentials file whose first line is the printed url.
+"""
+import base64
+import gzip
+import json
+import sys
+import threading
+import time
+from collections import Counter
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+from monitor.main import ENDPOINT__oauth, ENDPOINT__submit, ENDPOINT__prepare, ENDPOINT__attach, ENDPOINT__attach_batch, ENDPOINT__cron
+
+API_PREFIX = "/api"  # The monitor adds it to any http url without the dev port
+INTERNAL_PREFIX = "/internal/"
+TOKEN_LIFETIME_SECONDS = 3600
+
+
+class StubJAAQLHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    disable_nagle_algorithm = True  # Headers and body are written apart, which would otherwise wait on a delayed ack
+
+    def log_message(self, *args):
+        pass
+
+    def _reply(self, status: int, body: bytes):
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def endpoint(self) -> str:
+        endpoint = self.path.split("?")[0]
+        return endpoint[len(API_PREFIX):] if endpoint.startswith(API_PREFIX) else endpoint
+
+    def oauth(self, request: dict):
+        self._reply(200, json.dumps(self.server.stub.make_token()).encode("UTF-8"))
+
+    def submit(self, request: dict):
+        self._reply(200, self.server.stub.result)
+
+    def _handle(self):
+        # Subclasses answer /oauth/token and /submit differently by overriding oauth and submit
+        stub = self.server.stub
+        body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        if self.headers.get("Content-Encoding") == "gzip":
+            body = gzip.decompress(body)
+        request = json.loads(body) if len(body) != 0 else {}  # As the server would, so large request bodies cost it something too
+
+        endpoint = self.endpoint()
+        stub.count(endpoint)
+        if stub.latency != 0:
+            time.sleep(stub.latency)
+
+        if endpoint == ENDPOINT__oauth:
+            self.oauth(request)
+        elif endpoint == ENDPOINT__submit:
+            self.submit(request)
+        elif endpoint in [ENDPOINT__prepare, ENDPOINT__attach, ENDPOINT__attach_batch, ENDPOINT__cron] or endpoint.startswith(INTERNAL_PREFIX):
+            self._reply(200, b"{}")
+        else:
+            self._reply(404, json.dumps({"message": "No such endpoint " + endpoint}).encode("UTF-8"))
+
+    def do_GET(self):
+        self._handle()
+
+    def do_POST(self):
+        self._handle()
+
+
+class StubJAAQLServer:
+    """
+    Serves on an ephemeral localhost port from a background thread. Usable as a context manager. requests counts the
+    requests served per endpoint. handler may be a StubJAAQLHandler subclass answering some requests differently
+    """
+
+    def __init__(self, latency: float = 0.0, result_rows: int = 1, result_columns: int = 3, value_chars: int = 8, port: int = 0,
+                 handler: type = StubJAAQLHandler):
+        self.latency = latency
+        self.result = json.dumps({
+            "columns": ["column_%d" % idx for idx in range(result_columns)],
+            "rows": [["%0*d" % (value_chars, row) for _ in range(result_columns)] for row in range(result_rows)]
+        }).encode("UTF-8")
+        self.requests = Counter()
+        self._lock = threading.Lock()
+        self._server = ThreadingHTTPServer(("127.0.0.1", port), handler)
+        self._server.daemon_threads = True
+        self._server.stub = self
+        self._thread = None
+
+    @property
+    def url(self) -> str:
+        return "http://127.0.0.1:%d" % self._server.server_address[1]
+
+    def count(self, endpoint: str):
+        with self._lock:
+            self.requests[endpoint] += 1
+
+    def total_requests(self) -> int:
+        with self._lock:
+            return sum(self.requests.values())
+
+    @staticmethod
+    def make_token() -> str:
+        # Shaped like a JWT so the monitor can read its expiry
+        payload = base64.urlsafe_b64encode(json.dumps({"exp": time.time() + TOKEN_LIFETIME_SECONDS}).encode()).decode().rstrip("=")
+        return "stub." + payload + ".stub"
+
+    def write_credentials(self, file_name: str, username: str = "bench", database: str = None) -> str:
+        with open(file_name, "w") as f:
+            f.write("\n".join([self.url, username, "bench"] + ([database] if database is not None else [])) + "\n")
+        return file_name
+
+    def start(self):
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *args):
+        self.stop()
+
+
+def main():
+    port = int(sys.argv[1]) if len(sys.argv) > 1 else 6061
+    latency_ms = float(sys.argv[2]) if len(sys.argv) > 2 else 0
+    result_rows = int(sys.argv[3]) if len(sys.argv) > 3 else 1
+    server = StubJAAQLServer(latency=latency_ms / 1000, result_rows=result_rows, port=port)
+    print("Stand-in JAAQL serving on " + server.url)
+    try:
+        server._server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        print(dict(server.requests))
+
+
+if __name__ == "__main__":
+    main()
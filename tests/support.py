@@ -0,0 +1,46 @@
+"""
+What the tests that drive the monitor end to end share: a test case serving the stand-in JAAQL server in
+tests/stub_jaaql.py for each test, with a temporary directory to write scripts and credentials into
+"""
+import io
+import os
+import tempfile
+import unittest
+from contextlib import redirect_stdout, redirect_stderr
+
+from monitor.main import initialise_from_args
+from tests.stub_jaaql import StubJAAQLHandler, StubJAAQLServer
+
+
+class StubServerTestCase(unittest.TestCase):
+    """
+    Serves handler for each test as self.server. Subclasses set the attributes their handler reads on self.server in setUp
+    """
+    handler = StubJAAQLHandler
+
+    def setUp(self):
+        self.server = StubJAAQLServer(handler=self.handler).start()
+        self.directory = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        self.server.stop()
+        self.directory.cleanup()
+
+    def path(self, file_name: str) -> str:
+        return os.path.join(self.directory.name, file_name)
+
+    def write(self, file_name: str, lines: list) -> str:
+        with open(self.path(file_name), "w") as f:
+            f.write("\n".join(lines) + "\n")
+        return self.path(file_name)
+
+    def credentials(self, username: str = "dba") -> str:
+        return self.server.write_credentials(self.path(username + ".credentials.txt"), username)
+
+    def run_monitor(self, args: list) -> tuple:
+        # Returns what was printed to stdout and stderr. A run that fails raises, as it does with do_exit=False
+        out = io.StringIO()
+        err = io.StringIO()
+        with redirect_stdout(out), redirect_stderr(err):
+            initialise_from_args(args, do_exit=False)
+        return out.getvalue(), err.getvalue()
@@ -0,0 +1,139 @@
+"""
+Runs scripts with --async against the stand-in JAAQL server in tests/stub_jaaql.py, recording when the server starts
+and finishes each /submit, to check the order each connection's statements run in, the order errors are reported in
+and that a request turned away with a 401 is resent before anything queued after it.
+
+    python -m pytest tests
+"""
+import json
+import threading
+import time
+import unittest
+
+from monitor.main import HEADER__security, JAAQLMonitorException
+from tests.stub_jaaql import StubJAAQLHandler
+from tests.support import StubServerTestCase
+
+SLOW_SECONDS = 0.3  # How long the server takes over a query containing SLOW
+
+
+class RecordingHandler(StubJAAQLHandler):
+    """
+    Tokens name the account they were issued to. A query containing SLOW is answered after SLOW_SECONDS and one containing
+    FAIL with an error. The first token issued to an account in server.expire_first is turned away once with a 401
+    """
+
+    def oauth(self, request: dict):
+        stub = self.server.stub
+        token = stub.make_token() + "." + request["username"]
+        with stub.lock:
+            stub.tokens_issued += 1
+            if request["username"] in stub.expire_first:
+                stub.expire_first.remove(request["username"])
+                stub.expired.add(token)
+        self._reply(200, json.dumps(token).encode("UTF-8"))
+
+    def submit(self, request: dict):
+        stub = self.server.stub
+        token = self.headers.get(HEADER__security)
+        query = request["query"].strip()
+        with stub.lock:
+            if token in stub.expired:
+                stub.expired.remove(token)
+                stub.events.append(("401", query))
+                rejected = True
+            else:
+                stub.events.append(("start", query))
+                rejected = False
+        if rejected:
+            self._reply(401, b'{"message": "token expired"}')
+            return
+        if "SLOW" in query:
+            time.sleep(SLOW_SECONDS)
+        with stub.lock:
+            stub.events.append(("end", query))
+        if "FAIL" in query:
+            self._reply(422, json.dumps({"message": "failed " + query}).encode("UTF-8"))
+        else:
+            self._reply(200, stub.result)
+
+
+class AsyncEngineTest(StubServerTestCase):
+    handler = RecordingHandler
+
+    def setUp(self):
+        super().setUp()
+        self.server.lock = threading.Lock()
+        self.server.events = []
+        self.server.expired = set()
+        self.server.expire_first = set()
+        self.server.tokens_issued = 0
+
+    def run_script(self, lines: list, *args) -> str:
+        return self.run_monitor(["-c", self.credentials("dba"), "-c", "app", self.credentials("app"), "-i", self.write("script.sql", lines),
+                                 "--async"] + list(args))[1]
+
+    def index(self, event: str, query: str) -> int:
+        return self.server.events.index((event, query))
+
+    def test_switch_waits_for_other_connections(self):
+        self.run_script([
+            "CREATE TABLE t SLOW;", "\\g",
+            "\\switch jaaql account to @app",
+            "INSERT INTO t;", "\\g"
+        ])
+        self.assertLess(self.index("end", "CREATE TABLE t SLOW;"), self.index("start", "INSERT INTO t;"))
+
+    def test_independent_connections_run_concurrently_in_order(self):
+        self.run_script([
+            "SELECT 'dba 1' SLOW;", "\\g",
+            "SELECT 'dba 2';", "\\g",
+            "\\switch jaaql account to @app independently",
+            "SELECT 'app 1';", "\\g",
+            "SELECT 'app 2';", "\\g"
+        ])
+        # Each connection's statements run one after another, in script order
+        self.assertLess(self.index("end", "SELECT 'dba 1' SLOW;"), self.index("start", "SELECT 'dba 2';"))
+        self.assertLess(self.index("end", "SELECT 'app 1';"), self.index("start", "SELECT 'app 2';"))
+        # Whilst the app's did not wait on the dba's
+        self.assertLess(self.index("end", "SELECT 'app 2';"), self.index("end", "SELECT 'dba 1' SLOW;"))
+
+    def test_errors_are_reported_in_script_order(self):
+        with self.assertRaises(JAAQLMonitorException) as raised:
+            self.run_script([
+                "SELECT 'dba' SLOW FAIL;", "\\g",
+                "\\switch jaaql account to @app independently",
+                "SELECT 'app' FAIL;", "\\g"
+            ])
+        # The app's statement failed first, but comes later in the script
+        self.assertLess(self.index("end", "SELECT 'app' FAIL;"), self.index("end", "SELECT 'dba' SLOW FAIL;"))
+        self.assertIn("failed SELECT 'dba' SLOW FAIL;", str(raised.exception))
+        self.assertNotIn("failed SELECT 'app' FAIL;", str(raised.exception))
+
+    def test_keep_going_reports_every_error_in_script_order(self):
+        with self.assertRaises(JAAQLMonitorException) as raised:
+            self.run_script([
+                "SELECT 'dba' SLOW FAIL;", "\\g",
+                "\\switch jaaql account to @app independently",
+                "SELECT 'app' FAIL;", "\\g",
+                "SELECT 'app' after;", "\\g"
+            ], "--keep-going")
+        summary = str(raised.exception)
+        self.assertTrue(summary.startswith("2 statement(s) failed:"))
+        self.assertLess(summary.index("failed SELECT 'dba' SLOW FAIL;"), summary.index("failed SELECT 'app' FAIL;"))
+        self.assertIn(("end", "SELECT 'app' after;"), self.server.events)
+
+    def test_401_is_resent_before_later_requests(self):
+        self.server.expire_first.add("dba")
+        self.run_script([
+            "SELECT 1;", "\\g",
+            "SELECT 2;", "\\g",
+            "SELECT 3;", "\\g"
+        ])
+        self.assertEqual([event for event in self.server.events if event[0] != "end"],
+                         [("401", "SELECT 1;"), ("start", "SELECT 1;"), ("start", "SELECT 2;"), ("start", "SELECT 3;")])
+        self.assertEqual(self.server.tokens_issued, 2)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,102 @@
+"""
+Runs scripts with --batch-submits against the stand-in JAAQL server in tests/stub_jaaql.py, checking that a buffer
+failing part way through a batch is reported exactly as it would be were it submitted on its own: at its own file and
+line, with its own buffer, and with the server's LINE and caret moved to be relative to that buffer
+
+    python -m pytest tests
+"""
+import json
+import unittest
+
+from monitor.main import JAAQLMonitorException
+from tests.stub_jaaql import StubJAAQLHandler
+from tests.support import StubServerTestCase
+
+
+class SyntaxErrorHandler(StubJAAQLHandler):
+    """
+    Records the query of each /submit in server.queries. A query with a line containing FAIL is answered as postgres
+    answers a syntax error, with the line within the query it was sent and a caret beneath the offending word. Unless
+    server.line_numbers is False, when it is answered with just the message
+    """
+
+    def submit(self, request: dict):
+        stub = self.server.stub
+        query = request["query"]
+        stub.queries.append(query)
+        lines = query.replace("\r\n", "\n").split("\n")
+        failing = [idx for idx, line in enumerate(lines) if "FAIL" in line]
+        if len(failing) == 0:
+            self._reply(200, stub.result)
+        elif stub.line_numbers:
+            prefix = "LINE %d: " % (failing[0] + 1)
+            self._reply(422, ('ERROR:  syntax error at or near "FAIL"\n' + prefix + lines[failing[0]] + "\n" +
+                              " " * (len(prefix) + lines[failing[0]].index("FAIL")) + "^\n\n\n").encode("UTF-8"))
+        else:
+            self._reply(422, json.dumps({"message": "failed " + lines[failing[0]].strip()}).encode("UTF-8"))
+
+
+class BatchSubmitsTest(StubServerTestCase):
+    handler = SyntaxErrorHandler
+
+    # The failing buffer starts on line 8 of the script and is the fourth buffer of the batch, its failing line is on
+    # line 2 of the buffer and on line 10 (two digits) of the batch
+    SCRIPT = [
+        "SELECT 1;",
+        "\\g",
+        "SELECT 2;",
+        "\\g",
+        "SELECT 3,",
+        "    4;",
+        "\\g",
+        "SELECT 'failing buffer',",
+        "    FAIL;",
+        "\\g",
+        "SELECT 5;",
+        "\\g"
+    ]
+
+    def setUp(self):
+        super().setUp()
+        self.server.queries = []
+        self.server.line_numbers = True
+
+    def run_script(self, *args) -> str:
+        self.server.queries = []
+        with self.assertRaises(JAAQLMonitorException) as raised:
+            self.run_monitor(["-c", self.credentials(), "-i", self.write("script.sql", self.SCRIPT)] + list(args))
+        return str(raised.exception)
+
+    def test_error_in_a_batch_reads_as_if_submitted_alone(self):
+        alone = self.run_script()
+        batched = self.run_script("--batch-submits", "10")
+        self.assertEqual(len(self.server.queries), 1)  # Every buffer went in one batch
+        self.assertEqual(batched, alone)
+        self.assertIn("LINE 2:     FAIL;", batched)
+        self.assertIn("00002>     FAIL;", batched)
+        self.assertIn("Buffer [", batched)
+        self.assertIn("SELECT 'failing buffer',", batched)
+        self.assertNotIn("SELECT 3,", batched)
+        self.assertNotIn("SELECT 5;", batched)
+
+    def test_keep_going_reports_the_line_of_the_failing_buffer(self):
+        summary = self.run_script("--batch-submits", "10", "--keep-going")
+        self.assertTrue(summary.startswith("1 statement(s) failed:"))
+        self.assertIn("script.sql:9: ", summary)
+        self.assertIn("\n        SELECT 'failing buffer',", summary)
+        # The batch was rolled back, so every buffer was replayed one at a time and the one after the failure still ran
+        self.assertIn("SELECT 5;\n", self.server.queries[-1])
+
+    def test_error_without_a_line_number_replays_to_find_the_buffer(self):
+        self.server.line_numbers = False
+        alone = self.run_script()
+        batched = self.run_script("--batch-submits", "10")
+        self.assertEqual(batched, alone)
+        self.assertIn("failed FAIL;", batched)
+        self.assertIn("SELECT 'failing buffer',", batched)
+        # The batch, then its buffers one at a time up to the failing one
+        self.assertEqual(len(self.server.queries), 5)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,82 @@
+"""
+Runs scripts with --compress against the stand-in JAAQL server in tests/stub_jaaql.py, checking which /submit bodies are
+gzipped, that a server turning gzip away (a 415, or a 400 saying it cannot read the body) gets the request again as plain
+JSON along with every later one, and that any other 400 is not sent twice
+
+    python -m pytest tests
+"""
+import gzip
+import json
+import unittest
+
+from monitor.main import COMPRESS__min_bytes, ENDPOINT__submit, JAAQLMonitorException
+from tests.stub_jaaql import StubJAAQLHandler
+from tests.support import StubServerTestCase
+
+LARGE = "SELECT '%s';" % ("x" * COMPRESS__min_bytes)
+
+
+class GzipRejectingHandler(StubJAAQLHandler):
+    """
+    Records the Content-Encoding and Content-Type of each /submit in server.submits, and its query in server.queries. A
+    gzipped body is answered with server.rejection, a (status, body) pair, unless it is None. A query containing FAIL is
+    answered with a 400, as a SQL error is
+    """
+
+    def _handle(self):
+        if self.endpoint() != ENDPOINT__submit:
+            return super()._handle()
+
+        stub = self.server.stub
+        body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        encoding = self.headers.get("Content-Encoding")
+        stub.submits.append((encoding, self.headers.get("Content-Type")))
+        if encoding == "gzip" and stub.rejection is not None:
+            self._reply(*stub.rejection)
+            return
+        query = json.loads(gzip.decompress(body) if encoding == "gzip" else body)["query"].strip()
+        stub.queries.append(query)
+        if "FAIL" in query:
+            self._reply(400, b'{"message": "syntax error at or near FAIL"}')
+        else:
+            self._reply(200, stub.result)
+
+
+class CompressionTest(StubServerTestCase):
+    handler = GzipRejectingHandler
+
+    def setUp(self):
+        super().setUp()
+        self.server.submits = []
+        self.server.queries = []
+        self.server.rejection = None
+
+    def run_script(self, lines: list):
+        self.run_monitor(["-c", self.credentials(), "-i", self.write("script.sql", lines), "--compress"])
+
+    def test_only_large_bodies_are_gzipped(self):
+        self.run_script(["SELECT 1;", "\\g", LARGE, "\\g"])
+        self.assertEqual(self.server.submits, [(None, "application/json"), ("gzip", "application/json")])
+        self.assertEqual(self.server.queries, ["SELECT 1;", LARGE])
+
+    def test_415_is_resent_uncompressed_as_is_everything_after(self):
+        self.server.rejection = (415, b'{"message": "Unsupported Media Type"}')
+        self.run_script([LARGE, "\\g", "SELECT 2;", "\\g", LARGE, "\\g"])
+        self.assertEqual([encoding for encoding, _ in self.server.submits], ["gzip", None, None, None])
+        self.assertEqual(self.server.queries, [LARGE, "SELECT 2;", LARGE])
+
+    def test_400_saying_the_body_is_unreadable_is_resent_uncompressed(self):
+        self.server.rejection = (400, b'{"message": "Failed to decode JSON object: \'utf-8\' codec can\'t decode byte 0x8b"}')
+        self.run_script([LARGE, "\\g", LARGE, "\\g"])
+        self.assertEqual([encoding for encoding, _ in self.server.submits], ["gzip", None, None])
+        self.assertEqual(self.server.queries, [LARGE, LARGE])
+
+    def test_other_400s_are_not_resent(self):
+        with self.assertRaises(JAAQLMonitorException) as raised:
+            self.run_script([LARGE[:-1] + " FAIL;", "\\g"])
+        self.assertIn("syntax error at or near FAIL", str(raised.exception))
+        self.assertEqual([encoding for encoding, _ in self.server.submits], ["gzip"])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,85 @@
+"""
+Runs scripts with --export, \\g > file and \\export against the stand-in JAAQL server in tests/stub_jaaql.py, checking what
+is written: one csv header however many statements a script exports, statements returning no rows (DDL) skipped rather
+than failing the run, and one json object per row for .jsonl and .ndjson files
+
+    python -m pytest tests
+"""
+import csv
+import json
+import re
+import unittest
+
+from monitor.main import JAAQLMonitorException
+from tests.stub_jaaql import StubJAAQLHandler
+from tests.support import StubServerTestCase
+
+
+class RowsHandler(StubJAAQLHandler):
+    """
+    A query naming "ROWS <n> FROM <m>" is answered with n rows numbered from m. Anything else, such as DDL, is answered
+    with no columns and no rows
+    """
+
+    def submit(self, request: dict):
+        match = re.search(r"ROWS (\d+) FROM (\d+)", request["query"])
+        if match is None:
+            self._reply(200, b"{}")
+            return
+        count, first = int(match.group(1)), int(match.group(2))
+        self._reply(200, json.dumps({
+            "columns": ["id", "label", "data"],
+            "rows": [[idx, "row %d, \"quoted\"" % idx, {"idx": idx}] for idx in range(first, first + count)]
+        }).encode("UTF-8"))
+
+
+def expected_rows(first: int, last: int) -> list:
+    return [[str(idx), "row %d, \"quoted\"" % idx, json.dumps({"idx": idx})] for idx in range(first, last + 1)]
+
+
+class ExportTest(StubServerTestCase):
+    handler = RowsHandler
+
+    def run_script(self, lines: list, *args) -> str:
+        return self.run_monitor(["-c", self.credentials(), "-i", self.write("script.sql", lines)] + list(args))[0]
+
+    def read_csv(self, file_name: str) -> list:
+        with open(self.path(file_name), "r", encoding="UTF-8", newline="") as f:
+            return list(csv.reader(f))
+
+    def read_jsonl(self, file_name: str) -> list:
+        with open(self.path(file_name), "r", encoding="UTF-8") as f:
+            return [json.loads(line) for line in f]
+
+    def test_csv_has_one_header_across_statements(self):
+        self.run_script(["SELECT ROWS 2 FROM 1;", "\\g", "SELECT ROWS 3 FROM 3;", "\\g"], "--export", self.path("out.csv"))
+        self.assertEqual(self.read_csv("out.csv"), [["id", "label", "data"]] + expected_rows(1, 5))
+
+    def test_statements_returning_no_rows_are_skipped(self):
+        output = self.run_script(["CREATE TABLE t (id int);", "\\g", "SELECT ROWS 2 FROM 1;", "\\g", "INSERT INTO t VALUES (1);", "\\g",
+                                  "SELECT ROWS 1 FROM 3;", "\\g"], "--export", self.path("out.csv"), "-v")
+        self.assertEqual(self.read_csv("out.csv"), [["id", "label", "data"]] + expected_rows(1, 3))
+        self.assertIn("Nothing to export to", output)
+
+    def test_jsonl_has_an_object_per_row(self):
+        for file_name in ["out.jsonl", "out.ndjson"]:
+            self.run_script(["SELECT ROWS 2 FROM 1;", "\\g", "CREATE TABLE t (id int);", "\\g", "SELECT ROWS 1 FROM 3;", "\\g"],
+                            "--export", self.path(file_name))
+            self.assertEqual(self.read_jsonl(file_name), [{"id": idx, "label": "row %d, \"quoted\"" % idx, "data": {"idx": idx}}
+                                                          for idx in range(1, 4)])
+
+    def test_go_to_file_writes_a_file_per_statement(self):
+        self.run_script(["SELECT ROWS 2 FROM 1;", "\\g > " + self.path("first.csv"), "SELECT ROWS 1 FROM 3;",
+                         "\\g > " + self.path("second.jsonl"), "SELECT ROWS 1 FROM 4;", "\\export csv " + self.path("third.txt")])
+        self.assertEqual(self.read_csv("first.csv"), [["id", "label", "data"]] + expected_rows(1, 2))
+        self.assertEqual(self.read_jsonl("second.jsonl"), [{"id": 3, "label": "row 3, \"quoted\"", "data": {"idx": 3}}])
+        self.assertEqual(self.read_csv("third.txt"), [["id", "label", "data"]] + expected_rows(4, 4))
+
+    def test_failed_export_is_not_reported_as_exported(self):
+        with self.assertRaises(JAAQLMonitorException) as raised:
+            self.run_script(["SELECT ROWS 1 FROM 1;", "\\g"], "--export", self.path("missing/out.csv"), "-v")
+        self.assertIn("Could not export to", str(raised.exception))
+
+
+if __name__ == "__main__":
+    unittest.main()
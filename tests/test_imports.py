@@ -0,0 +1,100 @@
+"""
+Runs scripts that \\import other files against the stand-in JAAQL server in tests/stub_jaaql.py, checking that what
+is reported for a statement in an imported file, in the --keep-going summary, the --profile report and the --trace, points
+at its line in that file, whether the script is streamed or run from its compiled form (--ir-cache)
+
+    python -m pytest tests
+"""
+import json
+import os
+import unittest
+
+from monitor.main import ENDPOINT__submit, JAAQLMonitorException
+from tests.stub_jaaql import StubJAAQLHandler
+from tests.support import StubServerTestCase
+
+
+class FailingHandler(StubJAAQLHandler):
+    """
+    A /submit whose query contains FAIL is answered with an error naming the query. The size of each /submit body is
+    recorded in server.submit_bytes
+    """
+
+    def submit(self, request: dict):
+        self.server.stub.submit_bytes.append(int(self.headers["Content-Length"]))
+        query = request["query"].strip()
+        if "FAIL" in query:
+            self._reply(422, json.dumps({"message": "failed " + query}).encode("UTF-8"))
+        else:
+            self._reply(200, self.server.stub.result)
+
+
+class ImportLineTest(StubServerTestCase):
+    handler = FailingHandler
+
+    IMPORTED = [
+        "SELECT 'inc 1' FAIL \\g",
+        "",
+        "SELECT 'inc 3' FAIL \\g",
+        "",
+        "SELECT 'inc 5' FAIL \\g",
+        ""
+    ]
+    SCRIPT = [
+        "SELECT 'main 1';",
+        "\\g",
+        "",
+        "",
+        "",
+        "",
+        "",
+        "\\import inc.sql",
+        "SELECT 'main 9' FAIL \\g"
+    ]
+
+    def setUp(self):
+        super().setUp()
+        self.server.submit_bytes = []
+
+    def run_script(self, *args) -> str:
+        self.write("inc.sql", self.IMPORTED)
+        with self.assertRaises(JAAQLMonitorException) as raised:
+            self.run_monitor(["-c", self.credentials(), "-i", self.write("script.sql", self.SCRIPT), "--keep-going"] + list(args))
+        return str(raised.exception)
+
+    def assert_failure_lines(self, summary: str):
+        self.assertTrue(summary.startswith("4 statement(s) failed:"))
+        for file_name, line, query in [("inc.sql", 1, "SELECT 'inc 1' FAIL"), ("inc.sql", 3, "SELECT 'inc 3' FAIL"),
+                                       ("inc.sql", 5, "SELECT 'inc 5' FAIL"), ("script.sql", 9, "SELECT 'main 9' FAIL")]:
+            self.assertIn("%s:%d: failed %s" % (self.path(file_name), line, query), summary)
+
+    def test_keep_going_reports_lines_of_the_imported_file(self):
+        self.assert_failure_lines(self.run_script())
+
+    def test_keep_going_reports_lines_of_the_imported_file_from_the_ir(self):
+        ir_cache = self.path("ir")
+        self.assert_failure_lines(self.run_script("--ir-cache", ir_cache))  # Compiled
+        self.assert_failure_lines(self.run_script("--ir-cache", ir_cache))  # Cached
+
+    def test_profile_reports_lines_of_the_imported_file(self):
+        profile_file = self.path("profile.json")
+        self.run_script("--profile-json", profile_file)
+        with open(profile_file, "r", encoding="UTF-8") as f:
+            statements = json.load(f)["statements"]
+        self.assertEqual(sorted((os.path.basename(statement["file"]), statement["line"], statement["query"]) for statement in statements),
+                         [("inc.sql", 1, "SELECT 'inc 1' FAIL"), ("inc.sql", 3, "SELECT 'inc 3' FAIL"),
+                          ("inc.sql", 5, "SELECT 'inc 5' FAIL"), ("script.sql", 1, "SELECT 'main 1';"),
+                          ("script.sql", 9, "SELECT 'main 9' FAIL")])
+
+    def test_trace_reports_lines_of_the_imported_file(self):
+        trace_file = self.path("trace.json")
+        self.run_script("--trace", trace_file)
+        with open(trace_file, "r", encoding="UTF-8") as f:
+            requests = [event["args"] for event in json.load(f) if event.get("cat") == "request" and event["name"] == ENDPOINT__submit]
+        self.assertEqual([(os.path.basename(args["file"]), args["line"]) for args in requests],
+                         [("script.sql", 2), ("inc.sql", 1), ("inc.sql", 3), ("inc.sql", 5), ("script.sql", 9)])
+        self.assertEqual([args["payload_bytes"] for args in requests], self.server.submit_bytes)
+
+
+if __name__ == "__main__":
+    unittest.main()
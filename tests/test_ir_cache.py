@@ -0,0 +1,105 @@
+"""
+Runs scripts with --ir-cache against the stand-in JAAQL server in tests/stub_jaaql.py, checking that a script is
+compiled once and then run from the cache, that the cache never runs an imported file as it was rather than as it is
+(whether changed between runs or generated by the script as it runs) and that the cache directory is pruned
+
+    python -m pytest tests
+"""
+import os
+import time
+import unittest
+from unittest import mock
+
+from tests.stub_jaaql import StubJAAQLHandler
+from tests.support import StubServerTestCase
+
+
+class GeneratingHandler(StubJAAQLHandler):
+    """
+    Records the query of each /submit in server.queries. One containing GENERATE writes server.generated_content to
+    server.generated_file first, as a script that writes out the file it imports next would
+    """
+
+    def submit(self, request: dict):
+        stub = self.server.stub
+        query = request["query"].strip()
+        stub.queries.append(query)
+        if "GENERATE" in query:
+            with open(stub.generated_file, "w") as f:
+                f.write(stub.generated_content)
+        self._reply(200, stub.result)
+
+
+class IRCacheTest(StubServerTestCase):
+    handler = GeneratingHandler
+
+    def setUp(self):
+        super().setUp()
+        self.server.queries = []
+        self.cache_dir = self.path("ir")
+        self.server.generated_file = self.path("generated.sql")
+
+    def run_script(self, script: str = "script.sql") -> str:
+        self.server.queries = []
+        return self.run_monitor(["-c", self.credentials(), "-i", self.path(script), "--ir-cache", self.cache_dir, "-v"])[0]
+
+    def cache_files(self) -> list:
+        return [file_name for file_name in os.listdir(self.cache_dir) if file_name.endswith(".json")]
+
+    def test_compiled_once_then_run_from_the_cache(self):
+        self.write("inc.sql", ["SELECT 'inc';", "\\g"])
+        self.write("script.sql", ["SELECT 1;", "\\g", "\\import inc.sql", "SELECT 2;", "\\g"])
+
+        cold = self.run_script()
+        self.assertIn("Cached compiled script", cold)
+        self.assertEqual(self.server.queries, ["SELECT 1;", "SELECT 'inc';", "SELECT 2;"])
+
+        warm = self.run_script()
+        self.assertIn("Using cached compiled script", warm)
+        self.assertNotIn("Streaming", warm)
+        self.assertEqual(self.server.queries, ["SELECT 1;", "SELECT 'inc';", "SELECT 2;"])
+        self.assertEqual(len(self.cache_files()), 1)
+
+    def test_changed_import_is_run_as_it_is_now(self):
+        self.write("inc.sql", ["SELECT 'old';", "\\g"])
+        self.write("script.sql", ["\\import inc.sql", "SELECT 2;", "\\g"])
+        self.run_script()
+
+        self.write("inc.sql", ["SELECT 'new 1';", "\\g", "\\q"])
+        output = self.run_script()
+        self.assertIn("Using cached compiled script", output)
+        self.assertEqual(self.server.queries, ["SELECT 'new 1';"])
+
+        self.write("inc.sql", ["SELECT 'new 2';", "\\g"])
+        self.run_script()
+        self.assertEqual(self.server.queries, ["SELECT 'new 2';", "SELECT 2;"])
+
+    def test_generated_import_is_run_as_generated(self):
+        self.write("script.sql", ["SELECT 'GENERATE';", "\\g", "\\import generated.sql", "SELECT 2;", "\\g"])
+
+        # Does not exist when compiled
+        self.server.generated_content = "SELECT 'generated 1';\n\\g\n"
+        self.run_script()
+        self.assertEqual(self.server.queries, ["SELECT 'GENERATE';", "SELECT 'generated 1';", "SELECT 2;"])
+
+        # Left over from the last run when the script starts, but rewritten before it is imported
+        self.server.generated_content = "SELECT 'generated 2';\n\\g\n"
+        output = self.run_script()
+        self.assertIn("Using cached compiled script", output)
+        self.assertEqual(self.server.queries, ["SELECT 'GENERATE';", "SELECT 'generated 2';", "SELECT 2;"])
+
+    def test_cache_is_pruned_to_the_most_recently_used(self):
+        for idx in range(4):
+            self.write("script_%d.sql" % idx, ["SELECT %d;" % idx, "\\g"])
+        with mock.patch("monitor.main.IR__cache_max_files", 2):
+            for idx in [0, 1, 2, 0, 3]:  # 0 is used again, so 1 and 2 are the least recently used
+                self.run_script("script_%d.sql" % idx)
+                time.sleep(0.01)
+        self.assertEqual(len(self.cache_files()), 2)
+        self.assertIn("Using cached compiled script", self.run_script("script_0.sql"))
+        self.assertIn("Using cached compiled script", self.run_script("script_3.sql"))
+        self.assertNotIn("Using cached compiled script", self.run_script("script_1.sql"))
+
+
+if __name__ == "__main__":
+    unittest.main()
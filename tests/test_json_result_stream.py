@@ -0,0 +1,99 @@
+"""
+Checks that JSONResultStream decodes a /submit body the same as json.loads however the body is cut into chunks,
+including cuts inside strings, escapes, numbers and multi byte characters
+
+    python -m pytest tests
+"""
+import json
+import random
+import unittest
+
+from monitor.main import JSONResultStream
+
+BODY = json.dumps({
+    "columns": ["id", "name", "price", "data"],
+    "rows": [
+        [1, "plain", 1.5, None],
+        [-23, "quote \" and backslash \\ and slash /", -0.125, {"nested": [1, 2, {"deep": "x"}]}],
+        [456789, "tab\tnewline\nreturn\r", 1e-7, [True, False, None]],
+        [10000000000000000000000, "accents éè and emoji \U0001F600", 6.02e23, "\\u0041 is not an escape here"],
+        [0, "", -1.0E+10, {}]
+    ],
+    "after": {"message": "members after the rows", "count": 12345}
+}, ensure_ascii=True)
+
+
+def decode(chunks) -> tuple:
+    stream = JSONResultStream(chunks).open()
+    streaming_rows = stream.streaming_rows
+    rows = list(stream.iter_rows())
+    fields = dict(stream.fields)
+    fields.pop("rows", None)
+    return streaming_rows, fields, rows
+
+
+class FakeResponse:
+    def __init__(self, body: bytes, chunk_size: int):
+        self.encoding = "utf-8"
+        self._body = body
+        self._chunk_size = chunk_size
+
+    def iter_content(self, _):
+        for offset in range(0, len(self._body), self._chunk_size):
+            yield self._body[offset:offset + self._chunk_size]
+
+
+class JSONResultStreamTest(unittest.TestCase):
+    def assert_decodes(self, body: str, chunks: list):
+        expected = json.loads(body)
+        streaming_rows, fields, rows = decode(chunks)
+        self.assertTrue(streaming_rows)
+        self.assertEqual(rows, expected.pop("rows"))
+        self.assertEqual(fields, expected)
+
+    def test_every_cut_into_two_chunks(self):
+        for cut in range(len(BODY) + 1):
+            self.assert_decodes(BODY, [BODY[:cut], BODY[cut:]])
+
+    def test_one_character_chunks(self):
+        self.assert_decodes(BODY, list(BODY))
+
+    def test_random_chunks(self):
+        generator = random.Random(1)
+        for _ in range(200):
+            cuts = sorted(generator.sample(range(1, len(BODY)), generator.randint(1, 12)))
+            self.assert_decodes(BODY, [BODY[start:end] for start, end in zip([0] + cuts, cuts + [len(BODY)])])
+
+    def test_unescaped_text_and_whitespace(self):
+        body = json.dumps(json.loads(BODY), ensure_ascii=False, indent=2)
+        for cut in range(len(body) + 1):
+            self.assert_decodes(body, [body[:cut], body[cut:]])
+
+    def test_multi_byte_characters_cut_between_bytes(self):
+        body = json.dumps(json.loads(BODY), ensure_ascii=False).encode("utf-8")
+        for chunk_size in [1, 2, 3, 5, 7]:
+            stream = JSONResultStream.from_response(FakeResponse(body, chunk_size)).open()
+            self.assertEqual(list(stream.iter_rows()), json.loads(body)["rows"])
+
+    def test_rows_before_columns_are_read_into_memory(self):
+        body = json.dumps({"rows": [[1, "a"], [2, "b"]], "columns": ["n", "s"]})
+        for cut in range(len(body) + 1):
+            streaming_rows, fields, rows = decode([body[:cut], body[cut:]])
+            self.assertFalse(streaming_rows)
+            self.assertEqual(rows, [[1, "a"], [2, "b"]])
+            self.assertEqual(fields, {"columns": ["n", "s"]})
+
+    def test_numbers_at_the_end_of_a_chunk_are_not_cut_short(self):
+        body = '{"columns": ["n"], "rows": [[12345], [-6.5e-3], [7]], "total": 98765}'
+        for cut in range(len(body) + 1):
+            self.assert_decodes(body, [body[:cut], body[cut:]])
+
+    def test_malformed_body_is_an_error(self):
+        for body in ['{"columns": ["n"], "rows": [[1], [2}', '{"columns": ["n"], "rows": [[1]', '{"columns" ["n"]}', "[1]"]:
+            with self.assertRaises(json.JSONDecodeError, msg=body):
+                stream = JSONResultStream([body[:7], body[7:]]).open()
+                list(stream.iter_rows())
+
+
+if __name__ == "__main__":
+    unittest.main()
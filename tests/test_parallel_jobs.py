@@ -0,0 +1,58 @@
+"""
+Runs several files with -j against the stand-in JAAQL server in tests/stub_jaaql.py, checking that what the parallel
+workers export with --export is merged into the same file a sequential run writes
+
+    python -m pytest tests
+"""
+import json
+import re
+import unittest
+
+from tests.stub_jaaql import StubJAAQLHandler
+from tests.support import StubServerTestCase
+
+
+class NumberedRowsHandler(StubJAAQLHandler):
+    """
+    A query naming "ROWS <n> FROM <m>" is answered with n rows numbered from m, beneath a header with a quoted line break
+    """
+
+    def submit(self, request: dict):
+        match = re.search(r"ROWS (\d+) FROM (\d+)", request["query"])
+        if match is None:
+            self._reply(200, b"{}")
+            return
+        count, first = int(match.group(1)), int(match.group(2))
+        self._reply(200, json.dumps({
+            "columns": ["id", "a \"quoted\"\nlabel"],
+            "rows": [[idx, "row %d" % idx] for idx in range(first, first + count)]
+        }).encode("UTF-8"))
+
+
+class ParallelJobsTest(StubServerTestCase):
+    handler = NumberedRowsHandler
+
+    def run_files(self, export_file: str, *args) -> bytes:
+        files = [
+            self.write("a.sql", ["SELECT ROWS 2 FROM 1;", "\\g", "CREATE TABLE a (id int);", "\\g"]),
+            self.write("b.sql", ["CREATE TABLE b (id int);", "\\g"]),
+            self.write("c.sql", ["SELECT ROWS 1 FROM 3;", "\\g", "SELECT ROWS 2 FROM 4;", "\\g"])
+        ]
+        self.run_monitor(["-c", self.credentials()] + [arg for file_name in files for arg in ["-i", file_name]] +
+                         ["--export", self.path(export_file)] + list(args))
+        with open(self.path(export_file), "rb") as f:
+            return f.read()
+
+    def test_csv_export_matches_a_sequential_run(self):
+        sequential = self.run_files("sequential.csv")
+        self.assertEqual(sequential.count(b"label"), 1)
+        self.assertEqual(self.run_files("parallel.csv", "-j", "2"), sequential)
+
+    def test_jsonl_export_matches_a_sequential_run(self):
+        sequential = self.run_files("sequential.jsonl")
+        self.assertEqual(len(sequential.splitlines()), 5)
+        self.assertEqual(self.run_files("parallel.jsonl", "-j", "2"), sequential)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,47 @@
+"""
+Checks what happens when a persistent psql session (--persistent-psql) cannot be started
+
+    python -m pytest tests
+"""
+import io
+import unittest
+from contextlib import redirect_stdout, redirect_stderr
+from unittest import mock
+
+from monitor.main import State, JAAQLMonitorException, get_psql_session
+
+
+class DeadSession:
+    def is_alive(self):
+        return False
+
+
+class PsqlSessionStartTest(unittest.TestCase):
+    KEY = ("jaaql_container", "dba", "postgres")
+
+    def start_session(self, state: State):
+        err = io.StringIO()
+        with mock.patch("subprocess.Popen", side_effect=FileNotFoundError("docker not found")), \
+                redirect_stdout(io.StringIO()), redirect_stderr(err):
+            try:
+                return get_psql_session(state, "jaaql_container", "postgres", "dba")
+            finally:
+                self.assertIn("Error starting psql session: docker not found", err.getvalue())
+
+    def test_failure_is_reported_and_no_session_is_returned(self):
+        state = State()
+        state.do_exit = False
+        state.psql_sessions[self.KEY] = DeadSession()  # The last session, which has since exited
+        self.assertIsNone(self.start_session(state))
+        self.assertEqual(state.psql_sessions, {})
+
+    def test_failure_stops_a_script(self):
+        state = State()
+        state.do_exit = False
+        state.file_name = "script.sql"
+        with self.assertRaises(JAAQLMonitorException):
+            self.start_session(state)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,117 @@
+"""
+Checks QueryResult, the columnar form results are held in, and that a decoded result is laid out as one table while a
+streamed one too large to measure at once is laid out a page at a time
+
+    python -m pytest tests
+"""
+import io
+import json
+import unittest
+from array import array
+from contextlib import redirect_stdout
+from unittest import mock
+
+from monitor.main import JSONResultStream, QueryResult, State, format_query_output, format_streamed_query_output, ROWS_MAX
+
+
+class QueryResultTest(unittest.TestCase):
+    def test_numeric_columns_are_typed_arrays(self):
+        result = QueryResult.from_rows(["i", "f", "s"], [[1, 1.5, "a"], [2, 2.5, "b"]])
+        self.assertIsInstance(result._data[0], array)
+        self.assertEqual(result._data[0].typecode, "q")
+        self.assertEqual(result._data[1].typecode, "d")
+        self.assertEqual(result._data[2], ["a", "b"])
+        self.assertEqual(result.column_types, [int, float, str])
+
+    def test_columns_fall_back_to_lists(self):
+        # A null, a value of another type, a bool and an int too large for an array all keep the column as a list
+        result = QueryResult.from_rows(["null", "mixed", "bool", "big"], [[1, 1, 1, 1], [None, "x", True, 2 ** 70]])
+        for col_idx in range(4):
+            self.assertIsInstance(result._data[col_idx], list)
+        self.assertEqual(list(result.iter_rows()), [[1, 1, 1, 1], [None, "x", True, 2 ** 70]])
+        self.assertIs(result.row(1)[2], True)
+
+    def test_rows_must_have_one_value_per_column(self):
+        with self.assertRaises(ValueError):
+            QueryResult.from_rows(["a", "b"], [[1, 2], [3]])
+
+    def test_slices_share_the_columns(self):
+        rows = [[idx, "row %d" % idx] for idx in range(10)]
+        result = QueryResult.from_rows(["n", "s"], rows)
+        sliced = result[2:8][1:4]
+        self.assertIs(sliced._data, result._data)
+        self.assertEqual(len(sliced), 3)
+        self.assertEqual(list(sliced.iter_rows()), rows[3:6])
+        self.assertEqual(sliced.row(0), rows[3])
+        self.assertEqual(list(sliced.column(0)), [3, 4, 5])
+        self.assertIsInstance(sliced.column(0), memoryview)
+        self.assertIs(sliced.column(0).obj, result._data[0])
+        self.assertEqual(sliced.to_dicts(), [{"n": 3, "s": "row 3"}, {"n": 4, "s": "row 4"}, {"n": 5, "s": "row 5"}])
+
+    def test_slices_past_the_end_are_empty(self):
+        result = QueryResult.from_rows(["n"], [[1], [2]])
+        self.assertEqual(len(result[5:9]), 0)
+        self.assertEqual(list(result[5:9].iter_rows()), [])
+        self.assertEqual(len(result[1:0]), 0)
+
+    def test_results_without_columns(self):
+        result = QueryResult.from_rows([], [[], []])
+        self.assertEqual(len(result), 2)
+        self.assertEqual(list(result.iter_rows()), [[], []])
+
+
+class FormatQueryOutputTest(unittest.TestCase):
+    def format(self, num_rows: int, file_name: str = None, streamed: bool = False) -> str:
+        state = State()
+        state.is_verbose = True
+        state.file_name = file_name
+        json_output = {"columns": ["n", "s"], "rows": [[idx, "row %d" % idx] for idx in range(num_rows)]}
+        out = io.StringIO()
+        with redirect_stdout(out):
+            if streamed:
+                format_streamed_query_output(state, JSONResultStream([json.dumps(json_output)]).open())
+            else:
+                format_query_output(state, json_output)
+        return out.getvalue()
+
+    def test_interactive_output_is_truncated(self):
+        for streamed in [False, True]:
+            output = self.format(ROWS_MAX + 5, streamed=streamed)
+            self.assertIn("|row %d" % (ROWS_MAX - 1), output)
+            self.assertNotIn("|row %d" % ROWS_MAX, output)
+            self.assertIn("...", output)
+            self.assertTrue(output.rstrip().endswith("(%d rows)" % (ROWS_MAX + 5)))
+
+    def test_decoded_results_are_one_table(self):
+        with mock.patch("monitor.main.STREAM__page_rows", 4):
+            output = self.format(12, file_name="script.sql")
+        self.assertEqual(output.count("|n |"), 1)
+        self.assertEqual(len(set(len(line) for line in output.splitlines() if line.startswith("|"))), 1)  # One set of widths
+        self.assertTrue(output.rstrip().endswith("(12 rows)"))
+
+    def test_streamed_results_are_laid_out_a_page_at_a_time(self):
+        built = []
+        from_rows = QueryResult.from_rows
+
+        def recording_from_rows(columns, rows):
+            result = from_rows(columns, rows)
+            built.append(len(result))
+            return result
+
+        with mock.patch("monitor.main.STREAM__page_rows", 4), mock.patch.object(QueryResult, "from_rows", recording_from_rows):
+            output = self.format(12, file_name="script.sql", streamed=True)
+        self.assertLessEqual(max(built), 4)
+        self.assertEqual(output.count("|n"), 3)  # A header per page
+        for idx in range(12):
+            self.assertIn("|row %d" % idx, output)
+        self.assertTrue(output.rstrip().endswith("(12 rows)"))
+
+    def test_small_results_are_one_table(self):
+        for streamed in [False, True]:
+            output = self.format(3, file_name="script.sql", streamed=streamed)
+            self.assertEqual(output.count("|n|"), 1)
+            self.assertTrue(output.rstrip().endswith("(3 rows)"))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,26 @@
+"""
+Fails when importing monitor.main, as every run of the monitor does, goes over the startup budget, or when a module that
+only some runs need is imported at startup again. benchmarks/bench_startup.py reports the same measurements in detail
+
+    python -m pytest tests
+"""
+import unittest
+
+from tests.startup import DEFAULT_BUDGET_MS, DEFERRED_MODULES, RUNS, measure_startup
+
+
+class StartupBudgetTest(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.median_ms, cls.import_times = measure_startup()
+
+    def test_import_is_within_budget(self):
+        self.assertLessEqual(self.median_ms, DEFAULT_BUDGET_MS,
+                             "import monitor.main took %.1fms, the median of %d, over the %dms budget" % (self.median_ms, RUNS, DEFAULT_BUDGET_MS))
+
+    def test_deferred_modules_are_not_imported_at_startup(self):
+        self.assertEqual([name for name in DEFERRED_MODULES if name in self.import_times], [])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,117 @@
+"""
+Checks the cross process oauth token cache (--token-cache): that tokens are refreshed before they expire, that a damaged
+or foreign cache file is treated as empty and replaced, and that the cache is readable by its owner only
+
+    python -m pytest tests
+"""
+import json
+import os
+import stat
+import tempfile
+import time
+import unittest
+
+from tests.stub_jaaql import StubJAAQLServer
+from monitor.main import ConnectionInfo, ENDPOINT__oauth, HEADER__security, State, TOKEN__refresh_margin_seconds, get_token_cache_key, \
+    read_token_cache, write_token_cache_entry
+
+
+class TokenCacheFileTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.cache_file = os.path.join(self.directory.name, "jaaql-monitor", "oauth-tokens.json")
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def write_raw(self, content: str):
+        os.makedirs(os.path.dirname(self.cache_file), exist_ok=True)
+        with open(self.cache_file, "w", encoding="utf-8") as f:
+            f.write(content)
+
+    def test_entries_are_read_back(self):
+        expires = time.time() + 600
+        write_token_cache_entry(self.cache_file, "a", "token a", expires)
+        write_token_cache_entry(self.cache_file, "b", "token b", expires)
+        self.assertEqual(read_token_cache(self.cache_file), {"a": {"token": "token a", "expires": expires},
+                                                             "b": {"token": "token b", "expires": expires}})
+
+    def test_expired_entries_are_dropped_on_write(self):
+        write_token_cache_entry(self.cache_file, "old", "token old", time.time() - 1)
+        write_token_cache_entry(self.cache_file, "new", "token new", time.time() + 600)
+        self.assertEqual(list(read_token_cache(self.cache_file).keys()), ["new"])
+
+    def test_missing_file_is_empty(self):
+        self.assertEqual(read_token_cache(self.cache_file), {})
+
+    def test_damaged_file_is_empty_and_replaced(self):
+        for content in ["{not json", "", "[1, 2]", "null", '"token"']:
+            self.write_raw(content)
+            self.assertEqual(read_token_cache(self.cache_file), {}, content)
+            write_token_cache_entry(self.cache_file, "a", "token a", time.time() + 600)
+            self.assertEqual(list(read_token_cache(self.cache_file).keys()), ["a"], content)
+
+    def test_entries_of_the_wrong_shape_are_ignored(self):
+        expires = time.time() + 600
+        self.write_raw(json.dumps({
+            "good": {"token": "token", "expires": expires},
+            "not an object": "token",
+            "no token": {"expires": expires},
+            "token not a string": {"token": 1, "expires": expires},
+            "no expiry": {"token": "token"},
+            "expiry not a number": {"token": "token", "expires": "soon"},
+            "expiry a bool": {"token": "token", "expires": True}
+        }))
+        self.assertEqual(list(read_token_cache(self.cache_file).keys()), ["good"])
+        write_token_cache_entry(self.cache_file, "new", "token new", expires)
+        self.assertEqual(sorted(read_token_cache(self.cache_file).keys()), ["good", "new"])
+
+    @unittest.skipIf(os.name == "nt", "POSIX permissions")
+    def test_only_the_owner_can_read_the_cache(self):
+        write_token_cache_entry(self.cache_file, "a", "token a", time.time() + 600)
+        self.assertEqual(stat.S_IMODE(os.stat(self.cache_file).st_mode), 0o600)
+        self.assertEqual(stat.S_IMODE(os.stat(os.path.dirname(self.cache_file)).st_mode) & 0o077, 0)
+        self.assertEqual([name for name in os.listdir(os.path.dirname(self.cache_file)) if name.endswith(".tmp")], [])
+
+
+class TokenCacheRefreshTest(unittest.TestCase):
+    def setUp(self):
+        self.server = StubJAAQLServer().start()
+        self.directory = tempfile.TemporaryDirectory()
+        self.state = State()
+        self.state.do_exit = False
+        self.state.token_cache_file = os.path.join(self.directory.name, "oauth-tokens.json")
+        self.conn = ConnectionInfo(self.server.url, "dba", "password", None)
+        self.state.set_current_connection(self.conn)
+
+    def tearDown(self):
+        self.state.close_http_sessions()
+        self.server.stop()
+        self.directory.cleanup()
+
+    def authenticate_with_cached(self, expires_in: float) -> str:
+        write_token_cache_entry(self.state.token_cache_file, get_token_cache_key(self.conn), "cached", time.time() + expires_in)
+        self.state.authenticate(self.conn)
+        return self.conn.oauth_token[HEADER__security]
+
+    def test_cached_token_is_used_outside_the_margin(self):
+        self.assertEqual(self.authenticate_with_cached(TOKEN__refresh_margin_seconds + 60), "cached")
+        self.assertEqual(self.server.total_requests(), 0)
+
+    def test_cached_token_within_the_margin_is_refreshed_and_cached(self):
+        token = self.authenticate_with_cached(TOKEN__refresh_margin_seconds - 1)
+        self.assertNotEqual(token, "cached")
+        self.assertEqual(self.server.requests[ENDPOINT__oauth], 1)
+        self.assertEqual(read_token_cache(self.state.token_cache_file)[get_token_cache_key(self.conn)]["token"], token)
+
+    def test_token_about_to_expire_is_refreshed_before_use(self):
+        self.state.token_cache_file = None
+        self.conn.oauth_token = {HEADER__security: "held"}
+        self.conn.oauth_token_expires = time.time() + TOKEN__refresh_margin_seconds - 1
+        self.state.authenticate(self.conn)
+        self.assertNotEqual(self.conn.oauth_token[HEADER__security], "held")
+        self.assertGreater(self.conn.oauth_token_expires, time.time() + TOKEN__refresh_margin_seconds)
+
+
+if __name__ == "__main__":
+    unittest.main()
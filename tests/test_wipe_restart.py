@@ -0,0 +1,84 @@
+"""
+Runs \\wipe dbms against the stand-in JAAQL server in tests/stub_jaaql.py, its workers restarting after the wipe, checking
+how the monitor probes for them serving queries again: spaced out until a failure shows the restart has happened, then
+backing off whilst probes fail and confirming with quick successes. And that the wait is recorded in the --profile and
+--trace output
+
+    python -m pytest tests
+"""
+import json
+import unittest
+from unittest import mock
+
+from monitor.main import WAIT__healthy_poll_interval, WAIT__healthy_poll_max, WAIT__healthy_poll_min, WAIT__healthy_stable_checks
+from tests.stub_jaaql import StubJAAQLHandler
+from tests.support import StubServerTestCase
+
+
+class RestartingHandler(StubJAAQLHandler):
+    """
+    Answers the probes for the workers being back, SELECT 1 against postgres, with the statuses in server.probe_statuses
+    and then 200s
+    """
+
+    def submit(self, request: dict):
+        stub = self.server.stub
+        if request.get("query") != "SELECT 1" or request.get("database") != "postgres":
+            return super().submit(request)
+        status = stub.probe_statuses.pop(0) if len(stub.probe_statuses) != 0 else 200
+        self._reply(status, stub.result if status == 200 else b'{"message": "worker restarting"}')
+
+
+class WipeRestartTest(StubServerTestCase):
+    handler = RestartingHandler
+
+    def run_wipe(self, probe_statuses: list) -> list:
+        # Returns the seconds slept between probes, which are not actually slept
+        self.server.probe_statuses = probe_statuses
+        slept = []
+        script = self.write("script.sql", ["SELECT 'before';", "\\g", "\\wipe dbms", "SELECT 'after';", "\\g"])
+        with mock.patch("time.sleep", slept.append):
+            self.run_monitor(["-c", self.credentials(), "-i", script, "--profile-json", self.path("profile.json"),
+                              "--trace", self.path("trace.json")])
+        return slept
+
+    def waits(self) -> list:
+        with open(self.path("profile.json"), "r", encoding="UTF-8") as f:
+            return json.load(f)["waits"]
+
+    def wait_span(self) -> dict:
+        with open(self.path("trace.json"), "r", encoding="UTF-8") as f:
+            return [event for event in json.load(f) if event.get("name") == "wait for restart"][0]["args"]
+
+    def test_probes_back_off_whilst_failing_once_the_restart_is_seen(self):
+        self.assertEqual(WAIT__healthy_stable_checks, 3)
+        slept = self.run_wipe([200, 500, 500, 500, 500])
+        self.assertEqual(slept, [
+            WAIT__healthy_poll_interval,  # A success before any failure may still be the old worker
+            WAIT__healthy_poll_min,  # The restart has been seen
+            WAIT__healthy_poll_min * 2,
+            WAIT__healthy_poll_max,
+            WAIT__healthy_poll_max,
+            WAIT__healthy_poll_min,  # Back, confirmed with quick successes
+            WAIT__healthy_poll_min
+        ])
+        self.assertEqual(len(self.waits()), 1)
+        self.assertEqual({key: self.waits()[0][key] for key in ["file", "line", "probes", "restart_seen"]},
+                         {"file": self.path("script.sql"), "line": 3, "probes": 8, "restart_seen": True})
+        self.assertEqual({key: self.wait_span()[key] for key in ["probes", "restart_seen"]}, {"probes": 8, "restart_seen": True})
+
+    def test_probes_stay_spaced_out_until_the_restart_is_seen(self):
+        slept = self.run_wipe([])
+        self.assertEqual(slept, [WAIT__healthy_poll_interval] * (WAIT__healthy_stable_checks - 1))
+        self.assertEqual({key: self.waits()[0][key] for key in ["probes", "restart_seen"]},
+                         {"probes": WAIT__healthy_stable_checks, "restart_seen": False})
+
+    def test_a_failure_between_successes_starts_the_count_again(self):
+        slept = self.run_wipe([200, 200, 500])
+        self.assertEqual(slept, [WAIT__healthy_poll_interval, WAIT__healthy_poll_interval, WAIT__healthy_poll_min,
+                                 WAIT__healthy_poll_min, WAIT__healthy_poll_min])
+        self.assertEqual(self.waits()[0]["probes"], 6)
+
+
+if __name__ == "__main__":
+    unittest.main()